@@ -1,6 +1,13 @@
 """mLLMCelltype: A Python module for cell type annotation using various LLMs."""
 
-from .annotate import annotate_clusters, batch_annotate_clusters, get_model_response
+from .annotate import (
+    OutputBudget,
+    annotate_clusters,
+    batch_annotate_clusters,
+    get_model_response,
+    plan_annotation_chunks,
+    plan_output_budget,
+)
 from .compare import (
     analyze_confusion_patterns,
     compare_model_predictions,
@@ -20,23 +27,63 @@ from .functions import (
     select_best_prediction,
 )
 from .logger import setup_logging, write_log
+from .metrics import (
+    JsonlMetricsExporter,
+    MetricEvent,
+    MetricsCollector,
+    add_metrics_hook,
+    remove_metrics_hook,
+)
+from .ontology import CellTypeOntology, load_ontology
+from .planner import MODEL_PRICES, plan_batch_run, plan_consensus_run
 from .prompts import (
+    create_batch_consensus_check_prompt,
+    create_batch_discussion_prompt,
     create_batch_prompt,
     create_consensus_check_prompt,
     create_discussion_prompt,
     create_initial_discussion_prompt,
     create_json_prompt,
     create_prompt,
+    split_cacheable_prefix,
+)
+from .retry import (
+    CancellationToken,
+    DeadlineExceeded,
+    RetryPolicy,
+    configure_retry,
+    get_retry_budget,
+)
+from .router import (
+    CircuitBreaker,
+    CircuitOpenError,
+    HedgingPolicy,
+    ProviderStats,
+    RoutingConstraints,
+    configure_router,
+    get_circuit_breaker,
+    get_provider_stats,
+    rank_models,
+    summarize_prompt_cache,
 )
+from .tracing import Span, Tracer, set_tracer, start_span, tracing
 from .utils import (
+    canonicalize_markers,
     clean_annotation,
     clear_cache,
+    compact_marker_genes,
     create_cache_key,
+    deduplicate_marker_sets,
+    estimate_tokens,
+    expand_deduplicated_annotations,
+    extract_annotation_confidence,
     find_agreement,
+    find_unparsed_clusters,
     format_results,
     get_cache_stats,
     load_api_key,
     load_from_cache,
+    normalize_annotation,
     save_to_cache,
     validate_cache,
 )
@@ -48,11 +95,51 @@ __all__ = [
     "annotate_clusters",
     "batch_annotate_clusters",
     "get_model_response",
+    "plan_annotation_chunks",
+    "plan_output_budget",
+    "OutputBudget",
     # Functions
     "get_provider",
     "clean_annotation",
+    "normalize_annotation",
     "identify_controversial_clusters",
     "select_best_prediction",
+    # Ontology
+    "CellTypeOntology",
+    "load_ontology",
+    # Metrics
+    "MetricEvent",
+    "MetricsCollector",
+    "JsonlMetricsExporter",
+    "add_metrics_hook",
+    "remove_metrics_hook",
+    # Tracing
+    "Span",
+    "Tracer",
+    "set_tracer",
+    "start_span",
+    "tracing",
+    # Dry-run planning
+    "MODEL_PRICES",
+    "plan_batch_run",
+    "plan_consensus_run",
+    # Retries and cancellation
+    "CancellationToken",
+    "DeadlineExceeded",
+    "RetryPolicy",
+    "configure_retry",
+    "get_retry_budget",
+    # Routing
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "HedgingPolicy",
+    "ProviderStats",
+    "RoutingConstraints",
+    "configure_router",
+    "get_circuit_breaker",
+    "get_provider_stats",
+    "rank_models",
+    "summarize_prompt_cache",
     # Logging
     "setup_logging",
     "write_log",
@@ -65,14 +152,24 @@ __all__ = [
     "clear_cache",
     "get_cache_stats",
     "format_results",
+    "canonicalize_markers",
+    "deduplicate_marker_sets",
+    "expand_deduplicated_annotations",
+    "compact_marker_genes",
+    "find_unparsed_clusters",
     "find_agreement",
+    "estimate_tokens",
+    "extract_annotation_confidence",
     # Prompts
     "create_prompt",
     "create_batch_prompt",
     "create_json_prompt",
     "create_discussion_prompt",
     "create_consensus_check_prompt",
+    "create_batch_consensus_check_prompt",
+    "create_batch_discussion_prompt",
     "create_initial_discussion_prompt",
+    "split_cacheable_prefix",
     # Consensus
     "check_consensus",
     "process_controversial_clusters",
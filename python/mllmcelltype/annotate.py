@@ -2,13 +2,20 @@
 
 from __future__ import annotations
 
+import functools
+import json
+import math
+import re
 import time
-from typing import Optional, Union
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Optional, Union
 
 import pandas as pd
 
 from .logger import setup_logging, write_log
-from .prompts import create_batch_prompt, create_prompt
+from .metrics import MetricEvent, emit_metric, metrics_enabled
+from .prompts import DEFAULT_JSON_PROMPT_TEMPLATE, create_batch_prompt, create_prompt
 from .providers import (
     process_anthropic,
     process_deepseek,
@@ -21,8 +28,27 @@ from .providers import (
     process_stepfun,
     process_zhipu,
 )
+from .retry import CancellationToken, DeadlineExceeded, call_with_retry, run_cancellable
+from .router import (
+    CircuitOpenError,
+    HedgingPolicy,
+    get_circuit_breaker,
+    get_hedging_policy,
+    get_provider_stats,
+    read_usage_tokens,
+)
+from .tracing import in_current_span, start_span
 from .utils import (
+    CONFIDENCE_LEVELS,
+    _parse_json_response,
+    clean_annotation,
+    compact_marker_genes,
     create_cache_key,
+    deduplicate_marker_sets,
+    estimate_tokens,
+    expand_deduplicated_annotations,
+    extract_annotation_confidence,
+    find_unparsed_clusters,
     format_results,
     load_api_key,
     load_from_cache,
@@ -44,6 +70,202 @@ PROVIDER_FUNCTIONS = {
     "openrouter": process_openrouter,
 }
 
+# Output token limit of one response per provider
+MAX_OUTPUT_TOKENS = {"anthropic": 4000, "gemini": 4096}
+DEFAULT_MAX_OUTPUT_TOKENS = 4096
+
+# Share of the output limit a chunk is planned to fill, leaving room for verbose answers
+CHUNK_OUTPUT_SHARE = 0.5
+
+# Estimated answer tokens per cluster for line and JSON prompts
+CHUNK_ANSWER_TOKENS = 12
+CHUNK_JSON_ANSWER_TOKENS = 40
+
+# Fast mode output budget: headroom over the estimated answer, plus a fixed allowance
+OUTPUT_HEADROOM = 1.5
+OUTPUT_BASE_TOKENS = 32
+
+# Stop sequences that end a line-format answer once the model starts explaining it
+LINE_STOP_SEQUENCES = ["\nNote:", "\nExplanation:", "\nReasoning:", "\n**Note"]
+
+# Most stop sequences a provider accepts in one request; others take them all
+MAX_STOP_SEQUENCES = {"openai": 4, "zhipu": 1}
+
+# Models whose hidden reasoning counts towards the output limit get no tight budget
+# (nor stop sequences, which several of them reject). Matched against the model
+# name without a routing prefix such as 'deepseek/'
+REASONING_MODEL_PREFIXES = (
+    "o1",
+    "o3",
+    "o4",
+    "gpt-5",
+    "deepseek-reasoner",
+    "deepseek-r1",
+    "gemini-2.5",
+    "grok-3-mini",
+    "grok-4",
+    "qwq",
+    "glm-z1",
+)
+
+# Share of the budget a response must use to be treated as cut off
+TRUNCATION_SHARE = 0.75
+
+# Follow-up requests made for the clusters a cut off response did not reach
+MAX_CONTINUATIONS = 2
+
+
+@dataclass
+class OutputBudget:
+    """Output limits sent with one annotation request.
+
+    max_tokens is passed to the provider as its output token limit, and stop as
+    its stop sequences (None sends none). num_clusters and json_output record
+    what the budget was planned for, so it can be planned again when a request
+    fails over or is hedged to another model.
+    """
+
+    max_tokens: int
+    stop: Optional[list[str]] = None
+    num_clusters: Optional[int] = None
+    json_output: bool = False
+
+
+def _is_reasoning_model(model: str) -> bool:
+    """Check whether a model spends output tokens on hidden reasoning.
+
+    Args:
+        model: Model name, optionally with a routing prefix such as 'openai/'
+
+    Returns:
+        bool: True if the model matches REASONING_MODEL_PREFIXES
+
+    """
+    return model.lower().rsplit("/", 1)[-1].startswith(REASONING_MODEL_PREFIXES)
+
+
+def plan_output_budget(
+    num_clusters: int,
+    provider: str,
+    model: str,
+    max_output_tokens: Optional[int] = None,
+    json_output: bool = False,
+) -> Optional[OutputBudget]:
+    """Plan the output limits of a fast mode annotation request.
+
+    The limit covers the estimated answer for num_clusters clusters with
+    OUTPUT_HEADROOM to spare, so a model that starts explaining its answers is
+    cut off early. Line-format answers also get as many of LINE_STOP_SEQUENCES
+    as the provider accepts (see MAX_STOP_SEQUENCES).
+
+    Args:
+        num_clusters: Number of clusters in the request
+        provider: LLM provider
+        model: Model name
+        max_output_tokens: Output token limit of one response. If None, uses the
+            provider's limit from MAX_OUTPUT_TOKENS
+        json_output: Whether the prompt asks for a JSON answer
+
+    Returns:
+        Optional[OutputBudget]: The planned limits, or None for reasoning models,
+            whose hidden reasoning would be starved by a tight limit
+
+    """
+    if _is_reasoning_model(model):
+        return None
+    if max_output_tokens is None:
+        max_output_tokens = MAX_OUTPUT_TOKENS.get(provider.lower(), DEFAULT_MAX_OUTPUT_TOKENS)
+    answer_tokens = CHUNK_JSON_ANSWER_TOKENS if json_output else CHUNK_ANSWER_TOKENS
+    max_tokens = OUTPUT_BASE_TOKENS + math.ceil(num_clusters * answer_tokens * OUTPUT_HEADROOM)
+    max_stop = MAX_STOP_SEQUENCES.get(provider.lower(), len(LINE_STOP_SEQUENCES))
+    return OutputBudget(
+        max_tokens=min(max_tokens, max_output_tokens),
+        stop=None if json_output or not max_stop else LINE_STOP_SEQUENCES[:max_stop],
+        num_clusters=num_clusters,
+        json_output=json_output,
+    )
+
+
+def _output_budget_for(
+    budget: Optional[OutputBudget], provider: str, model: str
+) -> Optional[OutputBudget]:
+    """Plan an output budget again for the model a request is actually sent to.
+
+    Fallback and hedge requests go to other models, which may be reasoning
+    models, have another output limit or accept fewer stop sequences.
+
+    Args:
+        budget: Budget planned for the original model, or None
+        provider: Provider of the target model
+        model: Target model name
+
+    Returns:
+        Optional[OutputBudget]: The budget for the target model. Budgets that do
+            not record their cluster count are returned unchanged.
+
+    """
+    if budget is None or budget.num_clusters is None:
+        return budget
+    return plan_output_budget(budget.num_clusters, provider, model, json_output=budget.json_output)
+
+
+def _is_truncated(results: list[str], budget: OutputBudget) -> bool:
+    """Check whether a response was cut off at its output budget.
+
+    Uses the stop reason the provider reported. Responses without one, such as
+    those loaded from the cache, count as cut off if they used up most of the budget.
+    """
+    truncated = getattr(results, "truncated", None)
+    if truncated is not None:
+        return truncated
+    text = "\n".join(results) if isinstance(results, list) else str(results)
+    return estimate_tokens(text) >= budget.max_tokens * TRUNCATION_SHARE
+
+
+def plan_annotation_chunks(
+    clusters: list[str],
+    provider: str,
+    model: str,
+    max_output_tokens: Optional[int] = None,
+    json_output: bool = False,
+) -> list[list[str]]:
+    """Split clusters into chunks whose answers fit into one response of a model.
+
+    Each chunk is planned to use at most CHUNK_OUTPUT_SHARE of the model's output
+    token limit. Chunks only depend on that limit, so the same clusters keep the
+    same chunks, and cache keys, from run to run.
+
+    Args:
+        clusters: Cluster names in prompt order
+        provider: LLM provider
+        model: Model name
+        max_output_tokens: Output token limit of one response. If None, uses the
+            provider's limit from MAX_OUTPUT_TOKENS
+        json_output: Whether the prompt asks for a JSON answer
+
+    Returns:
+        list[list[str]]: Chunks of cluster names, in prompt order
+
+    """
+    if max_output_tokens is None:
+        max_output_tokens = MAX_OUTPUT_TOKENS.get(provider.lower(), DEFAULT_MAX_OUTPUT_TOKENS)
+    budget = max_output_tokens * CHUNK_OUTPUT_SHARE
+
+    answer_tokens = CHUNK_JSON_ANSWER_TOKENS if json_output else CHUNK_ANSWER_TOKENS
+    chunks: list[list[str]] = []
+    chunk: list[str] = []
+    used = 0
+    for cluster in clusters:
+        cost = estimate_tokens(f"Cluster {cluster}: ") + answer_tokens
+        if chunk and used + cost > budget:
+            chunks.append(chunk)
+            chunk, used = [], 0
+        chunk.append(cluster)
+        used += cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
 
 def annotate_clusters(
     marker_genes: Union[dict[str, list[str]], pd.DataFrame],
@@ -58,9 +280,46 @@ def annotate_clusters(
     cache_dir: Optional[str] = None,
     log_dir: Optional[str] = None,
     log_level: str = "INFO",
+    escalation_model: Optional[str] = None,
+    escalation_provider: Optional[str] = None,
+    escalation_api_key: Optional[str] = None,
+    min_confidence: str = "high",
+    fallback_model: Optional[str] = None,
+    fallback_provider: Optional[str] = None,
+    fallback_api_key: Optional[str] = None,
+    cancel_token: Optional[CancellationToken] = None,
+    max_output_tokens: Optional[int] = None,
+    max_parallel_chunks: int = 4,
+    repair_unparsed: bool = True,
+    rank_by: Optional[str] = None,
+    max_marker_tokens: Optional[int] = None,
+    compaction_stats: Optional[dict[str, int]] = None,
+    fast_mode: bool = False,
 ) -> dict[str, str]:
     """Annotate cell clusters using LLM.
 
+    If escalation_model is given, the annotation runs as a cascade: the model
+    given by provider/model annotates all clusters with a JSON prompt that
+    reports confidence, and only clusters below min_confidence or annotated as
+    'Unknown' are sent to the escalation model.
+
+    If fallback_model is given, the prompt is sent to it whenever the request to
+    the primary model fails, including when the primary model's circuit breaker
+    is open.
+
+    Large cluster sets are split into chunks that fit into one response of the
+    model (see plan_annotation_chunks). The chunks are sent in parallel and their
+    answers merged. Clusters whose annotation could not be reliably read from
+    the response are re-requested once in a small follow-up prompt.
+
+    With max_marker_tokens, the marker lists of every request are cut to the top
+    ranked genes that fit the budget (see compact_marker_genes).
+
+    In fast mode, the prompt asks for the annotations without any rationale and
+    each request carries an output token limit and stop sequences sized to its
+    clusters (see plan_output_budget). If a line-format response uses up its
+    limit, the clusters it did not reach are requested again.
+
     Args:
         marker_genes: Dictionary mapping cluster names to lists of marker genes,
                      or DataFrame with 'cluster' and 'gene' columns
@@ -75,6 +334,30 @@ def annotate_clusters(
         cache_dir: Directory to store cache files
         log_dir: Directory to store log files
         log_level: Logging level
+        escalation_model: Stronger model that re-annotates low-confidence clusters
+        escalation_provider: Provider of the escalation model. If None, inferred from
+            the model name
+        escalation_api_key: API key for the escalation provider
+        min_confidence: Lowest confidence level ('low', 'medium', 'high') accepted
+            from the first model without escalation
+        fallback_model: Substitute model used when the primary model fails
+        fallback_provider: Provider of the fallback model. If None, inferred from
+            the model name
+        fallback_api_key: API key for the fallback provider
+        cancel_token: Optional cancellation token of the run. Once it is cancelled,
+            pending requests are abandoned and DeadlineExceeded is raised.
+        max_output_tokens: Output token limit of one response, used to size chunks.
+            If None, uses the provider's limit
+        max_parallel_chunks: Maximum number of chunk requests sent at the same time
+        repair_unparsed: Whether to re-request clusters whose annotation is missing
+            or unreadable (see find_unparsed_clusters)
+        rank_by: Column of a marker genes DataFrame to rank the genes of each
+            cluster by, e.g. 'avg_log2FC' or 'p_val_adj'. Dictionaries are taken
+            as already ranked
+        max_marker_tokens: Optional token budget for the marker genes of one request
+        compaction_stats: Optional dictionary that is filled with the number of
+            marker genes dropped per truncated cluster
+        fast_mode: Whether to ask for bare annotations under a tight output budget
 
     Returns:
         Dict[str, str]: Dictionary mapping cluster names to annotations
@@ -86,7 +369,7 @@ def annotate_clusters(
 
     # Parse marker genes if DataFrame
     if isinstance(marker_genes, pd.DataFrame):
-        marker_genes = parse_marker_genes(marker_genes)
+        marker_genes = parse_marker_genes(marker_genes, rank_by=rank_by)
 
     # Get clusters
     clusters = list(marker_genes.keys())
@@ -105,22 +388,287 @@ def annotate_clusters(
             write_log(f"ERROR: {error_msg}", level="error")
             raise ValueError(error_msg)
 
-    # Create prompt
+    if escalation_model and min_confidence not in CONFIDENCE_LEVELS:
+        raise ValueError(
+            f"min_confidence must be one of {list(CONFIDENCE_LEVELS)}, got: {min_confidence}"
+        )
+
+    # Cascade mode needs the JSON format that reports confidence
+    if escalation_model and not prompt_template:
+        prompt_template = DEFAULT_JSON_PROMPT_TEMPLATE
+
+    json_output = prompt_template == DEFAULT_JSON_PROMPT_TEMPLATE
+
+    def send(prompt: str, budget: Optional[OutputBudget]) -> list[str]:
+        try:
+            return _request_annotations(
+                prompt,
+                provider,
+                model,
+                api_key,
+                use_cache,
+                cache_dir,
+                cancel_token,
+                output_budget=budget,
+            )
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if not fallback_model:
+                raise
+            write_log(
+                f"Request to {model} failed ({str(e)}), failing over to {fallback_model}",
+                level="warning",
+            )
+            return _request_annotations(
+                prompt,
+                fallback_provider,
+                fallback_model,
+                fallback_api_key,
+                use_cache,
+                cache_dir,
+                cancel_token,
+                output_budget=_output_budget_for(budget, fallback_provider, fallback_model),
+            )
+
+    def request_chunk(chunk: list[str], continuations: int = MAX_CONTINUATIONS) -> list[str]:
+        prompt, truncated = _render_annotation_prompt(
+            {cluster: marker_genes[cluster] for cluster in chunk},
+            species,
+            tissue,
+            additional_context,
+            prompt_template,
+            max_marker_tokens,
+            fast_mode,
+        )
+        if compaction_stats is not None:
+            compaction_stats.update(truncated)
+        budget = (
+            plan_output_budget(len(chunk), provider, model, max_output_tokens, json_output)
+            if fast_mode
+            else None
+        )
+        results = send(prompt, budget)
+        if budget is None or json_output or not _is_truncated(results, budget):
+            return results
+
+        # The last line of a cut off response may be incomplete
+        results = list(results[:-1])
+        answered = {
+            match.group(1)
+            for match in (re.match(r"\W*Cluster\s+([^:\s*]+)\W*:", line) for line in results)
+            if match
+        }
+        missing = [cluster for cluster in chunk if str(cluster) not in answered]
+        write_log(
+            f"Response for {len(chunk)} clusters used up its {budget.max_tokens} token limit, "
+            f"{len(missing)} clusters unanswered",
+            level="warning",
+        )
+        if missing and len(missing) < len(chunk) and continuations > 0:
+            results.extend(request_chunk(missing, continuations - 1))
+        return results
+
+    if fallback_model:
+        if not fallback_provider:
+            from .functions import get_provider
+
+            fallback_provider = get_provider(fallback_model)
+        fallback_api_key = fallback_api_key or load_api_key(fallback_provider)
+        if not fallback_api_key:
+            write_log(
+                f"ERROR: API key not found for fallback provider: {fallback_provider}",
+                level="error",
+            )
+            fallback_model = None
+
+    # Split large cluster sets so that every answer fits into one response
+    chunks = plan_annotation_chunks(
+        clusters,
+        provider,
+        model,
+        max_output_tokens=max_output_tokens,
+        json_output=json_output,
+    )
+    if len(chunks) > 1:
+        write_log(f"Splitting {len(clusters)} clusters into {len(chunks)} chunks")
+
+    if len(chunks) == 1:
+        chunk_results = [request_chunk(clusters)]
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_parallel_chunks, len(chunks)))) as pool:
+            chunk_results = list(pool.map(in_current_span(request_chunk), chunks))
+
+    annotations = {}
+    confidence = {}
+    unparsed = []
+    for chunk, results in zip(chunks, chunk_results):
+        chunk_annotations = format_results(results, chunk)
+        annotations.update(chunk_annotations)
+        unparsed.extend(find_unparsed_clusters(results, chunk_annotations, chunk))
+        if escalation_model:
+            confidence.update(extract_annotation_confidence(results))
+
+    # Re-request only the clusters that could not be read from the response
+    if unparsed and repair_unparsed:
+        write_log(f"Re-requesting {len(unparsed)} unparsed clusters: {', '.join(unparsed)}")
+        try:
+            results = request_chunk(unparsed)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            write_log(f"Repair request failed: {str(e)}", level="warning")
+        else:
+            repaired = format_results(results, unparsed)
+            still_unparsed = set(find_unparsed_clusters(results, repaired, unparsed))
+            for cluster in unparsed:
+                if cluster not in still_unparsed:
+                    annotations[cluster] = repaired[cluster]
+            if escalation_model:
+                repaired_confidence = extract_annotation_confidence(results)
+                for cluster in unparsed:
+                    if cluster in repaired_confidence and cluster not in still_unparsed:
+                        confidence[cluster] = repaired_confidence[cluster]
+            write_log(
+                f"Repaired {len(unparsed) - len(still_unparsed)} of {len(unparsed)} "
+                "unparsed clusters"
+            )
+
+    if not escalation_model:
+        return annotations
+
+    # Escalate clusters the first model is unsure about
+    threshold = CONFIDENCE_LEVELS[min_confidence]
+    escalated = []
+    for cluster in clusters:
+        annotation = clean_annotation(annotations.get(str(cluster), "")).lower()
+        is_unknown = not annotation or annotation.startswith("unknown")
+        if is_unknown or confidence.get(str(cluster), 0) < threshold:
+            escalated.append(cluster)
+    write_log(
+        f"Cascade: escalating {len(escalated)} of {len(clusters)} clusters "
+        f"from {model} to {escalation_model}"
+    )
+    if not escalated:
+        return annotations
+
+    if not escalation_provider:
+        from .functions import get_provider
+
+        escalation_provider = get_provider(escalation_model)
+
+    escalated_annotations = annotate_clusters(
+        marker_genes={cluster: marker_genes[cluster] for cluster in escalated},
+        species=species,
+        provider=escalation_provider,
+        model=escalation_model,
+        api_key=escalation_api_key,
+        tissue=tissue,
+        additional_context=additional_context,
+        prompt_template=prompt_template,
+        use_cache=use_cache,
+        cache_dir=cache_dir,
+        log_dir=log_dir,
+        log_level=log_level,
+        fallback_model=fallback_model,
+        fallback_provider=fallback_provider,
+        fallback_api_key=fallback_api_key,
+        cancel_token=cancel_token,
+        max_output_tokens=max_output_tokens,
+        max_parallel_chunks=max_parallel_chunks,
+        repair_unparsed=repair_unparsed,
+        max_marker_tokens=max_marker_tokens,
+        compaction_stats=compaction_stats,
+        fast_mode=fast_mode,
+    )
+
+    # Merge, keeping the first answer where the escalation model gave none
+    for cluster_id, annotation in escalated_annotations.items():
+        if clean_annotation(annotation):
+            annotations[cluster_id] = annotation
+
+    return annotations
+
+
+def _report_cache_access(provider: str, model: str, hit: bool) -> None:
+    """Emit a metrics event for a lookup in the disk cache."""
+    if metrics_enabled():
+        emit_metric(MetricEvent("cache", provider, model, cache_tier="disk", cache_hit=hit))
+
+
+def _render_annotation_prompt(
+    marker_genes: dict[str, list[str]],
+    species: str,
+    tissue: Optional[str] = None,
+    additional_context: Optional[str] = None,
+    prompt_template: Optional[str] = None,
+    max_marker_tokens: Optional[int] = None,
+    fast_mode: bool = False,
+) -> tuple[str, dict[str, int]]:
+    """Render the prompt of one annotation request as annotate_clusters sends it.
+
+    Args:
+        marker_genes: Dictionary mapping the clusters of the request to marker genes
+        species: Species name
+        tissue: Tissue name
+        additional_context: Additional context to include in the prompt
+        prompt_template: Custom prompt template
+        max_marker_tokens: Optional token budget for the marker genes
+        fast_mode: Whether to ask for the annotations without any rationale
+
+    Returns:
+        tuple[str, dict[str, int]]: The prompt and the number of marker genes
+            dropped per truncated cluster
+
+    """
+    truncated = {}
+    if max_marker_tokens is not None:
+        marker_genes, truncated = compact_marker_genes(marker_genes, max_marker_tokens)
     prompt = create_prompt(
         marker_genes=marker_genes,
         species=species,
         tissue=tissue,
         additional_context=additional_context,
         prompt_template=prompt_template,
+        fast_mode=fast_mode,
     )
+    return prompt, truncated
+
+
+def _request_annotations(
+    prompt: str,
+    provider: str,
+    model: str,
+    api_key: str,
+    use_cache: bool = True,
+    cache_dir: Optional[str] = None,
+    cancel_token: Optional[CancellationToken] = None,
+    output_budget: Optional[OutputBudget] = None,
+) -> list[str]:
+    """Send an annotation prompt to a provider, using the cache if enabled.
+
+    Args:
+        prompt: The prompt to send
+        provider: LLM provider
+        model: Model name
+        api_key: API key for the provider
+        use_cache: Whether to use cache
+        cache_dir: Directory to store cache files
+        cancel_token: Optional cancellation token of the run
+        output_budget: Optional output limits of the request
+
+    Returns:
+        list[str]: Raw response lines
 
+    """
     # Check cache
     if use_cache:
         cache_key = create_cache_key(prompt, model, provider)
         cached_results = load_from_cache(cache_key, cache_dir)
+        _report_cache_access(provider, model, bool(cached_results))
         if cached_results:
             write_log("Using cached results")
-            return format_results(cached_results, clusters)
+            return cached_results
 
     # Get provider function
     provider_func = PROVIDER_FUNCTIONS.get(provider.lower())
@@ -135,7 +683,15 @@ def annotate_clusters(
         start_time = time.time()
 
         # Call provider function
-        results = provider_func(prompt, model, api_key)
+        results = _call_provider(
+            provider_func,
+            prompt,
+            provider,
+            model,
+            api_key,
+            cancel_token=cancel_token,
+            output_budget=output_budget,
+        )
 
         end_time = time.time()
         write_log(f"Request processed in {end_time - start_time:.2f} seconds")
@@ -144,8 +700,7 @@ def annotate_clusters(
         if use_cache:
             save_to_cache(cache_key, results, cache_dir)
 
-        # Format results
-        return format_results(results, clusters)
+        return results
 
     except Exception as e:
         error_msg = f"Error during annotation: {str(e)}"
@@ -153,6 +708,178 @@ def annotate_clusters(
         raise
 
 
+def _batch_set_key(
+    marker_genes: dict[str, list[str]],
+    species: str,
+    tissue: Optional[str],
+    additional_context: Optional[str],
+    prompt_template: Optional[str],
+    provider: str,
+    model: str,
+) -> str:
+    """Create the cache key of one marker set in a batch.
+
+    Args:
+        marker_genes: Dictionary mapping cluster names to lists of marker genes
+        species: Species name
+        tissue: Tissue name of the set
+        additional_context: Additional context included in the prompt
+        prompt_template: Custom prompt template
+        provider: LLM provider
+        model: Model name
+
+    Returns:
+        str: The cache key
+
+    """
+    description = json.dumps(
+        {
+            "batch_set": {str(cluster): list(genes) for cluster, genes in marker_genes.items()},
+            "species": species,
+            "tissue": tissue,
+            "additional_context": additional_context,
+            "prompt_template": prompt_template,
+        },
+        sort_keys=True,
+    )
+    return create_cache_key(description, model, provider)
+
+
+def _parse_batch_response(results: list[str], num_sets: int) -> list[dict[str, str]]:
+    """Parse a batch response into per-set annotations.
+
+    Sets are matched by their 'Set N' header or JSON set index, so a set the
+    model skipped leaves an empty dictionary instead of shifting later sets.
+
+    Args:
+        results: Raw response lines
+        num_sets: Number of sets in the batch prompt
+
+    Returns:
+        list[dict[str, str]]: Annotations of each set, in prompt order
+
+    """
+    result_sets: list[dict[str, str]] = [{} for _ in range(num_sets)]
+
+    # The LLM response format is typically:
+    # Set 1:
+    # Cluster 1: T cells
+    # Cluster 2: B cells
+    # ...
+    #
+    # Set 2:
+    # ...
+    filtered_results = [line.strip() for line in results if line.strip()]
+    current_set = None
+    found = False
+    for line in filtered_results:
+        set_match = re.match(r"\**Set\s+(\d+)\**:?", line)
+        if set_match:
+            current_set = int(set_match.group(1)) - 1
+            continue
+        cluster_match = re.match(r"Cluster\s+([^:\s]+):\s*(.*)", line)
+        if cluster_match and current_set is not None and 0 <= current_set < num_sets:
+            result_sets[current_set][cluster_match.group(1)] = cluster_match.group(2).strip()
+            found = True
+
+    if found:
+        return result_sets
+
+    # Try to parse JSON format if present
+    try:
+        data = _parse_json_response(filtered_results)
+    except (json.JSONDecodeError, ValueError, TypeError):
+        write_log("Warning: Could not parse batch results", level="warning")
+        return result_sets
+
+    if isinstance(data, dict) and isinstance(data.get("sets"), list):
+        for index, set_data in enumerate(data["sets"][:num_sets]):
+            if isinstance(set_data, dict) and isinstance(set_data.get("clusters"), list):
+                for cluster in set_data["clusters"]:
+                    if isinstance(cluster, dict) and "id" in cluster and "cell_type" in cluster:
+                        result_sets[index][str(cluster["id"])] = cluster["cell_type"]
+    elif isinstance(data, dict) and isinstance(data.get("annotations"), list):
+        for annotation in data["annotations"]:
+            if not isinstance(annotation, dict) or not {"set", "cluster", "cell_type"} <= set(
+                annotation
+            ):
+                continue
+            try:
+                index = int(annotation["set"]) - 1
+            except (TypeError, ValueError):
+                continue
+            if 0 <= index < num_sets:
+                result_sets[index][str(annotation["cluster"])] = annotation["cell_type"]
+
+    return result_sets
+
+
+def _annotate_deduplicated_sets(
+    marker_genes_list: list[dict[str, list[str]]],
+    tissues: list[Optional[str]],
+    species: str,
+    provider: str,
+    model: str,
+    api_key: str,
+    additional_context: Optional[str],
+    use_cache: bool,
+    cache_dir: Optional[str],
+    log_dir: Optional[str],
+    log_level: str,
+    max_workers: int,
+    cancel_token: Optional[CancellationToken],
+    marker_top_n: Optional[int],
+) -> list[dict[str, str]]:
+    """Annotate every unique marker list of the sets once per tissue and fan out the results.
+
+    Args:
+        marker_genes_list: List of dictionaries mapping cluster names to lists of marker genes
+        tissues: Tissue name of each set
+        species: Species name
+        provider: LLM provider
+        model: Model name
+        api_key: API key for the provider
+        additional_context: Additional context to include in the prompt
+        use_cache: Whether to use cache
+        cache_dir: Directory to store cache files
+        log_dir: Directory to store log files
+        log_level: Logging level
+        max_workers: Maximum number of chunk requests sent at the same time
+        cancel_token: Optional cancellation token of the run
+        marker_top_n: Optional number of top markers compared and sent per cluster
+
+    Returns:
+        list[dict[str, str]]: Annotations of each set keyed by its own cluster names
+
+    """
+    results: list[dict[str, str]] = [{} for _ in marker_genes_list]
+    for group_tissue in dict.fromkeys(tissues):
+        indices = [index for index, set_tissue in enumerate(tissues) if set_tissue == group_tissue]
+        unique, mappings = deduplicate_marker_sets(
+            [marker_genes_list[index] for index in indices], top_n=marker_top_n
+        )
+        annotations = annotate_clusters(
+            marker_genes=unique,
+            species=species,
+            provider=provider,
+            model=model,
+            api_key=api_key,
+            tissue=group_tissue,
+            additional_context=additional_context,
+            use_cache=use_cache,
+            cache_dir=cache_dir,
+            log_dir=log_dir,
+            log_level=log_level,
+            cancel_token=cancel_token,
+            max_parallel_chunks=max_workers,
+        )
+        for index, set_annotations in zip(
+            indices, expand_deduplicated_annotations(annotations, mappings)
+        ):
+            results[index] = set_annotations
+    return results
+
+
 def batch_annotate_clusters(
     marker_genes_list: list[Union[dict[str, list[str]], pd.DataFrame]],
     species: str,
@@ -166,9 +893,23 @@ def batch_annotate_clusters(
     cache_dir: Optional[str] = None,
     log_dir: Optional[str] = None,
     log_level: str = "INFO",
+    max_workers: int = 4,
+    cancel_token: Optional[CancellationToken] = None,
+    deduplicate_clusters: bool = False,
+    marker_top_n: Optional[int] = None,
 ) -> list[dict[str, str]]:
     """Batch annotate multiple sets of cell clusters using LLM.
 
+    Identical marker sets with the same tissue are annotated once, and results are
+    cached per set, so adding a set to a batch only requests the new set. Sets that
+    are not cached are grouped by tissue into batch requests that fit into one
+    response of the model, and the requests run in parallel. A set the batch
+    response does not fully cover is annotated on its own with annotate_clusters.
+
+    With deduplicate_clusters, clusters of all sets with the same tissue whose
+    canonical marker lists match (see canonicalize_markers) are annotated once
+    through annotate_clusters, and the result is fanned out to every set.
+
     Args:
         marker_genes_list: List of dictionaries mapping cluster names to lists of
             marker genes, or list of DataFrames with 'cluster' and 'gene' columns
@@ -176,13 +917,19 @@ def batch_annotate_clusters(
         provider: LLM provider (e.g., 'openai', 'anthropic')
         model: Model name (e.g., 'gpt-4o', 'claude-3-opus-20240229')
         api_key: API key for the provider
-        tissue: Tissue name (e.g., 'brain', 'liver')
+        tissue: Tissue name (e.g., 'brain', 'liver'), or a list with one tissue per set
         additional_context: Additional context to include in the prompt
-        prompt_template: Custom prompt template
+        prompt_template: Custom batch prompt template
         use_cache: Whether to use cache
         cache_dir: Directory to store cache files
         log_dir: Directory to store log files
         log_level: Logging level
+        max_workers: Maximum number of batch requests sent at the same time
+        cancel_token: Optional cancellation token of the run
+        deduplicate_clusters: Whether to annotate each unique marker list across all
+            sets only once
+        marker_top_n: Optional number of top markers compared and sent per cluster
+            when deduplicate_clusters is set
 
     Returns:
         List[Dict[str, str]]: List of dictionaries mapping cluster names to annotations
@@ -199,10 +946,16 @@ def batch_annotate_clusters(
             parsed_marker_genes_list.append(parse_marker_genes(marker_genes))
         else:
             parsed_marker_genes_list.append(marker_genes)
+    write_log(f"Found {len(parsed_marker_genes_list)} sets of clusters")
 
-    # Get clusters for each set
-    clusters_list = [list(marker_genes.keys()) for marker_genes in parsed_marker_genes_list]
-    write_log(f"Found {len(clusters_list)} sets of clusters")
+    if isinstance(tissue, list):
+        if len(tissue) != len(parsed_marker_genes_list):
+            raise ValueError(
+                f"Got {len(tissue)} tissues for {len(parsed_marker_genes_list)} marker sets"
+            )
+        tissues = list(tissue)
+    else:
+        tissues = [tissue] * len(parsed_marker_genes_list)
 
     # Set default model based on provider
     if not model:
@@ -217,195 +970,415 @@ def batch_annotate_clusters(
             write_log(f"ERROR: {error_msg}", level="error")
             raise ValueError(error_msg)
 
-    # Create batch prompt
-    # If tissue is a list, use the first one for the batch prompt
-    # Individual tissues will be used when processing each dataset separately
-    batch_tissue = tissue[0] if isinstance(tissue, list) and len(tissue) > 0 else tissue
-
-    prompt = create_batch_prompt(
-        marker_genes_list=parsed_marker_genes_list,
+    if deduplicate_clusters:
+        return _annotate_deduplicated_sets(
+            parsed_marker_genes_list,
+            tissues,
+            species=species,
+            provider=provider,
+            model=model,
+            api_key=api_key,
+            additional_context=additional_context,
+            use_cache=use_cache,
+            cache_dir=cache_dir,
+            log_dir=log_dir,
+            log_level=log_level,
+            max_workers=max_workers,
+            cancel_token=cancel_token,
+            marker_top_n=marker_top_n,
+        )
+
+    set_keys, first_index, annotations_by_key, batches = _plan_batch_requests(
+        parsed_marker_genes_list,
+        tissues,
         species=species,
-        tissue=batch_tissue,
+        provider=provider,
+        model=model,
         additional_context=additional_context,
         prompt_template=prompt_template,
+        use_cache=use_cache,
+        cache_dir=cache_dir,
     )
+    if use_cache:
+        for key in first_index:
+            _report_cache_access(provider, model, key in annotations_by_key)
+
+    def run_batch(group_tissue: Optional[str], keys: list[str]) -> dict[str, dict[str, str]]:
+        set_markers = [parsed_marker_genes_list[first_index[key]] for key in keys]
+        prompt = create_batch_prompt(
+            marker_genes_list=set_markers,
+            species=species,
+            tissue=group_tissue,
+            additional_context=additional_context,
+            prompt_template=prompt_template,
+        )
+        write_log(f"Processing batch request for {len(keys)} sets with {provider}/{model}")
+        results = _request_annotations(
+            prompt, provider, model, api_key, use_cache=False, cancel_token=cancel_token
+        )
+
+        batch_annotations = {}
+        for key, marker_genes, set_results in zip(
+            keys, set_markers, _parse_batch_response(results, len(keys))
+        ):
+            clusters = [str(cluster) for cluster in marker_genes]
+            if all(set_results.get(cluster) for cluster in clusters):
+                batch_annotations[key] = {cluster: set_results[cluster] for cluster in clusters}
+                continue
+            write_log(
+                "Batch response does not cover every cluster of a set, annotating it on its own",
+                level="warning",
+            )
+            batch_annotations[key] = annotate_clusters(
+                marker_genes=marker_genes,
+                species=species,
+                provider=provider,
+                model=model,
+                api_key=api_key,
+                tissue=group_tissue,
+                additional_context=additional_context,
+                use_cache=use_cache,
+                cache_dir=cache_dir,
+                log_dir=log_dir,
+                log_level=log_level,
+                cancel_token=cancel_token,
+            )
+        return batch_annotations
 
-    # Check cache
+    if batches:
+        pending = sum(len(keys) for _, keys in batches)
+        write_log(f"Sending {len(batches)} batch requests for {pending} marker sets")
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as pool:
+            futures = [pool.submit(in_current_span(run_batch), *batch) for batch in batches]
+            for future in futures:
+                for key, annotations in future.result().items():
+                    annotations_by_key[key] = annotations
+                    if use_cache:
+                        save_to_cache(key, annotations, cache_dir)
+
+    return [dict(annotations_by_key[key]) for key in set_keys]
+
+
+def _plan_batch_requests(
+    parsed_marker_genes_list: list[dict[str, list[str]]],
+    tissues: list[Optional[str]],
+    species: str,
+    provider: str,
+    model: str,
+    additional_context: Optional[str] = None,
+    prompt_template: Optional[str] = None,
+    use_cache: bool = True,
+    cache_dir: Optional[str] = None,
+) -> tuple[
+    list[str],
+    dict[str, int],
+    dict[str, dict[str, str]],
+    list[tuple[Optional[str], list[str]]],
+]:
+    """Plan the batch requests of batch_annotate_clusters without sending them.
+
+    Args:
+        parsed_marker_genes_list: Marker genes of each set
+        tissues: Tissue of each set
+        species: Species name
+        provider: LLM provider
+        model: Model name
+        additional_context: Additional context included in the prompt
+        prompt_template: Custom batch prompt template
+        use_cache: Whether to use cached set results
+        cache_dir: Directory to store cache files
+
+    Returns:
+        tuple: The cache key of every set, the index of the first set with each
+            key, the cached annotations by key, and the batches to send as
+            (tissue, keys) pairs
+
+    """
+    # Identical marker sets with the same tissue are annotated once
+    set_keys = [
+        _batch_set_key(
+            marker_genes,
+            species,
+            set_tissue,
+            additional_context,
+            prompt_template,
+            provider,
+            model,
+        )
+        for marker_genes, set_tissue in zip(parsed_marker_genes_list, tissues)
+    ]
+    first_index: dict[str, int] = {}
+    for index, key in enumerate(set_keys):
+        first_index.setdefault(key, index)
+    write_log(f"{len(first_index)} unique marker sets out of {len(set_keys)}")
+
+    annotations_by_key: dict[str, dict[str, str]] = {}
     if use_cache:
-        cache_key = create_cache_key(prompt, model, provider)
-        cached_results = load_from_cache(cache_key, cache_dir)
-        if cached_results:
-            write_log("Using cached results")
-            # Parse cached results into sets
-            result_sets = []
-            start_idx = 0
-            for clusters in clusters_list:
-                end_idx = start_idx + len(clusters)
-                set_results = cached_results[start_idx:end_idx]
-                result_sets.append(format_results(set_results, clusters))
-                start_idx = end_idx
-            return result_sets
+        for key in first_index:
+            cached_results = load_from_cache(key, cache_dir)
+            if isinstance(cached_results, dict) and cached_results:
+                annotations_by_key[key] = cached_results
+        if annotations_by_key:
+            write_log(f"Using cached results for {len(annotations_by_key)} marker sets")
+    pending = [key for key in first_index if key not in annotations_by_key]
+
+    # Group sets by tissue and pack each group into requests whose answers fit one response
+    batches: list[tuple[Optional[str], list[str]]] = []
+    if pending:
+        capacity = len(
+            plan_annotation_chunks(
+                [
+                    str(cluster)
+                    for key in pending
+                    for cluster in parsed_marker_genes_list[first_index[key]]
+                ],
+                provider,
+                model,
+            )[0]
+        )
+        groups: dict[Optional[str], list[str]] = {}
+        for key in pending:
+            groups.setdefault(tissues[first_index[key]], []).append(key)
+        for group_tissue, keys in groups.items():
+            batch, size = [], 0
+            for key in keys:
+                count = len(parsed_marker_genes_list[first_index[key]])
+                if batch and size + count > capacity:
+                    batches.append((group_tissue, batch))
+                    batch, size = [], 0
+                batch.append(key)
+                size += count
+            batches.append((group_tissue, batch))
+
+    return set_keys, first_index, annotations_by_key, batches
+
+
+def _call_provider(
+    provider_func: Callable[[str, str, str], list[str]],
+    prompt: str,
+    provider: str,
+    model: str,
+    api_key: str,
+    hedging: Optional[HedgingPolicy] = None,
+    cancel_token: Optional[CancellationToken] = None,
+    output_budget: Optional[OutputBudget] = None,
+) -> list[str]:
+    """Call a provider function and record its latency and outcome for routing.
+
+    Transient failures are retried according to the configured RetryPolicy;
+    providers themselves make a single attempt. Calls to a model whose circuit
+    breaker is open fail immediately with CircuitOpenError.
 
-    # Get provider function
-    provider_func = PROVIDER_FUNCTIONS.get(provider.lower())
-    if not provider_func:
-        error_msg = f"Unknown provider: {provider}"
-        write_log(f"ERROR: {error_msg}", level="error")
-        raise ValueError(error_msg)
+    Args:
+        provider_func: Provider function from PROVIDER_FUNCTIONS
+        prompt: The prompt to send
+        provider: Provider name
+        model: Model name
+        api_key: API key for the provider
+        hedging: Hedging policy. If None, uses the policy set with configure_router.
+        cancel_token: Optional cancellation token. Once it is cancelled, the
+            request is abandoned and DeadlineExceeded is raised.
+        output_budget: Optional output limits passed to the provider function as
+            its max_tokens and stop arguments
 
-    # Process request
-    try:
-        write_log(f"Processing batch request with {provider} using model {model}")
-        start_time = time.time()
+    Returns:
+        list[str]: Raw response lines
 
-        # Call provider function
-        results = provider_func(prompt, model, api_key)
+    """
+    hedging = hedging or get_hedging_policy()
+    if hedging:
+        return _call_provider_hedged(
+            provider_func, prompt, provider, model, api_key, hedging, cancel_token, output_budget
+        )
+    return _call_provider_once(
+        provider_func, prompt, provider, model, api_key, cancel_token, output_budget
+    )
 
-        end_time = time.time()
-        write_log(f"Batch request processed in {end_time - start_time:.2f} seconds")
 
-        # Save to cache
-        if use_cache:
-            save_to_cache(cache_key, results, cache_dir)
+def _call_provider_once(
+    provider_func: Callable[[str, str, str], list[str]],
+    prompt: str,
+    provider: str,
+    model: str,
+    api_key: str,
+    cancel_token: Optional[CancellationToken] = None,
+    output_budget: Optional[OutputBudget] = None,
+) -> list[str]:
+    """Call a provider function without hedging; see _call_provider."""
+    description = f"{provider}/{model}"
+    options = (
+        {"max_tokens": output_budget.max_tokens, "stop": output_budget.stop}
+        if output_budget is not None
+        else {}
+    )
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled(description)
 
-        # Parse results into sets
-        # The LLM response format is typically:
-        # Set 1:
-        # Cluster 1: T cells
-        # Cluster 2: B cells
-        # ...
-        #
-        # Set 2:
-        # ...
-
-        # First, filter out empty lines and parse the results
-        filtered_results = [line for line in results if line.strip()]
-
-        # Initialize result sets
-        result_sets = []
-        current_set = None
-        current_set_results = {}
-
-        for line in filtered_results:
-            line = line.strip()
-
-            # Check if this is a set header
-            if line.startswith("Set "):
-                # If we have a current set, add it to results
-                if current_set is not None and current_set_results:
-                    result_sets.append(current_set_results)
-                    current_set_results = {}
-
-                # Extract set number
-                try:
-                    current_set = int(line.split()[1].rstrip(":")) - 1
-                except (IndexError, ValueError):
-                    current_set = len(result_sets)
-
-            # Check if this is a cluster annotation
-            elif line.startswith("Cluster "):
-                try:
-                    # Parse "Cluster X: Annotation"
-                    parts = line.split(":", 1)
-                    cluster_num = parts[0].split()[1]
-                    annotation = parts[1].strip() if len(parts) > 1 else ""
-
-                    # Add to current set results
-                    if current_set is not None:
-                        current_set_results[cluster_num] = annotation
-                except (IndexError, ValueError):
-                    write_log(f"Warning: Could not parse line: {line}", level="warning")
-
-        # Add the last set if it exists
-        if current_set is not None and current_set_results:
-            result_sets.append(current_set_results)
-
-        # Try to parse JSON format if present
-        if not result_sets:
-            try:
-                # Join all results and try to parse as JSON
-                full_text = "\n".join(filtered_results)
-
-                # Try to find JSON in the text
-                import json
-                import re
-
-                # Extract JSON content if it's wrapped in ```json and ``` markers
-                json_match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", full_text)
-                json_str = json_match.group(1) if json_match else None
-
-                if not json_str:
-                    # If no code blocks, try to find JSON object directly
-                    json_match = re.search(r"(\{[\s\S]*\})", full_text)
-                    json_str = json_match.group(1) if json_match else None
-
-                if json_str:
-                    try:
-                        data = json.loads(json_str)
-
-                        # Check if it's a batch response with sets
-                        if "sets" in data and isinstance(data["sets"], list):
-                            # Parse each set
-                            for set_data in data["sets"]:
-                                set_results = {}
-                                if "clusters" in set_data and isinstance(
-                                    set_data["clusters"], list
-                                ):
-                                    for cluster in set_data["clusters"]:
-                                        if "id" in cluster and "cell_type" in cluster:
-                                            set_results[str(cluster["id"])] = cluster["cell_type"]
-                                    result_sets.append(set_results)
-                        # Check if it's a batch response with annotations array
-                        elif "annotations" in data and isinstance(data["annotations"], list):
-                            # Group by set if specified
-                            set_groups = {}
-                            for annotation in data["annotations"]:
-                                if (
-                                    "set" in annotation
-                                    and "cluster" in annotation
-                                    and "cell_type" in annotation
-                                ):
-                                    set_id = annotation["set"]
-                                    if set_id not in set_groups:
-                                        set_groups[set_id] = {}
-                                    set_groups[set_id][str(annotation["cluster"])] = annotation[
-                                        "cell_type"
-                                    ]
-
-                            # Add all sets in order
-                            for set_id in sorted(set_groups.keys()):
-                                result_sets.append(set_groups[set_id])
-                    except json.JSONDecodeError:
-                        write_log("Warning: Failed to parse JSON response", level="warning")
-            except (ValueError, KeyError, AttributeError, TypeError) as e:
-                write_log(
-                    f"Warning: Error while trying to parse JSON: {str(e)}",
-                    level="warning",
-                )
-
-        # If we still didn't get any properly formatted results, fall back to the
-        # old method
-        if not result_sets:
-            write_log(
-                "Warning: Could not parse batch results, falling back to default parsing",
-                level="warning",
+    breaker = get_circuit_breaker(provider, model)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit open for {provider}/{model}, skipping request")
+
+    stats = get_provider_stats()
+    issued = time.time()
+    attempt_times: list[float] = []
+
+    def attempt() -> list[str]:
+        start_time = time.time()
+        try:
+            with start_span(
+                "http.request", provider=provider, model=model, attempt=len(attempt_times) + 1
+            ):
+                results = provider_func(prompt, model, api_key, **options)
+        except Exception:
+            attempt_times.append(time.time() - start_time)
+            stats.record(provider, model, attempt_times[-1], success=False)
+            raise
+        attempt_times.append(time.time() - start_time)
+        usage = read_usage_tokens(getattr(results, "usage", None))
+        output_tokens = (
+            usage["output_tokens"]
+            if usage
+            else estimate_tokens("\n".join(results) if isinstance(results, list) else results)
+        )
+        stats.record(provider, model, attempt_times[-1], True, output_tokens)
+        return results
+
+    def report(success: bool, results: Optional[list[str]] = None) -> None:
+        if not metrics_enabled():
+            return
+        text = "\n".join(results) if isinstance(results, list) else str(results or "")
+        # Prefer the token counts the provider reported over local estimates
+        usage = read_usage_tokens(getattr(results, "usage", None))
+        emit_metric(
+            MetricEvent(
+                "request",
+                provider,
+                model,
+                latency=attempt_times[-1] if attempt_times else 0.0,
+                queue_wait=max(0.0, time.time() - issued - sum(attempt_times)),
+                input_tokens=usage["input_tokens"] if usage else estimate_tokens(prompt),
+                output_tokens=usage["output_tokens"] if usage else estimate_tokens(text),
+                cached_tokens=usage["cached_tokens"] if usage else 0,
+                tokens_reported=usage is not None,
+                retries=max(0, len(attempt_times) - 1),
+                bytes_sent=len(prompt.encode("utf-8")),
+                bytes_received=len(text.encode("utf-8")),
+                success=success,
             )
-            result_sets = []
-            for i, clusters in enumerate(clusters_list):
-                result_sets.append(
-                    {
-                        str(cluster): f"Set {i + 1} results not properly parsed"
-                        for cluster in clusters
-                    }
-                )
+        )
 
-        return result_sets
+    # With a token, each attempt runs on a worker thread that can be abandoned
+    call = (
+        functools.partial(run_cancellable, in_current_span(attempt), cancel_token, description)
+        if cancel_token is not None
+        else attempt
+    )
 
-    except Exception as e:
-        error_msg = f"Error during batch annotation: {str(e)}"
-        write_log(f"ERROR: {error_msg}", level="error")
+    try:
+        results = call_with_retry(call, description, cancel_token=cancel_token)
+    except DeadlineExceeded:
+        # Running out of time says nothing about the health of the model
+        breaker.release_probe()
+        report(False)
+        raise
+    except Exception:
+        breaker.record_failure()
+        report(False)
         raise
 
+    breaker.record_success()
+    report(True, results)
+    return results
+
+
+def _call_provider_hedged(
+    provider_func: Callable[[str, str, str], list[str]],
+    prompt: str,
+    provider: str,
+    model: str,
+    api_key: str,
+    hedging: HedgingPolicy,
+    cancel_token: Optional[CancellationToken] = None,
+    output_budget: Optional[OutputBudget] = None,
+) -> list[str]:
+    """Call a provider, sending a hedge if the call runs longer than usual.
+
+    The first valid answer wins. A losing request cannot be aborted once sent;
+    its answer is ignored, but its latency is still recorded.
+
+    Args:
+        provider_func: Provider function from PROVIDER_FUNCTIONS
+        prompt: The prompt to send
+        provider: Provider name
+        model: Model name
+        api_key: API key for the provider
+        hedging: Hedging policy
+        cancel_token: Optional cancellation token
+        output_budget: Optional output limits of the request
+
+    Returns:
+        list[str]: Raw response lines
+
+    """
+    stats = get_provider_stats()
+    observed = stats.percentile(provider, model, hedging.percentile)
+    delay = max(observed or 0.0, hedging.min_delay)
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        call_provider = in_current_span(_call_provider_once)
+        primary = executor.submit(
+            call_provider,
+            provider_func,
+            prompt,
+            provider,
+            model,
+            api_key,
+            cancel_token,
+            output_budget,
+        )
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        # Send the hedge to the backup model if one is configured, else the same model
+        backup_provider, backup_model = (hedging.backups or {}).get(
+            f"{provider.lower()}/{model}", (provider, model)
+        )
+        backup_func = PROVIDER_FUNCTIONS.get(backup_provider.lower())
+        backup_key = api_key if backup_provider == provider else load_api_key(backup_provider)
+        if not backup_func or not backup_key:
+            write_log(f"No usable hedge target for {model}, waiting for the original request")
+            return primary.result()
+
+        write_log(
+            f"Request to {model} still running after {delay:.1f}s, sending hedge to {backup_model}"
+        )
+        hedge = executor.submit(
+            call_provider,
+            backup_func,
+            prompt,
+            backup_provider,
+            backup_model,
+            backup_key,
+            cancel_token,
+            _output_budget_for(output_budget, backup_provider, backup_model),
+        )
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result():
+                    stats.record_hedge(provider, model, won=future is hedge)
+                    return future.result()
+
+        stats.record_hedge(provider, model, won=False)
+        # Both failed: surface the error of the original request
+        return primary.result()
+    finally:
+        executor.shutdown(wait=False)
+
 
 def get_default_model(provider: str) -> str:
     """Get default model for a provider.
@@ -440,6 +1413,8 @@ def get_model_response(
     api_key: Optional[str] = None,
     use_cache: bool = True,
     cache_dir: Optional[str] = None,
+    hedging: Optional[HedgingPolicy] = None,
+    cancel_token: Optional[CancellationToken] = None,
 ) -> str:
     """Get response from a model for a given prompt.
 
@@ -450,6 +1425,10 @@ def get_model_response(
         api_key: The API key for the provider. If None, loads from environment.
         use_cache: Whether to use cache
         cache_dir: The cache directory
+        hedging: Optional hedging policy for this request. If None, uses the policy
+            set with configure_router, if any.
+        cancel_token: Optional cancellation token of the run. Once it is cancelled,
+            the request is abandoned and DeadlineExceeded is raised.
 
     Returns:
         str: The model response
@@ -481,6 +1460,7 @@ def get_model_response(
 
         cache_key = create_cache_key(prompt, model, provider)
         cached_result = load_from_cache(cache_key, cache_dir)
+        _report_cache_access(provider, model, bool(cached_result))
         if cached_result:
             write_log(f"Using cached result for {model}")
             if isinstance(cached_result, list):
@@ -510,7 +1490,9 @@ def get_model_response(
     # Call provider function
     try:
         write_log(f"Requesting response from {provider} ({model})")
-        result = provider_func(prompt, model, api_key)
+        result = _call_provider(
+            provider_func, prompt, provider, model, api_key, hedging, cancel_token
+        )
 
         # Save to cache
         if use_cache:
@@ -4,7 +4,7 @@ from __future__ import annotations
 
 from collections import Counter
 from itertools import combinations
-from typing import Any
+from typing import TYPE_CHECKING, Any, Optional
 
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -14,9 +14,15 @@ from .functions import identify_controversial_clusters
 from .logger import write_log
 from .utils import clean_annotation
 
+if TYPE_CHECKING:
+    from .ontology import CellTypeOntology
+
 
 def compare_model_predictions(
-    model_predictions: dict[str, dict[str, str]], display_plot: bool = True
+    model_predictions: dict[str, dict[str, str]],
+    display_plot: bool = True,
+    ontology: Optional[CellTypeOntology] = None,
+    ontology_depth: Optional[int] = None,
 ) -> tuple[pd.DataFrame, dict[str, Any]]:
     """Compare cell type annotations from different LLM models.
 
@@ -24,6 +30,8 @@ def compare_model_predictions(
         model_predictions: Dictionary mapping model names to dictionaries of
             cluster annotations
         display_plot: Whether to display plots
+        ontology: Optional cell type ontology used to treat synonymous labels as equal
+        ontology_depth: Optional ontology depth at which labels are compared
 
     Returns:
         Tuple of:
@@ -67,7 +75,11 @@ def compare_model_predictions(
                 anno1 = clean_annotation(preds1[cluster])
                 anno2 = clean_annotation(preds2[cluster])
 
-                # Simple exact match for now
+                # Compare ontology terms if available, otherwise exact match
+                if ontology is not None:
+                    anno1 = ontology.canonical_label(anno1, ontology_depth)
+                    anno2 = ontology.canonical_label(anno2, ontology_depth)
+
                 if anno1.lower() == anno2.lower():
                     agreement_count += 1
 
@@ -145,7 +157,9 @@ def compare_model_predictions(
         least_agreeing_score = 0.0
 
     # Identify controversial clusters
-    controversial = identify_controversial_clusters(model_predictions, threshold=0.6)
+    controversial = identify_controversial_clusters(
+        model_predictions, threshold=0.6, ontology=ontology, ontology_depth=ontology_depth
+    )
 
     metrics = {
         "agreement_avg": avg_agreement,
@@ -3,22 +3,167 @@
 from __future__ import annotations
 
 import contextlib
+import difflib
 import json
 import math
 import re
+import threading
 import time
-from collections import Counter
-from typing import Any, Optional, Union
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Any, Callable, Generator, Optional, Union
 
 import requests
 
 from .logger import write_log
-from .prompts import create_discussion_consensus_check_prompt, create_discussion_prompt
-from .utils import clean_annotation
+from .metrics import collect_run_metrics
+from .prompts import (
+    create_batch_discussion_prompt,
+    create_discussion_consensus_check_prompt,
+    create_discussion_prompt,
+)
+from .retry import CancellationToken, DeadlineExceeded, reset_retry_budget
+from .router import (
+    CircuitOpenError,
+    get_circuit_breaker,
+    get_provider_stats,
+    rank_models,
+    summarize_prompt_cache,
+)
+from .tracing import stage, start_span, traced, tracing_enabled, use_span
+from .utils import clean_annotation, compact_marker_genes, normalize_annotation
+
+if TYPE_CHECKING:
+    from .ontology import CellTypeOntology
+
+
+def _collect_cluster_annotations(
+    predictions: dict[str, dict[str, str]],
+) -> dict[str, list[str]]:
+    """Collect the cleaned annotations of every model for each cluster.
+
+    Args:
+        predictions: Dictionary mapping model names to dictionaries of
+            cluster annotations
+
+    Returns:
+        dict[str, list[str]]: Dictionary mapping cluster IDs to lists of annotations
+
+    """
+    # Get all clusters
+    all_clusters = set()
+    for model_results in predictions.values():
+        all_clusters.update(model_results.keys())
+
+    cluster_annotations = {}
+    for cluster in all_clusters:
+        annotations = []
+        for _model, results in predictions.items():
+            if cluster in results:
+                annotation = clean_annotation(results[cluster])
+                if annotation:
+                    annotations.append(annotation)
+        cluster_annotations[cluster] = annotations
+
+    return cluster_annotations
+
+
+def _simple_consensus(cluster_annotations: list[str]) -> tuple[str, float, float]:
+    """Calculate consensus by counting identical annotations.
+
+    Args:
+        cluster_annotations: List of annotations for one cluster
+
+    Returns:
+        tuple[str, float, float]: Majority annotation, consensus proportion and entropy
+
+    """
+    if not cluster_annotations:
+        return "Unknown", 0.0, 0.0
+
+    # Count occurrences of each annotation
+    annotation_counts = Counter(cluster_annotations)
+
+    # Find most common annotation
+    most_common_annotation, most_common_count = annotation_counts.most_common(1)[0]
+
+    # Calculate consensus proportion
+    total = len(cluster_annotations)
+    prop = most_common_count / total
+
+    # Calculate entropy
+    ent = 0.0
+    for count in annotation_counts.values():
+        p = count / total
+        ent -= p * (math.log2(p) if p > 0 else 0)
+
+    return most_common_annotation, prop, ent
+
+
+# Models used for consensus checks, in order of preference
+CONSENSUS_CHECK_MODELS = [
+    ("qwen", "qwen-max-2025-01-25"),
+    ("anthropic", "claude-3-5-sonnet-latest"),
+]
+
+
+def _request_consensus_check(
+    prompt: str,
+    api_keys: Optional[dict[str, str]] = None,
+    cancel_token: Optional[CancellationToken] = None,
+) -> Optional[str]:
+    """Send a consensus check prompt to the best available consensus check model.
+
+    Models from CONSENSUS_CHECK_MODELS are tried in the order given by the router,
+    which puts the fastest healthy model first once statistics exist. Transient
+    failures are retried by the provider layer, so each model is asked once here.
+
+    Args:
+        prompt: The consensus check prompt
+        api_keys: Dictionary mapping provider names to API keys
+        cancel_token: Optional cancellation token of the run
+
+    Returns:
+        Optional[str]: The LLM response, or None if no model could be reached
+
+    """
+    from .annotate import get_model_response
+    from .utils import load_api_key
+
+    for provider, model in rank_models(CONSENSUS_CHECK_MODELS):
+        # Get API key
+        api_key = (api_keys or {}).get(provider) or load_api_key(provider)
+        if not api_key:
+            write_log(f"No {provider} API key found, trying next consensus check model")
+            continue
+
+        try:
+            llm_response = get_model_response(
+                prompt=prompt,
+                provider=provider,
+                model=model,
+                api_key=api_key,
+                cancel_token=cancel_token,
+            )
+            write_log(f"Successfully got response from {model}")
+            return llm_response
+        except DeadlineExceeded as e:
+            write_log(f"Consensus check stopped: {str(e)}", level="warning")
+            return None
+        except Exception as e:
+            write_log(
+                f"Consensus check with {model} failed: {str(e)}, trying next model",
+                level="warning",
+            )
+
+    write_log("No consensus check model could be reached, falling back to simple consensus")
+    return None
 
 
 def check_consensus_with_llm(
-    predictions: dict[str, dict[str, str]], api_keys: Optional[dict[str, str]] = None
+    predictions: dict[str, dict[str, str]],
+    api_keys: Optional[dict[str, str]] = None,
+    cancel_token: Optional[CancellationToken] = None,
 ) -> tuple[dict[str, str], dict[str, float], dict[str, float]]:
     """Check consensus among different model predictions using LLM assistance.
     This function uses an LLM (Qwen or Claude) to evaluate semantic similarity between
@@ -28,6 +173,8 @@ def check_consensus_with_llm(
         predictions: Dictionary mapping model names to dictionaries of
             cluster annotations
         api_keys: Dictionary mapping provider names to API keys
+        cancel_token: Optional cancellation token. Once it is cancelled, remaining
+            clusters fall back to simple consensus calculation.
 
     Returns:
         Tuple of:
@@ -37,7 +184,6 @@ def check_consensus_with_llm(
 
     """
 
-    from .annotate import get_model_response
     from .prompts import create_consensus_check_prompt
 
     consensus = {}
@@ -48,108 +194,23 @@ def check_consensus_with_llm(
     if not predictions or not all(predictions.values()):
         return {}, {}, {}
 
-    # Get all clusters
-    all_clusters = set()
-    for model_results in predictions.values():
-        all_clusters.update(model_results.keys())
-
     # Process each cluster
-    for cluster in all_clusters:
-        # Collect all annotations for this cluster
-        cluster_annotations = []
-
-        for _model, results in predictions.items():
-            if cluster in results:
-                annotation = clean_annotation(results[cluster])
-                if annotation:
-                    cluster_annotations.append(annotation)
-
+    for cluster, cluster_annotations in _collect_cluster_annotations(predictions).items():
         if len(cluster_annotations) < 2:
             # Not enough annotations to check consensus
-            if cluster_annotations:
-                consensus[cluster] = cluster_annotations[0]
-                consensus_proportion[cluster] = 1.0
-                entropy[cluster] = 0.0
-            else:
-                consensus[cluster] = "Unknown"
-                consensus_proportion[cluster] = 0.0
-                entropy[cluster] = 0.0
+            (
+                consensus[cluster],
+                consensus_proportion[cluster],
+                entropy[cluster],
+            ) = _simple_consensus(cluster_annotations)
             continue
 
         # Create prompt for LLM
         prompt = create_consensus_check_prompt(cluster_annotations)
 
-        # Try with Qwen first
-        max_retries = 3
-        llm_response = None
-
-        # First try with Qwen
-        for attempt in range(max_retries):
-            try:
-                # Get API key
-                qwen_api_key = None
-                if api_keys and "qwen" in api_keys:
-                    qwen_api_key = api_keys["qwen"]
-
-                if not qwen_api_key:
-                    from .utils import load_api_key
-
-                    qwen_api_key = load_api_key("qwen")
-
-                if qwen_api_key:
-                    llm_response = get_model_response(
-                        prompt=prompt,
-                        provider="qwen",
-                        model="qwen-max-2025-01-25",
-                        api_key=qwen_api_key,
-                    )
-                    write_log(f"Successfully got response from Qwen on attempt {attempt + 1}")
-                    break
-                write_log("No Qwen API key found, trying Claude")
-                break
-            except (
-                requests.RequestException,
-                ValueError,
-                KeyError,
-                json.JSONDecodeError,
-            ) as e:
-                write_log(f"Error on Qwen attempt {attempt + 1}: {str(e)}", level="warning")
-                if attempt == max_retries - 1:
-                    write_log("All Qwen retry attempts failed, falling back to Claude")
-                else:
-                    write_log("Waiting before next attempt...")
-                    time.sleep(5 * (2**attempt))
-
-        # Try Claude as fallback
-        if not llm_response:
-            try:
-                # Get API key
-                anthropic_api_key = None
-                if api_keys and "anthropic" in api_keys:
-                    anthropic_api_key = api_keys["anthropic"]
-
-                if not anthropic_api_key:
-                    from .utils import load_api_key
-
-                    anthropic_api_key = load_api_key("anthropic")
-
-                if anthropic_api_key:
-                    llm_response = get_model_response(
-                        prompt=prompt,
-                        provider="anthropic",
-                        model="claude-3-5-sonnet-latest",
-                        api_key=anthropic_api_key,
-                    )
-                    write_log("Successfully got response from Claude as fallback")
-                else:
-                    write_log("No Claude API key found, falling back to simple consensus")
-            except (
-                requests.RequestException,
-                ValueError,
-                KeyError,
-                json.JSONDecodeError,
-            ) as e:
-                write_log(f"Error on Claude fallback: {str(e)}", level="warning")
+        # Try with Qwen first, then Claude
+        with start_span("consensus_check.cluster", cluster=cluster):
+            llm_response = _request_consensus_check(prompt, api_keys, cancel_token)
 
         # Parse LLM response
         if llm_response:
@@ -190,430 +251,1571 @@ def check_consensus_with_llm(
                 write_log(f"Error parsing LLM response: {str(e)}", level="warning")
 
         # Fallback to simple consensus calculation if LLM approach failed
-        # Count occurrences of each annotation
-        annotation_counts = Counter(cluster_annotations)
+        (
+            consensus[cluster],
+            consensus_proportion[cluster],
+            entropy[cluster],
+        ) = _simple_consensus(cluster_annotations)
+
+    return consensus, consensus_proportion, entropy
 
-        # Find most common annotation
-        most_common = annotation_counts.most_common(1)[0]
-        most_common_annotation = most_common[0]
-        most_common_count = most_common[1]
 
-        # Calculate consensus proportion
-        prop = most_common_count / len(cluster_annotations)
-        consensus_proportion[cluster] = prop
+def _extract_cluster_entries(response: str, description: str) -> list[dict[str, Any]]:
+    """Extract the per-cluster entries from a batched JSON reply.
 
-        # Calculate entropy
-        ent = 0.0
-        total = len(cluster_annotations)
-        for count in annotation_counts.values():
-            p = count / total
-            ent -= p * (math.log2(p) if p > 0 else 0)
-        entropy[cluster] = ent
+    Args:
+        response: Raw LLM response
+        description: Kind of reply, used in log messages
 
-        consensus[cluster] = most_common_annotation
+    Returns:
+        list[dict[str, Any]]: Entries of the 'clusters' list that name a cluster
 
-    return consensus, consensus_proportion, entropy
+    """
+    # Extract JSON content if it's wrapped in ```json and ``` markers
+    json_match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", response)
+    if json_match:
+        json_str = json_match.group(1)
+    else:
+        # If no code blocks, try to find JSON object directly
+        json_match = re.search(r"(\{[\s\S]*\})", response)
+        json_str = json_match.group(1) if json_match else response
 
+    try:
+        data = json.loads(json_str)
+    except json.JSONDecodeError as e:
+        write_log(f"Failed to parse {description} response: {str(e)}", level="warning")
+        return []
 
-def check_consensus(
+    entries = data.get("clusters", []) if isinstance(data, dict) else []
+    return [entry for entry in entries if isinstance(entry, dict) and "cluster" in entry]
+
+
+def _parse_batch_consensus_response(response: str) -> dict[str, tuple[str, float, float]]:
+    """Parse the JSON reply of a batched consensus check.
+
+    Args:
+        response: Raw LLM response
+
+    Returns:
+        dict[str, tuple[str, float, float]]: Dictionary mapping cluster IDs to the
+            consensus annotation, consensus proportion and entropy
+
+    """
+    parsed = {}
+    for entry in _extract_cluster_entries(response, "batch consensus"):
+        try:
+            cell_type = str(entry.get("cell_type", "")).strip() or "Unknown"
+            prop_value = float(entry["consensus_proportion"])
+            entropy_value = float(entry["entropy"])
+        except (KeyError, TypeError, ValueError) as e:
+            write_log(
+                f"Skipping malformed entry for cluster {entry.get('cluster')}: {str(e)}",
+                level="warning",
+            )
+            continue
+        parsed[str(entry["cluster"])] = (cell_type, prop_value, entropy_value)
+
+    return parsed
+
+
+def _chunk_clusters_by_tokens(
+    cluster_items: dict[str, Any],
+    max_prompt_tokens: int,
+    template: Optional[str] = None,
+    format_block: Optional[Callable[[str, Any], str]] = None,
+) -> list[dict[str, Any]]:
+    """Split clusters into groups whose batched prompt fits a token budget.
+
+    Args:
+        cluster_items: Dictionary mapping cluster IDs to the data shown for each cluster
+        max_prompt_tokens: Maximum estimated prompt tokens per request
+        template: Prompt template shared by every request. If None, uses the batch
+            consensus check template
+        format_block: Function formatting one cluster's prompt block. If None, uses
+            format_consensus_check_block
+
+    Returns:
+        list[dict[str, Any]]: Groups of clusters, one per request
+
+    """
+    from .prompts import DEFAULT_BATCH_CONSENSUS_CHECK_TEMPLATE, format_consensus_check_block
+    from .utils import estimate_tokens
+
+    preamble_tokens = estimate_tokens(template or DEFAULT_BATCH_CONSENSUS_CHECK_TEMPLATE)
+    format_block = format_block or format_consensus_check_block
+
+    chunks = []
+    current_chunk = {}
+    current_tokens = preamble_tokens
+    for cluster_id, item in cluster_items.items():
+        block_tokens = estimate_tokens(format_block(cluster_id, item))
+        # Always put at least one cluster in a chunk, even if it exceeds the budget
+        if current_chunk and current_tokens + block_tokens > max_prompt_tokens:
+            chunks.append(current_chunk)
+            current_chunk = {}
+            current_tokens = preamble_tokens
+        current_chunk[cluster_id] = item
+        current_tokens += block_tokens
+
+    if current_chunk:
+        chunks.append(current_chunk)
+
+    return chunks
+
+
+def check_consensus_with_llm_batch(
     predictions: dict[str, dict[str, str]],
-    consensus_threshold: float = 0.6,
-    entropy_threshold: float = 1.0,
     api_keys: Optional[dict[str, str]] = None,
-) -> tuple[dict[str, str], dict[str, float], dict[str, float], list[str]]:
-    """Check if there is consensus among different model predictions.
-    Uses LLM assistance to evaluate semantic similarity between annotations.
+    max_prompt_tokens: int = 3000,
+    cancel_token: Optional[CancellationToken] = None,
+) -> tuple[dict[str, str], dict[str, float], dict[str, float]]:
+    """Check consensus for many clusters per LLM request.
+
+    Works like check_consensus_with_llm, but sends the annotations of as many
+    clusters as fit into max_prompt_tokens in one prompt and parses a structured
+    per-cluster reply. Clusters missing from the reply fall back to simple
+    consensus calculation.
 
     Args:
         predictions: Dictionary mapping model names to dictionaries of
             cluster annotations
-        consensus_threshold: Agreement threshold below which a cluster is considered controversial
-        entropy_threshold: Entropy threshold above which a cluster is considered controversial
         api_keys: Dictionary mapping provider names to API keys
+        max_prompt_tokens: Maximum estimated prompt tokens per request
+        cancel_token: Optional cancellation token of the run
 
     Returns:
         Tuple of:
             - Dictionary mapping cluster IDs to consensus annotations
             - Dictionary mapping cluster IDs to consensus proportion scores
             - Dictionary mapping cluster IDs to entropy scores
-            - List of controversial cluster IDs
 
     """
-    # Find consensus annotations and metrics using LLM
-    consensus, consensus_proportion, entropy = check_consensus_with_llm(predictions, api_keys)
+    from .prompts import create_batch_consensus_check_prompt
 
-    # Find controversial clusters based on both consensus proportion and entropy
-    controversial = [
-        cluster
-        for cluster, score in consensus_proportion.items()
-        if score < consensus_threshold or entropy.get(cluster, 0) > entropy_threshold
-    ]
+    consensus = {}
+    consensus_proportion = {}
+    entropy = {}
 
-    return consensus, consensus_proportion, entropy, controversial
+    # Ensure we have annotations
+    if not predictions or not all(predictions.values()):
+        return {}, {}, {}
+
+    # Clusters with fewer than 2 annotations do not need the LLM
+    to_check = {}
+    for cluster, cluster_annotations in _collect_cluster_annotations(predictions).items():
+        if len(cluster_annotations) < 2:
+            (
+                consensus[cluster],
+                consensus_proportion[cluster],
+                entropy[cluster],
+            ) = _simple_consensus(cluster_annotations)
+        else:
+            to_check[cluster] = cluster_annotations
+
+    chunks = _chunk_clusters_by_tokens(to_check, max_prompt_tokens)
+    write_log(f"Checking consensus for {len(to_check)} clusters in {len(chunks)} batched requests")
+
+    for chunk in chunks:
+        prompt = create_batch_consensus_check_prompt(chunk)
+        with start_span("consensus_check.batch", clusters=len(chunk)):
+            llm_response = _request_consensus_check(prompt, api_keys, cancel_token)
+        parsed = _parse_batch_consensus_response(llm_response) if llm_response else {}
+
+        for cluster, cluster_annotations in chunk.items():
+            if str(cluster) in parsed:
+                cell_type, prop_value, entropy_value = parsed[str(cluster)]
+                consensus[cluster] = cell_type
+                consensus_proportion[cluster] = prop_value
+                entropy[cluster] = entropy_value
+            else:
+                # Fallback to simple consensus calculation if the reply lacks this cluster
+                (
+                    consensus[cluster],
+                    consensus_proportion[cluster],
+                    entropy[cluster],
+                ) = _simple_consensus(cluster_annotations)
 
+    return consensus, consensus_proportion, entropy
 
-def process_controversial_clusters(
-    marker_genes: dict[str, list[str]],
-    controversial_clusters: list[str],
-    model_predictions: dict[str, dict[str, str]],
-    species: str,
-    tissue: Optional[str] = None,
-    provider: str = "openai",
-    model: Optional[str] = None,
-    api_key: Optional[str] = None,
-    max_discussion_rounds: int = 3,
-    consensus_threshold: float = 0.7,
-    entropy_threshold: float = 1.0,
-    use_cache: bool = True,
-    cache_dir: Optional[str] = None,
-) -> tuple[dict[str, str], dict[str, list[str]], dict[str, float], dict[str, float]]:
-    """Process controversial clusters by facilitating a discussion between models.
+
+# Consensus tiers, from cheapest to most expensive
+CONSENSUS_TIERS = ("single", "exact", "synonym", "lexical", "llm")
+
+# Differing words that always mark distinct cell types in the lexical tier:
+# marker genes and subsets (digits, +/-) and roman numeral types
+DISTINGUISHING_WORD = re.compile(r"[0-9+-]|^(?:i{1,3}|iv|vi{0,3}|ix|x)$")
+
+# Differing words shorter than this are abbreviations (e.g. 'nk' and 'nkt')
+# and are never merged by the lexical tier
+MIN_LEXICAL_WORD_LENGTH = 4
+
+
+def _group_annotations(
+    annotations: list[str], key_func: Callable[[str], str]
+) -> dict[str, list[str]]:
+    """Group annotations that share the same key.
 
     Args:
-        marker_genes: Dictionary mapping cluster names to lists of marker genes
-        controversial_clusters: List of controversial cluster IDs
-        model_predictions: Dictionary mapping model names to dictionaries of
-            cluster annotations
-        species: Species name (e.g., 'human', 'mouse')
-        tissue: Optional tissue name (e.g., 'brain', 'liver')
-        provider: LLM provider for the discussion
-        model: Model name for the discussion
-        api_key: API key for the provider
-        max_discussion_rounds: Maximum number of discussion rounds for controversial clusters
-        consensus_threshold: Agreement threshold for determining when consensus is reached
-        entropy_threshold: Entropy threshold for determining when consensus is reached
-        use_cache: Whether to use cache
-        cache_dir: Directory to store cache files
+        annotations: List of annotations for one cluster
+        key_func: Function mapping an annotation to its grouping key
 
     Returns:
-        tuple[dict[str, str], dict[str, list[str]], dict[str, float], dict[str, float]]:
-            - Dictionary mapping cluster IDs to resolved annotations
-            - Dictionary mapping cluster IDs to discussion history for each round
-            - Dictionary mapping cluster IDs to updated consensus proportion scores
-            - Dictionary mapping cluster IDs to updated entropy scores
+        dict[str, list[str]]: Dictionary mapping keys to the annotations in each group
 
     """
+    groups = {}
+    for annotation in annotations:
+        groups.setdefault(key_func(annotation), []).append(annotation)
+    return groups
 
-    from .annotate import get_model_response
-    from .prompts import create_consensus_check_prompt
 
-    results = {}
-    discussion_history = {}
-    updated_consensus_proportion = {}
-    updated_entropy = {}
+def _is_spelling_variant(label: str, other: str) -> bool:
+    """Check whether two normalized labels can only differ by spelling.
 
-    for cluster_id in controversial_clusters:
-        write_log(f"Processing controversial cluster {cluster_id}")
+    The labels must have the same number of words, and every pair of differing
+    words must be long enough to hold a typo and free of digits, +/- markers and
+    roman numerals, which name distinct subsets such as 'CD4+' and 'CD8+'.
 
-        # Get marker genes for this cluster
-        cluster_markers = marker_genes.get(cluster_id, [])
-        if not cluster_markers:
-            write_log(
-                f"Warning: No marker genes found for cluster {cluster_id}",
-                level="warning",
-            )
-            results[cluster_id] = "Unknown (no markers)"
-            discussion_history[cluster_id] = ["No marker genes found for this cluster"]
+    Args:
+        label: Normalized annotation
+        other: Normalized annotation to compare with
+
+    Returns:
+        bool: True if the labels may be merged by spelling similarity
+
+    """
+    words, other_words = label.split(), other.split()
+    if len(words) != len(other_words):
+        return False
+    for word, other_word in zip(words, other_words):
+        if word == other_word:
             continue
+        if min(len(word), len(other_word)) < MIN_LEXICAL_WORD_LENGTH:
+            return False
+        if DISTINGUISHING_WORD.search(word) or DISTINGUISHING_WORD.search(other_word):
+            return False
+    return True
 
-        # Get model predictions for this cluster
-        model_votes = {
-            model: predictions.get(cluster_id, "Unknown")
-            for model, predictions in model_predictions.items()
-            if cluster_id in predictions
-        }
 
-        # Use a more capable model for discussion if possible
-        discussion_model = model
-        if provider == "openai" and not discussion_model:
-            discussion_model = "gpt-4o"
-        elif provider == "anthropic" and not discussion_model:
-            discussion_model = "claude-3-opus"
+def _group_annotations_lexically(
+    annotations: list[str], similarity_threshold: float
+) -> dict[str, list[str]]:
+    """Group normalized annotations whose spelling is nearly identical.
 
-        # Initialize variables for iterative discussion
-        current_round = 1
-        consensus_reached = False
-        final_decision = None
-        rounds_history = []
-        current_votes = model_votes.copy()
-
-        # Create initial consensus check prompt for LLM to calculate metrics
-
-        # Get all annotations for this cluster
-        annotations = list(current_votes.values())
-
-        # Create prompt for LLM to check consensus
-        consensus_check_prompt = create_consensus_check_prompt(annotations)
-
-        # Get response from LLM
-        consensus_check_response = get_model_response(
-            consensus_check_prompt,
-            provider,
-            discussion_model,
-            api_key,
-            use_cache,
-            cache_dir,
-        )
+    Only spelling variants (see _is_spelling_variant) are merged, however similar
+    two labels are overall.
 
-        # Parse response to get consensus metrics
-        try:
-            lines = consensus_check_response.strip().split("\n")
-            if len(lines) >= 3:
-                # Extract consensus proportion
-                cp = float(lines[1].strip())
+    Args:
+        annotations: List of annotations for one cluster
+        similarity_threshold: Minimum similarity ratio (0-1) for two labels to be merged
 
-                # Extract entropy value
-                h = float(lines[2].strip())
+    Returns:
+        dict[str, list[str]]: Dictionary mapping group representatives to annotations
 
-                write_log(
-                    f"Initial metrics for cluster {cluster_id} (LLM calculated): CP={cp:.2f}, H={h:.2f}"
-                )
-            else:
-                # Fallback if LLM response format is unexpected
-                cp = 0.25  # Low consensus to ensure discussion happens
-                h = 2.0  # High entropy to indicate uncertainty
-                write_log(
-                    f"Could not parse LLM consensus check response, using default values: CP={cp:.2f}, H={h:.2f}",
-                    level="warning",
-                )
-        except (ValueError, IndexError, AttributeError, TypeError) as e:
-            # Fallback if parsing fails
-            cp = 0.25  # Low consensus to ensure discussion happens
-            h = 2.0  # High entropy to indicate uncertainty
-            write_log(
-                f"Error parsing LLM consensus check response: {str(e)}, using default values: CP={cp:.2f}, H={h:.2f}",
-                level="warning",
-            )
+    """
+    groups = {}
+    for annotation in annotations:
+        normalized = normalize_annotation(annotation)
+        for representative in groups:
+            if (
+                _is_spelling_variant(normalized, representative)
+                and difflib.SequenceMatcher(None, normalized, representative).ratio()
+                >= similarity_threshold
+            ):
+                groups[representative].append(annotation)
+                break
+        else:
+            groups[normalized] = [annotation]
+    return groups
 
-        rounds_history.append(
-            f"Initial votes: {current_votes}\nConsensus Proportion (CP): {cp:.2f}\nShannon Entropy (H): {h:.2f}"
-        )
 
-        # Start iterative discussion process
-        try:
-            while current_round <= max_discussion_rounds and not consensus_reached:
-                write_log(f"Starting discussion round {current_round} for cluster {cluster_id}")
+def _group_metrics(groups: dict[str, list[str]]) -> tuple[str, float, float]:
+    """Calculate consensus metrics from grouped annotations.
 
-                # Generate discussion prompt based on current round
-                if current_round == 1:
-                    # Initial discussion round
-                    prompt = create_discussion_prompt(
-                        cluster_id=cluster_id,
-                        marker_genes=cluster_markers,
-                        model_votes=current_votes,
-                        species=species,
-                        tissue=tissue,
-                    )
-                else:
-                    # Follow-up rounds include previous discussion
-                    prompt = create_discussion_prompt(
+    Args:
+        groups: Dictionary mapping group keys to the annotations in each group
+
+    Returns:
+        tuple[str, float, float]: Most common label of the largest group, consensus
+            proportion and entropy
+
+    """
+    total = sum(len(members) for members in groups.values())
+    largest = max(groups.values(), key=len)
+
+    ent = 0.0
+    for members in groups.values():
+        p = len(members) / total
+        ent -= p * (math.log2(p) if p > 0 else 0)
+
+    label = Counter(largest).most_common(1)[0][0]
+    return label, len(largest) / total, ent
+
+
+def _resolve_consensus_tiers(
+    predictions: dict[str, dict[str, str]],
+    consensus_threshold: float,
+    entropy_threshold: float,
+    similarity_threshold: Optional[float] = None,
+    ontology: Optional[CellTypeOntology] = None,
+    ontology_depth: Optional[int] = None,
+) -> tuple[dict[str, tuple[str, float, float]], dict[str, tuple[str, float, float]], dict]:
+    """Decide consensus locally for every cluster the cheap tiers can settle.
+
+    Each cluster is tried against exact, synonym and, if a similarity threshold is
+    given, lexical matching in turn. A cluster is decided at the first tier where
+    its consensus proportion and entropy already pass the thresholds; everything
+    else is left for the LLM. With an ontology, the synonym tier groups labels by
+    ontology term.
+
+    Args:
+        predictions: Dictionary mapping model names to dictionaries of
+            cluster annotations
+        consensus_threshold: Agreement threshold below which a cluster is considered controversial
+        entropy_threshold: Entropy threshold above which a cluster is considered controversial
+        similarity_threshold: Minimum similarity ratio for the lexical tier. If None,
+            the lexical tier is skipped.
+        ontology: Optional cell type ontology for the synonym tier
+        ontology_depth: Optional ontology depth at which labels are compared
+
+    Returns:
+        Tuple of:
+            - Dictionary mapping decided cluster IDs to (annotation, proportion, entropy)
+            - Dictionary mapping undecided cluster IDs to their best local metrics
+            - Dictionary with per-tier cluster counts and time in seconds
+
+    """
+    tier_stats = {tier: {"clusters": 0, "time": 0.0} for tier in CONSENSUS_TIERS}
+    if ontology is not None:
+
+        def synonym_key(label: str) -> str:
+            return ontology.canonical_label(label, ontology_depth)
+
+    else:
+        synonym_key = normalize_annotation
+
+    tier_functions = [
+        ("exact", lambda labels: _group_annotations(labels, str.lower)),
+        ("synonym", lambda labels: _group_annotations(labels, synonym_key)),
+    ]
+    if similarity_threshold is not None:
+        tier_functions.append(
+            (
+                "lexical",
+                lambda labels: _group_annotations_lexically(labels, similarity_threshold),
+            )
+        )
+
+    decided = {}
+    undecided = {}
+    for cluster, cluster_annotations in _collect_cluster_annotations(predictions).items():
+        if len(cluster_annotations) < 2:
+            decided[cluster] = _simple_consensus(cluster_annotations)
+            tier_stats["single"]["clusters"] += 1
+            continue
+
+        for tier, group_func in tier_functions:
+            start_time = time.perf_counter()
+            metrics = _group_metrics(group_func(cluster_annotations))
+            tier_stats[tier]["time"] += time.perf_counter() - start_time
+
+            _label, prop, ent = metrics
+            if prop >= consensus_threshold and ent <= entropy_threshold:
+                decided[cluster] = metrics
+                tier_stats[tier]["clusters"] += 1
+                break
+        else:
+            undecided[cluster] = metrics
+
+    return decided, undecided, tier_stats
+
+
+def _vote_metrics(counts: list[int]) -> tuple[float, float]:
+    """Calculate the consensus proportion and entropy of vote counts per label."""
+    total = sum(counts)
+    ent = -sum(count / total * math.log2(count / total) for count in counts if count)
+    return max(counts) / total, ent
+
+
+def _is_vote_settled(
+    labels: list[str],
+    queried: int,
+    total_models: int,
+    consensus_threshold: float,
+    entropy_threshold: float,
+    key_func: Callable[[str], str],
+) -> bool:
+    """Check whether the remaining models can still change a cluster's outcome.
+
+    The outcome is settled if it is the same for any way the models not yet
+    queried could vote. Consensus is certain if it holds even when every
+    remaining model names a different new label, which gives the lowest
+    consensus proportion and the highest entropy. It is ruled out if it fails
+    even when every remaining model agrees with the leading label, which gives
+    the highest proportion and the lowest entropy.
+
+    Args:
+        labels: Annotations received so far for one cluster
+        queried: Number of models already queried for the cluster
+        total_models: Number of models available
+        consensus_threshold: Agreement threshold for consensus
+        entropy_threshold: Entropy threshold for consensus
+        key_func: Function mapping an annotation to its grouping key
+
+    Returns:
+        bool: True if querying more models cannot change the outcome
+
+    """
+    counts = sorted(Counter(key_func(label) for label in labels if label).values(), reverse=True)
+    remaining = total_models - queried
+    if remaining <= 0:
+        return True
+    if not counts:
+        return False
+
+    prop, ent = _vote_metrics(counts + [1] * remaining)
+    if prop >= consensus_threshold and ent <= entropy_threshold:
+        return True
+    prop, ent = _vote_metrics([counts[0] + remaining] + counts[1:])
+    return prop < consensus_threshold or ent > entropy_threshold
+
+
+def check_consensus(
+    predictions: dict[str, dict[str, str]],
+    consensus_threshold: float = 0.6,
+    entropy_threshold: float = 1.0,
+    api_keys: Optional[dict[str, str]] = None,
+    batch: bool = False,
+    max_prompt_tokens: int = 3000,
+    tiered: bool = True,
+    similarity_threshold: Optional[float] = None,
+    tier_stats: Optional[dict[str, dict[str, float]]] = None,
+    ontology: Optional[CellTypeOntology] = None,
+    ontology_depth: Optional[int] = None,
+    cancel_token: Optional[CancellationToken] = None,
+) -> tuple[dict[str, str], dict[str, float], dict[str, float], list[str]]:
+    """Check if there is consensus among different model predictions.
+    Uses LLM assistance to evaluate semantic similarity between annotations.
+
+    In tiered mode, clusters are first matched exactly, then by normalized
+    synonyms, and, with a similarity_threshold, by spelling similarity. Only
+    clusters that are still below the thresholds after these cheap tiers are sent
+    to the LLM.
+
+    Args:
+        predictions: Dictionary mapping model names to dictionaries of
+            cluster annotations
+        consensus_threshold: Agreement threshold below which a cluster is considered controversial
+        entropy_threshold: Entropy threshold above which a cluster is considered controversial
+        api_keys: Dictionary mapping provider names to API keys
+        batch: Whether to check many clusters per LLM request
+        max_prompt_tokens: Maximum estimated prompt tokens per request in batch mode
+        tiered: Whether to resolve clusters with local matching before asking the LLM
+        similarity_threshold: Optional minimum similarity ratio (0-1) that enables the
+            lexical tier, which merges spelling variants such as 'Oligodendrocytes' and
+            'Oligodendrocites'. Labels differing in marker genes, abbreviations or roman
+            numerals are never merged. None leaves such clusters to the LLM.
+        tier_stats: Optional dictionary that is filled with the number of clusters
+            decided and the time spent by each tier
+        ontology: Optional cell type ontology used by the synonym tier to group labels
+        ontology_depth: Optional ontology depth at which the synonym tier compares labels
+        cancel_token: Optional cancellation token. Once it is cancelled, clusters left
+            for the LLM fall back to simple consensus calculation.
+
+    Returns:
+        Tuple of:
+            - Dictionary mapping cluster IDs to consensus annotations
+            - Dictionary mapping cluster IDs to consensus proportion scores
+            - Dictionary mapping cluster IDs to entropy scores
+            - List of controversial cluster IDs
+
+    """
+    consensus = {}
+    consensus_proportion = {}
+    entropy = {}
+    llm_predictions = predictions
+    stats = {tier: {"clusters": 0, "time": 0.0} for tier in CONSENSUS_TIERS}
+
+    if tiered and predictions:
+        decided, undecided, stats = _resolve_consensus_tiers(
+            predictions,
+            consensus_threshold,
+            entropy_threshold,
+            similarity_threshold,
+            ontology=ontology,
+            ontology_depth=ontology_depth,
+        )
+        for cluster, (label, prop, ent) in {**undecided, **decided}.items():
+            consensus[cluster] = label
+            consensus_proportion[cluster] = prop
+            entropy[cluster] = ent
+
+        # Only send the clusters the cheap tiers could not settle to the LLM
+        llm_predictions = {}
+        for model, results in predictions.items():
+            model_results = {
+                cluster: annotation
+                for cluster, annotation in results.items()
+                if cluster in undecided
+            }
+            if model_results:
+                llm_predictions[model] = model_results
+
+    # Find consensus annotations and metrics using LLM
+    if llm_predictions:
+        start_time = time.perf_counter()
+        if batch:
+            llm_results = check_consensus_with_llm_batch(
+                llm_predictions,
+                api_keys,
+                max_prompt_tokens=max_prompt_tokens,
+                cancel_token=cancel_token,
+            )
+        else:
+            llm_results = check_consensus_with_llm(llm_predictions, api_keys, cancel_token)
+        stats["llm"]["time"] += time.perf_counter() - start_time
+
+        llm_consensus, llm_proportion, llm_entropy = llm_results
+        for cluster in llm_consensus:
+            if tiered and cluster not in undecided:
+                continue
+            consensus[cluster] = llm_consensus[cluster]
+            consensus_proportion[cluster] = llm_proportion.get(cluster, 0.0)
+            entropy[cluster] = llm_entropy.get(cluster, 0.0)
+            stats["llm"]["clusters"] += 1
+
+    if tiered:
+        write_log(
+            "Consensus tiers: "
+            + ", ".join(
+                f"{tier}={stats[tier]['clusters']} ({stats[tier]['time']:.3f}s)"
+                for tier in CONSENSUS_TIERS
+            )
+        )
+    if tier_stats is not None:
+        tier_stats.update(stats)
+
+    # Find controversial clusters based on both consensus proportion and entropy
+    controversial = [
+        cluster
+        for cluster, score in consensus_proportion.items()
+        if score < consensus_threshold or entropy.get(cluster, 0) > entropy_threshold
+    ]
+
+    return consensus, consensus_proportion, entropy, controversial
+
+
+def _parse_batch_discussion_response(response: str) -> dict[str, dict[str, Any]]:
+    """Parse the JSON reply of a batched discussion round.
+
+    Args:
+        response: Raw LLM response
+
+    Returns:
+        dict[str, dict[str, Any]]: Dictionary mapping cluster IDs to verdicts with the
+            keys 'cell_type', 'consensus_proportion', 'entropy' and 'reasoning'
+
+    """
+    parsed = {}
+    for entry in _extract_cluster_entries(response, "batch discussion"):
+        cell_type = clean_annotation(str(entry.get("cell_type", "")))
+        if not cell_type:
+            continue
+        verdict = {
+            "cell_type": cell_type,
+            "consensus_proportion": None,
+            "entropy": None,
+            "reasoning": str(entry.get("reasoning", "")).strip(),
+        }
+        for key in ("consensus_proportion", "entropy"):
+            with contextlib.suppress(KeyError, TypeError, ValueError):
+                verdict[key] = float(entry[key])
+        parsed[str(entry["cluster"])] = verdict
+
+    return parsed
+
+
+def _process_controversial_clusters_batch(
+    marker_genes: dict[str, list[str]],
+    controversial_clusters: list[str],
+    model_predictions: dict[str, dict[str, str]],
+    species: str,
+    tissue: Optional[str],
+    request: Callable[[str], str],
+    max_discussion_rounds: int,
+    consensus_threshold: float,
+    entropy_threshold: float,
+    max_prompt_tokens: int,
+) -> tuple[dict[str, str], dict[str, list[str]], dict[str, float], dict[str, float]]:
+    """Discuss controversial clusters in batches, one request per batch and round.
+
+    Clusters that reach consensus drop out of the following rounds. request sends
+    a prompt to the discussion model; see process_controversial_clusters for the
+    other arguments and the return values.
+    """
+    from .prompts import DEFAULT_BATCH_DISCUSSION_TEMPLATE, format_discussion_block
+
+    results = {}
+    discussion_history = {}
+    updated_consensus_proportion = {}
+    updated_entropy = {}
+
+    model_votes = {}
+    for cluster_id in controversial_clusters:
+        if not marker_genes.get(cluster_id):
+            write_log(
+                f"Warning: No marker genes found for cluster {cluster_id}",
+                level="warning",
+            )
+            results[cluster_id] = "Unknown (no markers)"
+            discussion_history[cluster_id] = ["No marker genes found for this cluster"]
+            continue
+
+        model_votes[cluster_id] = {
+            model_name: predictions.get(cluster_id, "Unknown")
+            for model_name, predictions in model_predictions.items()
+            if cluster_id in predictions
+        }
+        _, cp, h = _simple_consensus(
+            [clean_annotation(vote) for vote in model_votes[cluster_id].values()]
+        )
+        discussion_history[cluster_id] = [
+            f"Initial votes: {model_votes[cluster_id]}\n"
+            f"Consensus Proportion (CP): {cp:.2f}\nShannon Entropy (H): {h:.2f}"
+        ]
+
+    active = list(model_votes)
+    last_verdicts = {}
+    previous_discussion = {}
+
+    for current_round in range(1, max_discussion_rounds + 1):
+        if not active:
+            break
+
+        chunks = _chunk_clusters_by_tokens(
+            {cluster_id: cluster_id for cluster_id in active},
+            max_prompt_tokens,
+            template=DEFAULT_BATCH_DISCUSSION_TEMPLATE,
+            format_block=lambda cluster_id, _: format_discussion_block(
+                cluster_id,
+                marker_genes[cluster_id],
+                model_votes[cluster_id],
+                previous_discussion.get(cluster_id),
+            ),
+        )
+        write_log(
+            f"Starting batched discussion round {current_round} for {len(active)} clusters "
+            f"in {len(chunks)} requests"
+        )
+
+        still_active = []
+        for chunk in chunks:
+            prompt = create_batch_discussion_prompt(
+                marker_genes={cluster_id: marker_genes[cluster_id] for cluster_id in chunk},
+                model_votes=model_votes,
+                species=species,
+                tissue=tissue,
+                previous_discussion=previous_discussion,
+            )
+            try:
+                with start_span("discussion.batch", round=current_round, clusters=len(chunk)):
+                    response = request(prompt)
+                verdicts = _parse_batch_discussion_response(response)
+            except (
+                DeadlineExceeded,
+                requests.RequestException,
+                CircuitOpenError,
+                ValueError,
+                KeyError,
+                json.JSONDecodeError,
+                AttributeError,
+            ) as e:
+                write_log(
+                    f"Error during batched discussion round {current_round}: {str(e)}",
+                    level="error",
+                )
+                verdicts = {}
+
+            for cluster_id in chunk:
+                verdict = verdicts.get(str(cluster_id))
+                if not verdict:
+                    discussion_history[cluster_id].append(
+                        f"Round {current_round} Discussion:\nNo verdict returned for this cluster"
+                    )
+                    still_active.append(cluster_id)
+                    continue
+
+                last_verdicts[cluster_id] = verdict
+                cp_value = verdict["consensus_proportion"]
+                h_value = verdict["entropy"]
+                round_summary = (
+                    f"Round {current_round} Discussion:\n{verdict['reasoning']}\n\n"
+                    f"Proposed cell type: {verdict['cell_type']}"
+                )
+                if cp_value is not None and h_value is not None:
+                    round_summary += (
+                        f"\nConsensus Proportion (CP): {cp_value:.2f}"
+                        f"\nShannon Entropy (H): {h_value:.2f}"
+                    )
+                discussion_history[cluster_id].append(round_summary)
+
+                if (
+                    cp_value is not None
+                    and h_value is not None
+                    and cp_value >= consensus_threshold
+                    and h_value <= entropy_threshold
+                ):
+                    results[cluster_id] = verdict["cell_type"]
+                    updated_consensus_proportion[cluster_id] = cp_value
+                    updated_entropy[cluster_id] = h_value
+                    discussion_history[cluster_id].append(
+                        f"Consensus reached in round {current_round}\n"
+                        f"Final cell type: {verdict['cell_type']}"
+                    )
+                    write_log(
+                        f"Consensus reached for cluster {cluster_id} in round {current_round}"
+                    )
+                else:
+                    previous_discussion[cluster_id] = (
+                        f"proposed {verdict['cell_type']}. {verdict['reasoning']}".strip()
+                    )
+                    still_active.append(cluster_id)
+
+        active = still_active
+
+    # Clusters without consensus keep their last verdict, if any
+    for cluster_id in active:
+        verdict = last_verdicts.get(cluster_id)
+        if verdict:
+            results[cluster_id] = verdict["cell_type"]
+            updated_consensus_proportion[cluster_id] = (
+                verdict["consensus_proportion"]
+                if verdict["consensus_proportion"] is not None
+                else 0.75
+            )
+            updated_entropy[cluster_id] = (
+                verdict["entropy"] if verdict["entropy"] is not None else 0.5
+            )
+        else:
+            write_log(
+                f"Warning: Could not reach a decision for cluster {cluster_id} "
+                f"after {max_discussion_rounds} rounds",
+                level="warning",
+            )
+            results[cluster_id] = "Inconclusive"
+            updated_consensus_proportion[cluster_id] = 0.5
+            updated_entropy[cluster_id] = 1.0
+
+    return results, discussion_history, updated_consensus_proportion, updated_entropy
+
+
+def _compact_discussion_state(
+    round_number: int,
+    response: str,
+    proposed_cell_type: Optional[str],
+    model_votes: dict[str, str],
+    cluster_markers: list[str],
+    max_tokens: int,
+) -> str:
+    """Reduce a discussion round to a compact state carried into the next round.
+
+    The state keeps the current votes, the proposed cell type, the marker genes
+    cited as evidence and the consensus metrics, followed by as much of a summary
+    of the round as fits into max_tokens.
+
+    Args:
+        round_number: Number of the discussion round
+        response: Full response of the discussion round
+        proposed_cell_type: Cell type proposed in the round
+        model_votes: Dictionary mapping model names to cell type annotations
+        cluster_markers: List of marker genes for the cluster
+        max_tokens: Maximum estimated tokens of the state
+
+    Returns:
+        str: Compact discussion state
+
+    """
+    from .utils import estimate_tokens
+
+    votes_text = "; ".join(f"{model}: {vote}" for model, vote in model_votes.items())
+    response_upper = response.upper()
+    evidence = [
+        gene
+        for gene in cluster_markers
+        if re.search(rf"\b{re.escape(gene.upper())}\b", response_upper)
+    ]
+
+    lines = [
+        f"Round {round_number} state:",
+        f"Current votes: {votes_text}",
+        f"Proposed cell type: {proposed_cell_type or 'Unclear'}",
+        f"Key evidence genes: {', '.join(evidence) if evidence else 'none cited'}",
+    ]
+    cp_value, h_value = extract_consensus_metrics_from_discussion(response)
+    if cp_value is not None and h_value is not None:
+        lines.append(
+            f"Consensus Proportion (CP): {cp_value:.2f}, Shannon Entropy (H): {h_value:.2f}"
+        )
+    state = "\n".join(lines)
+
+    # Add as much of the summary as the budget allows
+    remaining_chars = (max_tokens - estimate_tokens(state)) * 4 - len("\nSummary: ")
+    if remaining_chars > 0:
+        summary = " ".join(summarize_discussion(response).split())
+        if len(summary) > remaining_chars:
+            summary = summary[: max(remaining_chars - 3, 0)].rstrip() + "..."
+        state += f"\nSummary: {summary}"
+
+    return state
+
+
+# Discussion models preferred when present in the model list, most capable first
+PREFERRED_DISCUSSION_MODELS = ["gpt-4o", "claude-3-opus", "gemini-2.0-pro"]
+
+# Strategies for spreading discussion requests across several models
+POOL_STRATEGIES = ("round_robin", "least_loaded")
+
+
+class _DiscussionModelPool:
+    """Spread discussion requests across several discussion models.
+
+    Every discussion prompt carries its own context, so consecutive steps of the
+    same cluster may go to different models. Models whose circuit breaker is
+    open get no requests while another model of the pool is available.
+    """
+
+    def __init__(
+        self,
+        members: list[dict[str, str]],
+        strategy: str = "round_robin",
+        use_cache: bool = True,
+        cache_dir: Optional[str] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> None:
+        """Set up the pool.
+
+        Args:
+            members: Discussion models, each a dictionary with 'provider', 'model'
+                and 'api_key'
+            strategy: 'round_robin' or 'least_loaded'
+            use_cache: Whether to use cache
+            cache_dir: Directory to store cache files
+            cancel_token: Optional cancellation token of the run
+
+        """
+        if not members:
+            raise ValueError("Discussion model pool needs at least one model")
+        if strategy not in POOL_STRATEGIES:
+            raise ValueError(f"Unknown pool strategy: {strategy}")
+
+        self.members = members
+        self.strategy = strategy
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+        self.cancel_token = cancel_token
+        self.in_flight = [0] * len(members)
+        self.served = [0] * len(members)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> int:
+        # Members whose circuit is open are skipped while any other is available
+        available = [
+            get_circuit_breaker(member["provider"], member["model"]).available
+            for member in self.members
+        ]
+        if not any(available):
+            available = [True] * len(self.members)
+        with self._lock:
+            if self.strategy == "round_robin":
+                index = self._next
+                while not available[index]:
+                    index = (index + 1) % len(self.members)
+                self._next = (index + 1) % len(self.members)
+            else:
+                index = min(
+                    (i for i in range(len(self.members)) if available[i]),
+                    key=lambda i: (self.in_flight[i], self.served[i]),
+                )
+            self.in_flight[index] += 1
+            self.served[index] += 1
+            return index
+
+    def request(self, prompt: str) -> str:
+        """Send a prompt to the next discussion model.
+
+        Args:
+            prompt: The prompt to send
+
+        Returns:
+            str: The model response
+
+        """
+        from .annotate import get_model_response
+
+        index = self._acquire()
+        member = self.members[index]
+        try:
+            return get_model_response(
+                prompt,
+                member["provider"],
+                member["model"],
+                member.get("api_key"),
+                self.use_cache,
+                self.cache_dir,
+                cancel_token=self.cancel_token,
+            )
+        finally:
+            with self._lock:
+                self.in_flight[index] -= 1
+
+
+def _discuss_cluster(
+    cluster_id: str,
+    marker_genes: dict[str, list[str]],
+    model_predictions: dict[str, dict[str, str]],
+    species: str,
+    tissue: Optional[str],
+    max_discussion_rounds: int,
+    consensus_threshold: float,
+    entropy_threshold: float,
+    max_context_tokens: Optional[int],
+    results: dict[str, str],
+    discussion_history: dict[str, list[str]],
+    updated_consensus_proportion: dict[str, float],
+    updated_entropy: dict[str, float],
+    step_spans: Optional[dict[str, Any]] = None,
+) -> Generator[str, str, None]:
+    """Run the discussion of one controversial cluster step by step.
+
+    Each LLM request is yielded as a prompt and its response is sent back into the
+    generator, so the caller decides when and how requests are made. The outcome
+    is written into the given result dictionaries.
+
+    Args:
+        cluster_id: ID of the cluster to discuss
+        marker_genes: Dictionary mapping cluster names to lists of marker genes
+        model_predictions: Dictionary mapping model names to dictionaries of
+            cluster annotations
+        species: Species name (e.g., 'human', 'mouse')
+        tissue: Optional tissue name (e.g., 'brain', 'liver')
+        max_discussion_rounds: Maximum number of discussion rounds
+        consensus_threshold: Agreement threshold for determining when consensus is reached
+        entropy_threshold: Entropy threshold for determining when consensus is reached
+        max_context_tokens: Optional token budget for follow-up discussion prompts
+        results: Dictionary receiving the resolved annotation
+        discussion_history: Dictionary receiving the discussion history
+        updated_consensus_proportion: Dictionary receiving the consensus proportion
+        updated_entropy: Dictionary receiving the entropy
+        step_spans: Optional dictionary receiving the trace span of the round whose
+            prompt was yielded last, so the caller can send the request within it
+
+    Yields:
+        str: Prompts to send to the discussion model
+
+    """
+    from .prompts import create_consensus_check_prompt
+    from .utils import estimate_tokens
+
+    write_log(f"Processing controversial cluster {cluster_id}")
+
+    # Get marker genes for this cluster
+    cluster_markers = marker_genes.get(cluster_id, [])
+    if not cluster_markers:
+        write_log(
+            f"Warning: No marker genes found for cluster {cluster_id}",
+            level="warning",
+        )
+        results[cluster_id] = "Unknown (no markers)"
+        discussion_history[cluster_id] = ["No marker genes found for this cluster"]
+        return
+
+    # Get model predictions for this cluster
+    model_votes = {
+        model: predictions.get(cluster_id, "Unknown")
+        for model, predictions in model_predictions.items()
+        if cluster_id in predictions
+    }
+
+    # Initialize variables for iterative discussion
+    current_round = 1
+    carried_state = None
+    consensus_reached = False
+    final_decision = None
+    rounds_history = []
+    current_votes = model_votes.copy()
+
+    # Create initial consensus check prompt for LLM to calculate metrics
+
+    # Get all annotations for this cluster
+    annotations = list(current_votes.values())
+
+    # Create prompt for LLM to check consensus
+    consensus_check_prompt = create_consensus_check_prompt(annotations)
+
+    # The initial consensus check is traced as round 0
+    if step_spans is None:
+        step_spans = {}
+    cluster_span = start_span("discussion.cluster", cluster=cluster_id)
+    round_span = start_span("discussion.round", parent=cluster_span, round=0)
+    step_spans[cluster_id] = round_span
+
+    # Get response from LLM
+    try:
+        consensus_check_response = yield consensus_check_prompt
+    except (requests.RequestException, CircuitOpenError, ValueError) as e:
+        # A failed request fails this cluster, as in the discussion rounds below
+        round_span.end(e)
+        cluster_span.end(e)
+        write_log(
+            f"Error during discussion for cluster {cluster_id}: {str(e)}",
+            level="error",
+        )
+        results[cluster_id] = f"Error during discussion: {str(e)}"
+        discussion_history[cluster_id] = [f"Error occurred: {str(e)}"]
+        return
+    except BaseException as e:
+        round_span.end(e)
+        cluster_span.end(e)
+        raise
+    round_span.end()
+
+    # Parse response to get consensus metrics
+    try:
+        lines = consensus_check_response.strip().split("\n")
+        if len(lines) >= 3:
+            # Extract consensus proportion
+            cp = float(lines[1].strip())
+
+            # Extract entropy value
+            h = float(lines[2].strip())
+
+            write_log(
+                f"Initial metrics for cluster {cluster_id} (LLM calculated): CP={cp:.2f}, H={h:.2f}"
+            )
+        else:
+            # Fallback if LLM response format is unexpected
+            cp = 0.25  # Low consensus to ensure discussion happens
+            h = 2.0  # High entropy to indicate uncertainty
+            write_log(
+                f"Could not parse LLM consensus check response, using default values: CP={cp:.2f}, H={h:.2f}",
+                level="warning",
+            )
+    except (ValueError, IndexError, AttributeError, TypeError) as e:
+        # Fallback if parsing fails
+        cp = 0.25  # Low consensus to ensure discussion happens
+        h = 2.0  # High entropy to indicate uncertainty
+        write_log(
+            f"Error parsing LLM consensus check response: {str(e)}, using default values: CP={cp:.2f}, H={h:.2f}",
+            level="warning",
+        )
+
+    rounds_history.append(
+        f"Initial votes: {current_votes}\nConsensus Proportion (CP): {cp:.2f}\nShannon Entropy (H): {h:.2f}"
+    )
+
+    # Start iterative discussion process
+    try:
+        while current_round <= max_discussion_rounds and not consensus_reached:
+            write_log(f"Starting discussion round {current_round} for cluster {cluster_id}")
+            round_span = start_span("discussion.round", parent=cluster_span, round=current_round)
+            step_spans[cluster_id] = round_span
+
+            # Generate discussion prompt based on current round
+            if current_round == 1:
+                # Initial discussion round
+                prompt = create_discussion_prompt(
+                    cluster_id=cluster_id,
+                    marker_genes=cluster_markers,
+                    model_votes=current_votes,
+                    species=species,
+                    tissue=tissue,
+                )
+            else:
+                # Follow-up rounds include previous discussion
+                prompt = create_discussion_prompt(
+                    cluster_id=cluster_id,
+                    marker_genes=cluster_markers,
+                    model_votes=current_votes,
+                    species=species,
+                    tissue=tissue,
+                    previous_discussion=carried_state or rounds_history[-1],
+                )
+
+            # Get response for this round
+            response = yield prompt
+
+            # Extract potential decision from this round
+            round_decision = extract_cell_type_from_discussion(response)
+
+            # Record this round's discussion
+            round_summary = f"Round {current_round} Discussion:\n{response}\n\nProposed cell type: {round_decision or 'Unclear'}"
+            rounds_history.append(round_summary)
+
+            # Carry a compact state instead of the full text into the next round
+            if max_context_tokens is not None:
+                base_tokens = estimate_tokens(
+                    create_discussion_prompt(
                         cluster_id=cluster_id,
                         marker_genes=cluster_markers,
                         model_votes=current_votes,
                         species=species,
                         tissue=tissue,
-                        previous_discussion=rounds_history[-1],
+                        previous_discussion="",
                     )
+                )
+                carried_state = _compact_discussion_state(
+                    current_round,
+                    response,
+                    round_decision,
+                    current_votes,
+                    cluster_markers,
+                    max(max_context_tokens - base_tokens - 10, 0),
+                )
 
-                # Get response for this round
-                response = get_model_response(
-                    prompt, provider, discussion_model, api_key, use_cache, cache_dir
+            # Check if we've reached consensus
+            if current_round < max_discussion_rounds and round_decision:
+                # Create a consensus check prompt
+                consensus_prompt = create_discussion_consensus_check_prompt(
+                    cluster_id=cluster_id,
+                    discussion=response,
+                    proposed_cell_type=round_decision,
                 )
 
-                # Extract potential decision from this round
-                round_decision = extract_cell_type_from_discussion(response)
+                # Get consensus check response
+                consensus_response = yield consensus_prompt
 
-                # Record this round's discussion
-                round_summary = f"Round {current_round} Discussion:\n{response}\n\nProposed cell type: {round_decision or 'Unclear'}"
-                rounds_history.append(round_summary)
+                # Add consensus checker result to history
+                rounds_history.append(f"Consensus Check {current_round}:\n{consensus_response}")
 
-                # Check if we've reached consensus
-                if current_round < max_discussion_rounds and round_decision:
-                    # Create a consensus check prompt
-                    consensus_prompt = create_discussion_consensus_check_prompt(
-                        cluster_id=cluster_id,
-                        discussion=response,
-                        proposed_cell_type=round_decision,
+                # Previously had consensus indicators check here, now using metrics extraction
+
+                # Extract consensus proportion and entropy values for the current round
+                cp_value, h_value = extract_consensus_metrics_from_discussion(response)
+
+                # If unable to extract from discussion, try to extract from consensus check response
+                if cp_value is None or h_value is None:
+                    cp_value, h_value = extract_consensus_metrics_from_discussion(
+                        consensus_response
                     )
 
-                    # Get consensus check response
-                    consensus_response = get_model_response(
-                        consensus_prompt,
-                        provider,
-                        discussion_model,
-                        api_key,
-                        use_cache,
-                        cache_dir,
+                # If still unable to extract, use default values
+                if cp_value is None:
+                    cp_value = 0.5  # Default medium consensus proportion
+                    write_log(
+                        f"Could not extract consensus proportion for cluster {cluster_id} "
+                        f"in round {current_round}, using default value: {cp_value}",
+                        level="warning",
                     )
 
-                    # Add consensus checker result to history
-                    rounds_history.append(f"Consensus Check {current_round}:\n{consensus_response}")
+                if h_value is None:
+                    h_value = 1.0  # Default medium entropy value
+                    write_log(
+                        f"Could not extract entropy for cluster {cluster_id} "
+                        f"in round {current_round}, using default value: {h_value}",
+                        level="warning",
+                    )
 
-                    # Previously had consensus indicators check here, now using metrics extraction
+                # Use consensus proportion and entropy values to compare with thresholds
+                consensus_reached = cp_value >= consensus_threshold and h_value <= entropy_threshold
+                write_log(
+                    f"Consensus check for cluster {cluster_id} in round {current_round}: "
+                    f"CP={cp_value:.2f}, H={h_value:.2f}, threshold CP>={consensus_threshold:.2f}, "
+                    f"H<={entropy_threshold:.2f}",
+                    level="info",
+                )
+
+                if consensus_reached:
+                    final_decision = round_decision
+                    write_log(
+                        f"Consensus reached for cluster {cluster_id} in round {current_round}",
+                        level="info",
+                    )
 
-                    # Extract consensus proportion and entropy values for the current round
+                    # Extract CP and H from the discussion if available
                     cp_value, h_value = extract_consensus_metrics_from_discussion(response)
+                    if cp_value is not None and h_value is not None:
+                        updated_consensus_proportion[cluster_id] = cp_value
+                        updated_entropy[cluster_id] = h_value
+                    else:
+                        # If not found in discussion, set high consensus values
+                        updated_consensus_proportion[cluster_id] = 1.0
+                        updated_entropy[cluster_id] = 0.0
+
+                    rounds_history.append(
+                        f"Consensus reached in round {current_round}\n"
+                        f"Final cell type: {final_decision}\n"
+                        f"Consensus Proportion (CP): {updated_consensus_proportion[cluster_id]:.2f}\n"
+                        f"Shannon Entropy (H): {updated_entropy[cluster_id]:.2f}"
+                    )
+
+            round_span.end()
+
+            # Move to next round if no consensus yet
+            if not consensus_reached:
+                current_round += 1
+
+        # After all rounds, use the last round's decision if no consensus was reached
+        if not final_decision:
+            # Try to extract majority_prediction from the last consensus check
+            if rounds_history and len(rounds_history) >= 1:
+                # Get the response from the last consensus check
+                last_consensus_check = consensus_response
+
+                # Try to extract majority_prediction
+                try:
+                    lines = last_consensus_check.strip().split("\n")
+                    lines = [line.strip() for line in lines if line.strip()]
+
+                    # If it's the standard format (4 lines), the 4th line should be the
+                    # majority_prediction
+                    if (
+                        len(lines) >= 4
+                        and re.match(r"^\s*[01]\s*$", lines[0])
+                        and re.match(r"^\s*(0\.\d+|1\.0*|1)\s*$", lines[1])
+                    ):
+                        majority_prediction = lines[3].strip()
+                        if majority_prediction and majority_prediction != "Unknown":
+                            final_decision = clean_annotation(majority_prediction)
+                            write_log(
+                                f"Using majority prediction from last consensus check "
+                                f"for cluster {cluster_id}: {final_decision}",
+                                level="info",
+                            )
+                except (KeyError, ValueError, AttributeError, IndexError) as e:
+                    write_log(
+                        f"Error extracting majority prediction: {str(e)}",
+                        level="warning",
+                    )
+
+            # If unable to extract majority_prediction, use the decision from the
+            # last round
+            if not final_decision and round_decision:
+                final_decision = round_decision
+                write_log(
+                    f"Using final round decision for cluster {cluster_id} "
+                    f"after {max_discussion_rounds} rounds",
+                    level="info",
+                )
+
+        # Store the final result
+        if not final_decision:
+            write_log(
+                f"Warning: Could not reach a decision for cluster {cluster_id} "
+                f"after {max_discussion_rounds} rounds",
+                level="warning",
+            )
+            results[cluster_id] = "Inconclusive"
+            # For inconclusive results, extract metrics from the last round
+            # if available
+            if rounds_history:
+                last_round = rounds_history[-1]
+                cp_value, h_value = extract_consensus_metrics_from_discussion(last_round)
+                if cp_value is not None and h_value is not None:
+                    updated_consensus_proportion[cluster_id] = cp_value
+                    updated_entropy[cluster_id] = h_value
+                else:
+                    # If not found, set high uncertainty values
+                    updated_consensus_proportion[cluster_id] = 0.5
+                    updated_entropy[cluster_id] = 1.0
+            else:
+                # If no discussion history, set high uncertainty values
+                updated_consensus_proportion[cluster_id] = 0.5
+                updated_entropy[cluster_id] = 1.0
+        else:
+            results[cluster_id] = final_decision
+            # If consensus wasn't explicitly reached but we have a final decision
+            # Extract metrics from the last round if available
+            if cluster_id not in updated_consensus_proportion and rounds_history:
+                last_round = rounds_history[-1]
+                cp_value, h_value = extract_consensus_metrics_from_discussion(last_round)
+                if cp_value is not None and h_value is not None:
+                    updated_consensus_proportion[cluster_id] = cp_value
+                    updated_entropy[cluster_id] = h_value
+                else:
+                    # If not found, set reasonable default values
+                    updated_consensus_proportion[cluster_id] = 0.75
+                    updated_entropy[cluster_id] = 0.5
+
+        # Store the full discussion history
+        discussion_history[cluster_id] = rounds_history
+
+    except (
+        requests.RequestException,
+        CircuitOpenError,
+        ValueError,
+        KeyError,
+        json.JSONDecodeError,
+        AttributeError,
+    ) as e:
+        write_log(
+            f"Error during discussion for cluster {cluster_id}: {str(e)}",
+            level="error",
+        )
+        results[cluster_id] = f"Error during discussion: {str(e)}"
+        discussion_history[cluster_id] = [f"Error occurred: {str(e)}"]
+    finally:
+        round_span.end()
+        cluster_span.end()
+
+
+def _request_in_step_span(
+    request: Callable[[str], str], step_spans: dict[str, Any], cluster_id: str
+) -> Callable[[str], str]:
+    """Wrap a discussion request so it runs in the span of the cluster's current round.
+
+    Args:
+        request: Function sending a prompt to the discussion model
+        step_spans: Dictionary filled by _discuss_cluster
+        cluster_id: ID of the discussed cluster
+
+    Returns:
+        Callable[[str], str]: The wrapped request function
+
+    """
+
+    def send(prompt: str) -> str:
+        with use_span(step_spans.get(cluster_id)):
+            return request(prompt)
+
+    return send
+
+
+def _run_discussion(discussion: Generator[str, str, None], request: Callable[[str], str]) -> None:
+    """Drive a cluster discussion to completion, one request at a time.
+
+    If the run's deadline passes, the discussion is closed without a result.
+
+    Args:
+        discussion: Generator returned by _discuss_cluster
+        request: Function sending a prompt to the discussion model
+
+    """
+    try:
+        prompt = next(discussion)
+        while True:
+            try:
+                response = request(prompt)
+            except DeadlineExceeded:
+                discussion.close()
+                return
+            except Exception as e:
+                prompt = discussion.throw(e)
+            else:
+                prompt = discussion.send(response)
+    except StopIteration:
+        pass
+
+
+def _run_discussions_pipelined(
+    discussions: dict[str, Generator[str, str, None]],
+    requests_by_cluster: dict[str, Callable[[str], str]],
+    max_in_flight: int,
+) -> None:
+    """Drive many cluster discussions with a fixed number of requests in flight.
+
+    Every step of a discussion depends only on the previous step of the same
+    cluster, so whenever a request finishes, the next step of that cluster is
+    queued and the freed slot goes to the next waiting step of any cluster.
+
+    Args:
+        discussions: Dictionary mapping cluster IDs to generators from _discuss_cluster
+        requests_by_cluster: Dictionary mapping cluster IDs to functions sending a
+            prompt of that cluster to the discussion model
+        max_in_flight: Maximum number of concurrent requests
+
+    """
+    ready = deque()
+    for cluster_id, discussion in discussions.items():
+        with contextlib.suppress(StopIteration):
+            ready.append((cluster_id, next(discussion)))
+
+    write_log(
+        f"Pipelining discussions of {len(discussions)} clusters "
+        f"with up to {max_in_flight} requests in flight"
+    )
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        in_flight = {}
+        while ready or in_flight:
+            while ready and len(in_flight) < max_in_flight:
+                cluster_id, prompt = ready.popleft()
+                in_flight[executor.submit(requests_by_cluster[cluster_id], prompt)] = cluster_id
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                cluster_id = in_flight.pop(future)
+                discussion = discussions[cluster_id]
+                try:
+                    error = future.exception()
+                    if isinstance(error, DeadlineExceeded):
+                        discussion.close()
+                        continue
+                    if error is not None:
+                        next_prompt = discussion.throw(error)
+                    else:
+                        next_prompt = discussion.send(future.result())
+                except StopIteration:
+                    continue
+                ready.append((cluster_id, next_prompt))
+
+
+def process_controversial_clusters(
+    marker_genes: dict[str, list[str]],
+    controversial_clusters: list[str],
+    model_predictions: dict[str, dict[str, str]],
+    species: str,
+    tissue: Optional[str] = None,
+    provider: str = "openai",
+    model: Optional[str] = None,
+    api_key: Optional[str] = None,
+    max_discussion_rounds: int = 3,
+    consensus_threshold: float = 0.7,
+    entropy_threshold: float = 1.0,
+    use_cache: bool = True,
+    cache_dir: Optional[str] = None,
+    batch_discussion: bool = False,
+    max_prompt_tokens: int = 3000,
+    max_context_tokens: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    discussion_pool: Optional[list[dict[str, str]]] = None,
+    pool_strategy: str = "round_robin",
+    cancel_token: Optional[CancellationToken] = None,
+) -> tuple[dict[str, str], dict[str, list[str]], dict[str, float], dict[str, float]]:
+    """Process controversial clusters by facilitating a discussion between models.
 
-                    # If unable to extract from discussion, try to extract from consensus check response
-                    if cp_value is None or h_value is None:
-                        cp_value, h_value = extract_consensus_metrics_from_discussion(
-                            consensus_response
-                        )
+    Args:
+        marker_genes: Dictionary mapping cluster names to lists of marker genes
+        controversial_clusters: List of controversial cluster IDs
+        model_predictions: Dictionary mapping model names to dictionaries of
+            cluster annotations
+        species: Species name (e.g., 'human', 'mouse')
+        tissue: Optional tissue name (e.g., 'brain', 'liver')
+        provider: LLM provider for the discussion
+        model: Model name for the discussion
+        api_key: API key for the provider
+        max_discussion_rounds: Maximum number of discussion rounds for controversial clusters
+        consensus_threshold: Agreement threshold for determining when consensus is reached
+        entropy_threshold: Entropy threshold for determining when consensus is reached
+        use_cache: Whether to use cache
+        cache_dir: Directory to store cache files
+        batch_discussion: Whether to discuss several clusters per request and round,
+            with structured per-cluster verdicts
+        max_prompt_tokens: Maximum estimated prompt tokens per batched discussion request
+        max_context_tokens: If set, follow-up discussion prompts carry a compact state of
+            the previous round (votes, proposed type, evidence genes and a summary)
+            instead of its full text, keeping each prompt within this many tokens
+        max_in_flight: If greater than 1, interleave the discussion steps of all
+            clusters and keep up to this many requests in flight at once. Defaults
+            to the size of discussion_pool if one is given
+        discussion_pool: Optional list of discussion models, each a dictionary with
+            'provider', 'model' and 'api_key'. If given, requests are spread across
+            these models instead of going to provider/model
+        pool_strategy: How requests are spread across discussion_pool: 'round_robin'
+            or 'least_loaded' (fewest requests in flight)
+        cancel_token: Optional cancellation token of the run. Once it is cancelled,
+            pending requests are abandoned and clusters whose discussion did not
+            finish are left out of the resolved annotations.
 
-                    # If still unable to extract, use default values
-                    if cp_value is None:
-                        cp_value = 0.5  # Default medium consensus proportion
-                        write_log(
-                            f"Could not extract consensus proportion for cluster {cluster_id} "
-                            f"in round {current_round}, using default value: {cp_value}",
-                            level="warning",
-                        )
+    Returns:
+        tuple[dict[str, str], dict[str, list[str]], dict[str, float], dict[str, float]]:
+            - Dictionary mapping cluster IDs to resolved annotations
+            - Dictionary mapping cluster IDs to discussion history for each round
+            - Dictionary mapping cluster IDs to updated consensus proportion scores
+            - Dictionary mapping cluster IDs to updated entropy scores
 
-                    if h_value is None:
-                        h_value = 1.0  # Default medium entropy value
-                        write_log(
-                            f"Could not extract entropy for cluster {cluster_id} "
-                            f"in round {current_round}, using default value: {h_value}",
-                            level="warning",
-                        )
+    """
 
-                    # Use consensus proportion and entropy values to compare with thresholds
-                    consensus_reached = (
-                        cp_value >= consensus_threshold and h_value <= entropy_threshold
-                    )
-                    write_log(
-                        f"Consensus check for cluster {cluster_id} in round {current_round}: "
-                        f"CP={cp_value:.2f}, H={h_value:.2f}, threshold CP>={consensus_threshold:.2f}, "
-                        f"H<={entropy_threshold:.2f}",
-                        level="info",
-                    )
+    from .annotate import get_model_response
 
-                    if consensus_reached:
-                        final_decision = round_decision
-                        write_log(
-                            f"Consensus reached for cluster {cluster_id} in round {current_round}",
-                            level="info",
-                        )
+    results = {}
+    discussion_history = {}
+    updated_consensus_proportion = {}
+    updated_entropy = {}
 
-                        # Extract CP and H from the discussion if available
-                        cp_value, h_value = extract_consensus_metrics_from_discussion(response)
-                        if cp_value is not None and h_value is not None:
-                            updated_consensus_proportion[cluster_id] = cp_value
-                            updated_entropy[cluster_id] = h_value
-                        else:
-                            # If not found in discussion, set high consensus values
-                            updated_consensus_proportion[cluster_id] = 1.0
-                            updated_entropy[cluster_id] = 0.0
-
-                        rounds_history.append(
-                            f"Consensus reached in round {current_round}\n"
-                            f"Final cell type: {final_decision}\n"
-                            f"Consensus Proportion (CP): {updated_consensus_proportion[cluster_id]:.2f}\n"
-                            f"Shannon Entropy (H): {updated_entropy[cluster_id]:.2f}"
-                        )
+    if discussion_pool:
+        # Without pipelining only one request is in flight, so the pool would idle
+        if max_in_flight is None:
+            max_in_flight = len(discussion_pool)
+        request = _DiscussionModelPool(
+            discussion_pool,
+            strategy=pool_strategy,
+            use_cache=use_cache,
+            cache_dir=cache_dir,
+            cancel_token=cancel_token,
+        ).request
+    else:
+        # Use a more capable model for discussion if possible
+        discussion_model = model
+        if provider == "openai" and not discussion_model:
+            discussion_model = "gpt-4o"
+        elif provider == "anthropic" and not discussion_model:
+            discussion_model = "claude-3-opus"
 
-                # Move to next round if no consensus yet
-                if not consensus_reached:
-                    current_round += 1
-
-            # After all rounds, use the last round's decision if no consensus was reached
-            if not final_decision:
-                # Try to extract majority_prediction from the last consensus check
-                if rounds_history and len(rounds_history) >= 1:
-                    # Get the response from the last consensus check
-                    last_consensus_check = consensus_response
-
-                    # Try to extract majority_prediction
-                    try:
-                        lines = last_consensus_check.strip().split("\n")
-                        lines = [line.strip() for line in lines if line.strip()]
-
-                        # If it's the standard format (4 lines), the 4th line should be the
-                        # majority_prediction
-                        if (
-                            len(lines) >= 4
-                            and re.match(r"^\s*[01]\s*$", lines[0])
-                            and re.match(r"^\s*(0\.\d+|1\.0*|1)\s*$", lines[1])
-                        ):
-                            majority_prediction = lines[3].strip()
-                            if majority_prediction and majority_prediction != "Unknown":
-                                final_decision = clean_annotation(majority_prediction)
-                                write_log(
-                                    f"Using majority prediction from last consensus check "
-                                    f"for cluster {cluster_id}: {final_decision}",
-                                    level="info",
-                                )
-                    except (KeyError, ValueError, AttributeError, IndexError) as e:
-                        write_log(
-                            f"Error extracting majority prediction: {str(e)}",
-                            level="warning",
-                        )
+        def request(prompt: str) -> str:
+            return get_model_response(
+                prompt,
+                provider,
+                discussion_model,
+                api_key,
+                use_cache,
+                cache_dir,
+                cancel_token=cancel_token,
+            )
 
-                # If unable to extract majority_prediction, use the decision from the
-                # last round
-                if not final_decision and round_decision:
-                    final_decision = round_decision
-                    write_log(
-                        f"Using final round decision for cluster {cluster_id} "
-                        f"after {max_discussion_rounds} rounds",
-                        level="info",
-                    )
+    if batch_discussion:
+        return _process_controversial_clusters_batch(
+            marker_genes,
+            controversial_clusters,
+            model_predictions,
+            species,
+            tissue,
+            request,
+            max_discussion_rounds,
+            consensus_threshold,
+            entropy_threshold,
+            max_prompt_tokens,
+        )
 
-            # Store the final result
-            if not final_decision:
-                write_log(
-                    f"Warning: Could not reach a decision for cluster {cluster_id} "
-                    f"after {max_discussion_rounds} rounds",
-                    level="warning",
-                )
-                results[cluster_id] = "Inconclusive"
-                # For inconclusive results, extract metrics from the last round
-                # if available
-                if rounds_history:
-                    last_round = rounds_history[-1]
-                    cp_value, h_value = extract_consensus_metrics_from_discussion(last_round)
-                    if cp_value is not None and h_value is not None:
-                        updated_consensus_proportion[cluster_id] = cp_value
-                        updated_entropy[cluster_id] = h_value
-                    else:
-                        # If not found, set high uncertainty values
-                        updated_consensus_proportion[cluster_id] = 0.5
-                        updated_entropy[cluster_id] = 1.0
-                else:
-                    # If no discussion history, set high uncertainty values
-                    updated_consensus_proportion[cluster_id] = 0.5
-                    updated_entropy[cluster_id] = 1.0
-            else:
-                results[cluster_id] = final_decision
-                # If consensus wasn't explicitly reached but we have a final decision
-                # Extract metrics from the last round if available
-                if cluster_id not in updated_consensus_proportion and rounds_history:
-                    last_round = rounds_history[-1]
-                    cp_value, h_value = extract_consensus_metrics_from_discussion(last_round)
-                    if cp_value is not None and h_value is not None:
-                        updated_consensus_proportion[cluster_id] = cp_value
-                        updated_entropy[cluster_id] = h_value
-                    else:
-                        # If not found, set reasonable default values
-                        updated_consensus_proportion[cluster_id] = 0.75
-                        updated_entropy[cluster_id] = 0.5
+    step_spans = {}
+    discussions = {
+        cluster_id: _discuss_cluster(
+            cluster_id,
+            marker_genes,
+            model_predictions,
+            species,
+            tissue,
+            max_discussion_rounds,
+            consensus_threshold,
+            entropy_threshold,
+            max_context_tokens,
+            results,
+            discussion_history,
+            updated_consensus_proportion,
+            updated_entropy,
+            step_spans,
+        )
+        for cluster_id in controversial_clusters
+    }
+    requests_by_cluster = {
+        cluster_id: _request_in_step_span(request, step_spans, cluster_id)
+        if tracing_enabled()
+        else request
+        for cluster_id in controversial_clusters
+    }
 
-            # Store the full discussion history
-            discussion_history[cluster_id] = rounds_history
+    if max_in_flight and max_in_flight > 1:
+        _run_discussions_pipelined(discussions, requests_by_cluster, max_in_flight)
+    else:
+        for cluster_id, discussion in discussions.items():
+            _run_discussion(discussion, requests_by_cluster[cluster_id])
 
-        except (
-            requests.RequestException,
-            ValueError,
-            KeyError,
-            json.JSONDecodeError,
-            AttributeError,
-        ) as e:
-            write_log(
-                f"Error during discussion for cluster {cluster_id}: {str(e)}",
-                level="error",
+    for cluster_id in controversial_clusters:
+        if cluster_id not in results:
+            write_log(f"Discussion of cluster {cluster_id} stopped before it finished")
+            discussion_history.setdefault(cluster_id, []).append(
+                "Discussion stopped: run cancelled or deadline exceeded"
             )
-            results[cluster_id] = f"Error during discussion: {str(e)}"
-            discussion_history[cluster_id] = [f"Error occurred: {str(e)}"]
 
     return results, discussion_history, updated_consensus_proportion, updated_entropy
 
@@ -731,6 +1933,275 @@ def extract_cell_type_from_discussion(discussion: str) -> Optional[str]:
     return None
 
 
+# Rough token costs used to plan a budgeted consensus run
+BUDGET_PROMPT_TOKENS = 250
+BUDGET_ANSWER_TOKENS = 15
+BUDGET_DISCUSSION_TOKENS = 600
+BUDGET_CONTROVERSIAL_RATE = 0.25
+
+# Share of a time budget held back for single-model annotation of low-impact clusters
+LOW_IMPACT_TIME_SHARE = 0.2
+
+
+def _plan_budget(
+    marker_genes: dict[str, list[str]],
+    num_models: int,
+    token_budget: Optional[int] = None,
+    cluster_sizes: Optional[dict[str, int]] = None,
+    min_cluster_fraction: float = 0.02,
+    max_discussion_rounds: int = 3,
+) -> tuple[list[str], list[str], list[str], int]:
+    """Split clusters into full consensus, single-model and skipped work by impact.
+
+    Clusters are visited from the largest to the smallest. Clusters holding at least
+    min_cluster_fraction of all cells get full consensus while the token budget allows
+    it, smaller ones and those that no longer fit get single-model annotation, and
+    clusters that do not fit at all are skipped.
+
+    Args:
+        marker_genes: Dictionary mapping cluster names to lists of marker genes
+        num_models: Number of models taking part in full consensus
+        token_budget: Optional limit on the estimated number of tokens
+        cluster_sizes: Optional dictionary mapping cluster names to cell counts
+        min_cluster_fraction: Fraction of all cells below which a cluster is low-impact
+        max_discussion_rounds: Maximum number of discussion rounds per cluster
+
+    Returns:
+        tuple: (full consensus clusters, single-model clusters, skipped clusters,
+            estimated tokens)
+
+    """
+    from .utils import estimate_tokens
+
+    cluster_sizes = cluster_sizes or {}
+    order = sorted(marker_genes, key=lambda cluster_id: -cluster_sizes.get(cluster_id, 0))
+    total_cells = sum(cluster_sizes.get(cluster_id, 0) for cluster_id in marker_genes)
+
+    full, single, skipped = [], [], []
+    used = 0
+    for cluster_id in order:
+        cluster_tokens = (
+            estimate_tokens(", ".join(str(gene) for gene in marker_genes[cluster_id]))
+            + BUDGET_ANSWER_TOKENS
+        )
+        full_cost = num_models * cluster_tokens + math.ceil(
+            BUDGET_CONTROVERSIAL_RATE * max_discussion_rounds * BUDGET_DISCUSSION_TOKENS
+        )
+        if not full:
+            full_cost += num_models * BUDGET_PROMPT_TOKENS
+        single_cost = cluster_tokens + (0 if single else BUDGET_PROMPT_TOKENS)
+
+        low_impact = (
+            total_cells > 0
+            and cluster_sizes.get(cluster_id, 0) < min_cluster_fraction * total_cells
+        )
+        if (
+            not low_impact
+            and not single
+            and (token_budget is None or used + full_cost <= token_budget)
+        ):
+            full.append(cluster_id)
+            used += full_cost
+        elif token_budget is None or used + single_cost <= token_budget:
+            single.append(cluster_id)
+            used += single_cost
+        else:
+            skipped.append(cluster_id)
+
+    return full, single, skipped, used
+
+
+def _budgeted_consensus_annotation(
+    marker_genes: dict[str, list[str]],
+    species: str,
+    models: list[Union[str, dict[str, str]]],
+    api_keys: Optional[dict[str, str]],
+    time_budget: Optional[float],
+    token_budget: Optional[int],
+    cluster_sizes: Optional[dict[str, int]],
+    min_cluster_fraction: float,
+    cancel_token: Optional[CancellationToken],
+    options: dict[str, Any],
+) -> dict[str, Any]:
+    """Run consensus annotation within a time or token budget, largest clusters first.
+
+    Args:
+        marker_genes: Dictionary mapping cluster names to lists of marker genes
+        species: Species name (e.g., 'human', 'mouse')
+        models: List of models to use for annotation
+        api_keys: Dictionary mapping provider names to API keys
+        time_budget: Optional limit in seconds on the total runtime
+        token_budget: Optional limit on the estimated number of tokens
+        cluster_sizes: Optional dictionary mapping cluster names to cell counts
+        min_cluster_fraction: Fraction of all cells below which a cluster is low-impact
+        cancel_token: Optional CancellationToken of the enclosing run
+        options: Remaining keyword arguments of interactive_consensus_annotation
+
+    Returns:
+        dict[str, Any]: Dictionary containing consensus results and metadata
+
+    """
+    from .annotate import annotate_clusters
+    from .functions import get_provider
+    from .utils import load_api_key
+
+    api_keys = dict(api_keys or {})
+    candidates = []
+    for model_item in models:
+        if isinstance(model_item, dict):
+            model_name = model_item.get("model")
+            provider = model_item.get("provider") or get_provider(model_name)
+        else:
+            model_name = model_item
+            provider = get_provider(model_item)
+        api_key = api_keys.get(provider) or load_api_key(provider)
+        if api_key:
+            api_keys[provider] = api_key
+            candidates.append((provider, model_name))
+
+    full, single, skipped, estimated_tokens = _plan_budget(
+        marker_genes,
+        num_models=len(candidates),
+        token_budget=token_budget,
+        cluster_sizes=cluster_sizes,
+        min_cluster_fraction=min_cluster_fraction,
+        max_discussion_rounds=options.get("max_discussion_rounds", 3),
+    )
+    write_log(
+        f"Budget plan: {len(full)} clusters with full consensus, {len(single)} with a "
+        f"single model, {len(skipped)} skipped (~{estimated_tokens} tokens)"
+    )
+
+    run_token = cancel_token
+    if time_budget is not None:
+        run_token = CancellationToken(time_budget, parent=cancel_token)
+
+    timings = {}
+    result = {
+        "consensus": {},
+        "consensus_proportion": {},
+        "entropy": {},
+        "controversial_clusters": [],
+        "resolved": {},
+        "model_annotations": {},
+        "discussion_logs": {},
+        "metadata": {},
+    }
+
+    if full:
+        # Hold back part of the time for the low-impact clusters
+        full_token = run_token
+        if time_budget is not None and single:
+            full_token = CancellationToken(
+                time_budget * (1 - LOW_IMPACT_TIME_SHARE), parent=run_token
+            )
+        full_result = interactive_consensus_annotation(
+            marker_genes={cluster_id: marker_genes[cluster_id] for cluster_id in full},
+            species=species,
+            models=models,
+            api_keys=api_keys,
+            cancel_token=full_token,
+            **options,
+        )
+        if "error" in full_result:
+            # Fall back to single-model annotation for the high-impact clusters
+            single = full + single
+            full = []
+        else:
+            result.update(full_result)
+
+    single_model = None
+    if single:
+        ranked = rank_models(candidates)
+        annotations = {}
+        if ranked and not (run_token is not None and run_token.cancelled):
+            single_provider, single_model = ranked[0]
+            try:
+                with stage(
+                    "single_model_annotation",
+                    timings,
+                    provider=single_provider,
+                    model=single_model,
+                    clusters=len(single),
+                ):
+                    annotations = annotate_clusters(
+                        marker_genes={
+                            cluster_id: marker_genes[cluster_id] for cluster_id in single
+                        },
+                        species=species,
+                        provider=single_provider,
+                        model=single_model,
+                        api_key=api_keys[single_provider],
+                        tissue=options.get("tissue"),
+                        additional_context=options.get("additional_context"),
+                        use_cache=options.get("use_cache", True),
+                        cache_dir=options.get("cache_dir"),
+                        cancel_token=run_token,
+                        fast_mode=options.get("fast_mode", False),
+                    )
+            except (
+                requests.RequestException,
+                ValueError,
+                KeyError,
+                json.JSONDecodeError,
+                AttributeError,
+                ImportError,
+                CircuitOpenError,
+                DeadlineExceeded,
+            ) as e:
+                write_log(f"Error annotating with {single_model}: {str(e)}", level="error")
+            if annotations:
+                result["model_annotations"].setdefault(single_model, {}).update(annotations)
+
+        for cluster_id in single:
+            annotation = clean_annotation(annotations.get(cluster_id, ""))
+            if annotation:
+                result["consensus"][cluster_id] = annotation
+                result["consensus_proportion"][cluster_id] = 1.0
+                result["entropy"][cluster_id] = 0.0
+            else:
+                skipped.append(cluster_id)
+        single = [cluster_id for cluster_id in single if cluster_id not in skipped]
+
+    for cluster_id in skipped:
+        result["consensus"][cluster_id] = "Unknown"
+        result["consensus_proportion"][cluster_id] = 0.0
+        result["entropy"][cluster_id] = 0.0
+
+    if not full and not single:
+        write_log("No annotations were successful within the budget", level="error")
+        return {"error": "No annotations were successful"}
+
+    # Report clusters in their original order
+    for key in ("consensus", "consensus_proportion", "entropy"):
+        result[key] = {
+            cluster_id: result[key][cluster_id]
+            for cluster_id in marker_genes
+            if cluster_id in result[key]
+        }
+
+    metadata = result["metadata"]
+    metadata.setdefault("timestamp", time.strftime("%Y-%m-%d %H:%M:%S"))
+    metadata.setdefault("models", models)
+    metadata.setdefault("species", species)
+    metadata["timings"] = {**metadata.get("timings", {}), **timings}
+    metadata["partial"] = bool(
+        metadata.get("partial") or skipped or (run_token is not None and run_token.cancelled)
+    )
+    metadata["budget"] = {
+        "time_budget": time_budget,
+        "token_budget": token_budget,
+        "estimated_tokens": estimated_tokens,
+        "full_consensus_clusters": full,
+        "single_model_clusters": single,
+        "skipped_clusters": skipped,
+        "single_model": single_model,
+    }
+    return result
+
+
+@collect_run_metrics
+@traced("interactive_consensus_annotation")
 def interactive_consensus_annotation(
     marker_genes: dict[str, list[str]],
     species: str,
@@ -744,6 +2215,25 @@ def interactive_consensus_annotation(
     use_cache: bool = True,
     cache_dir: Optional[str] = None,
     verbose: bool = False,
+    batch_consensus_check: bool = False,
+    tiered_consensus: bool = True,
+    ontology: Optional[CellTypeOntology] = None,
+    ontology_depth: Optional[int] = None,
+    sequential_voting: bool = False,
+    initial_quorum: Optional[int] = None,
+    batch_discussion: bool = False,
+    max_context_tokens: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    discussion_models: Optional[list[Union[str, dict[str, str]]]] = None,
+    discussion_pool_strategy: str = "round_robin",
+    timeout: Optional[float] = None,
+    cancel_token: Optional[CancellationToken] = None,
+    time_budget: Optional[float] = None,
+    token_budget: Optional[int] = None,
+    cluster_sizes: Optional[dict[str, int]] = None,
+    min_cluster_fraction: float = 0.02,
+    max_marker_tokens: Optional[int] = None,
+    fast_mode: bool = False,
 ) -> dict[str, Any]:
     """Perform consensus annotation of cell types using multiple LLMs and interactive resolution.
 
@@ -760,18 +2250,114 @@ def interactive_consensus_annotation(
         use_cache: Whether to use cache
         cache_dir: Directory to store cache files
         verbose: Whether to print detailed logs
+        batch_consensus_check: Whether to check consensus for many clusters per LLM request
+        tiered_consensus: Whether to settle clusters by exact and synonym matching
+            before asking an LLM
+        ontology: Optional cell type ontology used to group synonymous labels
+        ontology_depth: Optional ontology depth at which labels are compared
+        sequential_voting: Whether to query models one at a time after an initial
+            quorum, sending each further model only the clusters whose outcome under
+            consensus_threshold and entropy_threshold the remaining votes could still
+            change. Proportion and entropy of skipped clusters cover the queried models
+        initial_quorum: Number of models that annotate every cluster in sequential
+            mode. If None, uses the smallest number that can reach consensus_threshold
+        batch_discussion: Whether to discuss several controversial clusters per request
+        max_context_tokens: Optional token budget for follow-up discussion prompts, which
+            then carry a compact state of the previous round instead of its full text
+        max_in_flight: If greater than 1, pipeline the discussions of all controversial
+            clusters with up to this many requests in flight. Defaults to the number
+            of discussion_models if they are given
+        discussion_models: Optional pool of models to spread the discussion of
+            controversial clusters across, instead of a single discussion model
+        discussion_pool_strategy: How discussion requests are spread across
+            discussion_models: 'round_robin' or 'least_loaded'
+        timeout: Optional limit in seconds on the total runtime. When it runs out,
+            pending requests are abandoned and the best partial result is returned
+            with metadata['partial'] set. Ignored if cancel_token is given.
+        cancel_token: Optional CancellationToken to stop the run from another thread
+            or to share one deadline across several runs
+        time_budget: Optional wall-clock budget in seconds for a budgeted run. Large
+            clusters get full consensus and discussion first, and low-impact clusters
+            are annotated by the fastest single model with the time that remains
+        token_budget: Optional budget on the estimated number of tokens for a budgeted
+            run. Clusters that do not fit are reported as 'Unknown'
+        cluster_sizes: Optional dictionary mapping cluster names to cell counts, used to
+            prioritise clusters in a budgeted run
+        min_cluster_fraction: Fraction of all cells below which a cluster only gets
+            single-model annotation in a budgeted run
+        max_marker_tokens: Optional token budget for the marker genes of all clusters.
+            Marker lists are cut to the top ranked genes that fit before any model is
+            asked, and the dropped genes are reported in metadata['marker_compaction']
+        fast_mode: Whether the initial annotations are requested without rationale and
+            under a tight output token budget (see annotate_clusters)
 
     Returns:
-        dict[str, Any]: Dictionary containing consensus results and metadata
+        dict[str, Any]: Dictionary containing consensus results and metadata. Budgeted
+            runs also report their plan in metadata['budget'], metadata['metrics']
+            summarizes the requests and cache lookups of the run, and
+            metadata['timings'] holds the seconds spent in each stage
 
     """
     from .annotate import annotate_clusters
     from .functions import get_provider
 
+    marker_compaction = {}
+    if max_marker_tokens is not None:
+        marker_genes, truncated = compact_marker_genes(marker_genes, max_marker_tokens)
+        marker_compaction = {"max_marker_tokens": max_marker_tokens, "truncated": truncated}
+
+    if time_budget is not None or token_budget is not None:
+        result = _budgeted_consensus_annotation(
+            marker_genes,
+            species,
+            models,
+            api_keys,
+            time_budget=time_budget,
+            token_budget=token_budget,
+            cluster_sizes=cluster_sizes,
+            min_cluster_fraction=min_cluster_fraction,
+            cancel_token=cancel_token
+            if cancel_token is not None
+            else (CancellationToken(timeout) if timeout is not None else None),
+            options={
+                "tissue": tissue,
+                "additional_context": additional_context,
+                "consensus_threshold": consensus_threshold,
+                "entropy_threshold": entropy_threshold,
+                "max_discussion_rounds": max_discussion_rounds,
+                "use_cache": use_cache,
+                "cache_dir": cache_dir,
+                "verbose": verbose,
+                "batch_consensus_check": batch_consensus_check,
+                "tiered_consensus": tiered_consensus,
+                "ontology": ontology,
+                "ontology_depth": ontology_depth,
+                "sequential_voting": sequential_voting,
+                "initial_quorum": initial_quorum,
+                "batch_discussion": batch_discussion,
+                "max_context_tokens": max_context_tokens,
+                "max_in_flight": max_in_flight,
+                "discussion_models": discussion_models,
+                "discussion_pool_strategy": discussion_pool_strategy,
+                "fast_mode": fast_mode,
+            },
+        )
+        if "metadata" in result:
+            result["metadata"]["marker_compaction"] = marker_compaction
+        return result
+
     # Set up logging
     if verbose:
         write_log("Starting interactive consensus annotation")
 
+    # All provider calls of this run share one retry budget
+    retry_budget = reset_retry_budget()
+    prompt_usage = get_provider_stats().prompt_usage()
+    timings = {}
+
+    if cancel_token is None and timeout is not None:
+        cancel_token = CancellationToken(timeout)
+
     # Make sure we have API keys
     if api_keys is None:
         api_keys = {}
@@ -792,9 +2378,8 @@ def interactive_consensus_annotation(
                 if api_key:
                     api_keys[provider] = api_key
 
-    # Run initial annotations with all models
-    model_results = {}
-
+    # Resolve the provider and API key of every usable model
+    annotators = []
     for model_item in models:
         # Handle both string models and dict models
         if isinstance(model_item, dict):
@@ -821,26 +2406,38 @@ def interactive_consensus_annotation(
             )
             continue
 
+        annotators.append((provider, model_name, api_key))
+
+    def run_annotator(
+        provider: str, model_name: str, api_key: str, cluster_markers: dict[str, list[str]]
+    ) -> Optional[dict[str, str]]:
         if verbose:
-            write_log(f"Annotating with {model_name}")
+            write_log(f"Annotating {len(cluster_markers)} clusters with {model_name}")
 
         try:
-            results = annotate_clusters(
-                marker_genes=marker_genes,
-                species=species,
+            with start_span(
+                "annotation.model",
                 provider=provider,
                 model=model_name,
-                api_key=api_key,
-                tissue=tissue,
-                additional_context=additional_context,
-                use_cache=use_cache,
-                cache_dir=cache_dir,
-            )
-
-            model_results[model_name] = results
+                clusters=len(cluster_markers),
+            ):
+                results = annotate_clusters(
+                    marker_genes=cluster_markers,
+                    species=species,
+                    provider=provider,
+                    model=model_name,
+                    api_key=api_key,
+                    tissue=tissue,
+                    additional_context=additional_context,
+                    use_cache=use_cache,
+                    cache_dir=cache_dir,
+                    cancel_token=cancel_token,
+                    fast_mode=fast_mode,
+                )
 
             if verbose:
                 write_log(f"Successfully annotated with {model_name}")
+            return results
         except (
             requests.RequestException,
             ValueError,
@@ -848,8 +2445,94 @@ def interactive_consensus_annotation(
             json.JSONDecodeError,
             AttributeError,
             ImportError,
+            CircuitOpenError,
+            DeadlineExceeded,
         ) as e:
             write_log(f"Error annotating with {model_name}: {str(e)}", level="error")
+            return None
+
+    model_results = {}
+    voting_stats = {}
+
+    with stage("annotation", timings):
+        if not sequential_voting:
+            # Run initial annotations with all models
+            for provider, model_name, api_key in annotators:
+                if cancel_token is not None and cancel_token.cancelled:
+                    write_log("Run stopped, skipping remaining annotation models", level="warning")
+                    break
+                results = run_annotator(provider, model_name, api_key, marker_genes)
+                if results is not None:
+                    model_results[model_name] = results
+        else:
+            # Query a quorum first, then only the clusters whose outcome is still open
+            total_models = len(annotators)
+            if initial_quorum is None:
+                initial_quorum = math.ceil(consensus_threshold * total_models)
+            initial_quorum = max(1, min(initial_quorum, total_models))
+
+            if ontology is not None:
+
+                def vote_key(label: str) -> str:
+                    return ontology.canonical_label(label, ontology_depth)
+
+            elif tiered_consensus:
+                vote_key = normalize_annotation
+            else:
+                vote_key = str.lower
+
+            cluster_votes = {cluster_id: [] for cluster_id in marker_genes}
+            cluster_queries = dict.fromkeys(marker_genes, 0)
+
+            for index, (provider, model_name, api_key) in enumerate(annotators):
+                if index < initial_quorum:
+                    pending = list(marker_genes)
+                else:
+                    pending = [
+                        cluster_id
+                        for cluster_id in marker_genes
+                        if not _is_vote_settled(
+                            cluster_votes[cluster_id],
+                            cluster_queries[cluster_id],
+                            total_models,
+                            consensus_threshold,
+                            entropy_threshold,
+                            vote_key,
+                        )
+                    ]
+                    if not pending:
+                        break
+                if cancel_token is not None and cancel_token.cancelled:
+                    write_log("Run stopped, skipping remaining annotation models", level="warning")
+                    break
+
+                results = run_annotator(
+                    provider,
+                    model_name,
+                    api_key,
+                    {cluster_id: marker_genes[cluster_id] for cluster_id in pending},
+                )
+                for cluster_id in pending:
+                    cluster_queries[cluster_id] += 1
+                if results is None:
+                    continue
+
+                model_results[model_name] = results
+                for cluster_id in pending:
+                    annotation = clean_annotation(results.get(cluster_id, ""))
+                    if annotation:
+                        cluster_votes[cluster_id].append(annotation)
+
+            queries = sum(cluster_queries.values())
+            voting_stats = {
+                "initial_quorum": initial_quorum,
+                "cluster_queries": queries,
+                "cluster_queries_saved": total_models * len(marker_genes) - queries,
+            }
+            write_log(
+                f"Sequential voting queried {queries} of {total_models * len(marker_genes)} "
+                f"cluster-model pairs (initial quorum {initial_quorum})"
+            )
 
     # Check if we have any results
     if not model_results:
@@ -857,101 +2540,168 @@ def interactive_consensus_annotation(
         return {"error": "No annotations were successful"}
 
     # Check consensus
-    consensus, consensus_proportion, entropy, controversial = check_consensus(
-        model_results,
-        consensus_threshold=consensus_threshold,
-        entropy_threshold=entropy_threshold,
-        api_keys=api_keys,
-    )
+    tier_stats = {}
+    with stage("consensus_check", timings):
+        consensus, consensus_proportion, entropy, controversial = check_consensus(
+            model_results,
+            consensus_threshold=consensus_threshold,
+            entropy_threshold=entropy_threshold,
+            api_keys=api_keys,
+            batch=batch_consensus_check,
+            tiered=tiered_consensus,
+            tier_stats=tier_stats,
+            ontology=ontology,
+            ontology_depth=ontology_depth,
+            cancel_token=cancel_token,
+        )
 
     if verbose:
         write_log(f"Found {len(controversial)} controversial clusters out of {len(consensus)}")
 
     # If there are controversial clusters, resolve them
     resolved = {}
-    if controversial:
-        # Choose best model for discussion
-        discussion_model = None
-        discussion_provider = None
-
-        # Try to use the most capable model available
-        for preferred_model_name in ["gpt-4o", "claude-3-opus", "gemini-2.0-pro"]:
-            # Check if the preferred model is in the models list
-            for model_item in models:
-                if isinstance(model_item, dict):
-                    # For dictionary models, check the 'model' key
-                    if model_item.get("model") == preferred_model_name:
-                        discussion_provider = model_item.get("provider")
-                        discussion_model = preferred_model_name
-                        # If provider is not explicitly provided, try to get it from model name
-                        if not discussion_provider:
-                            discussion_provider = get_provider(discussion_model)
-                        if discussion_provider in api_keys:
-                            break
-                elif model_item == preferred_model_name:
-                    # For string models
-                    provider = get_provider(preferred_model_name)
-                    if provider in api_keys:
-                        discussion_model = preferred_model_name
-                        discussion_provider = provider
-                        break
-            # If we found a model, break out of the outer loop too
-            if discussion_model:
-                break
-
-        # If no preferred model is available, use the first one
-        if not discussion_model and models:
-            first_model = models[0]
-            # Handle both string models and dict models
-            if isinstance(first_model, dict):
-                discussion_provider = first_model.get("provider")
-                discussion_model = first_model.get("model")
+    discussion_pool = []
+    if controversial and discussion_models:
+        from .utils import load_api_key
 
-                # If provider is not explicitly provided, try to get it from model name
-                if not discussion_provider and discussion_model:
-                    discussion_provider = get_provider(discussion_model)
+        for model_item in discussion_models:
+            if isinstance(model_item, dict):
+                model_name = model_item.get("model")
+                provider = model_item.get("provider") or get_provider(model_name)
             else:
-                discussion_model = first_model
-                discussion_provider = get_provider(discussion_model)
-
-        if discussion_model:
-            if verbose:
-                write_log(f"Resolving controversial clusters using {discussion_model}")
+                model_name = model_item
+                provider = get_provider(model_item)
 
-            try:
-                resolved, discussion_logs, updated_cp, updated_h = process_controversial_clusters(
-                    marker_genes=marker_genes,
-                    controversial_clusters=controversial,
-                    model_predictions=model_results,
-                    species=species,
-                    tissue=tissue,
-                    provider=discussion_provider,
-                    model=discussion_model,
-                    api_key=api_keys.get(discussion_provider),
-                    max_discussion_rounds=max_discussion_rounds,
-                    consensus_threshold=consensus_threshold,
-                    entropy_threshold=entropy_threshold,
-                    use_cache=use_cache,
-                    cache_dir=cache_dir,
+            api_key = api_keys.get(provider) or load_api_key(provider)
+            if not api_key:
+                write_log(
+                    f"Warning: No API key found for {provider}, "
+                    f"leaving {model_name} out of the discussion pool",
+                    level="warning",
                 )
+                continue
+            discussion_pool.append({"provider": provider, "model": model_name, "api_key": api_key})
 
-                # Update consensus proportion and entropy for resolved clusters
-                for cluster_id, cp in updated_cp.items():
-                    consensus_proportion[cluster_id] = cp
+    with stage("discussion", timings, clusters=len(controversial)):
+        if controversial and cancel_token is not None and cancel_token.cancelled:
+            write_log(
+                f"Run stopped, leaving {len(controversial)} controversial clusters undiscussed",
+                level="warning",
+            )
+        elif controversial:
+            # Choose best model for discussion
+            discussion_model = None
+            discussion_provider = None
+
+            if discussion_pool:
+                discussion_model = discussion_pool[0]["model"]
+                discussion_provider = discussion_pool[0]["provider"]
+
+            if not discussion_model:
+                # Prefer the most capable models, then the fastest healthy one per the router
+                candidates = []
+                for model_item in models:
+                    if isinstance(model_item, dict):
+                        model_name = model_item.get("model")
+                        provider = model_item.get("provider") or get_provider(model_name)
+                    else:
+                        model_name = model_item
+                        provider = get_provider(model_item)
+                    if provider in api_keys:
+                        candidates.append((provider, model_name))
 
-                for cluster_id, h in updated_h.items():
-                    entropy[cluster_id] = h
+                candidates.sort(
+                    key=lambda candidate: (
+                        PREFERRED_DISCUSSION_MODELS.index(candidate[1])
+                        if candidate[1] in PREFERRED_DISCUSSION_MODELS
+                        else len(PREFERRED_DISCUSSION_MODELS)
+                    )
+                )
+                ranked = rank_models(candidates)
+                if ranked:
+                    discussion_provider, discussion_model = ranked[0]
+
+            # If no preferred model is available, use the first one whose circuit is closed
+            if not discussion_model:
+                for model_item in models:
+                    # Handle both string models and dict models
+                    if isinstance(model_item, dict):
+                        model_name = model_item.get("model")
+                        # If provider is not explicitly provided, try to get it from model name
+                        provider = model_item.get("provider") or (
+                            get_provider(model_name) if model_name else None
+                        )
+                    else:
+                        model_name = model_item
+                        provider = get_provider(model_item)
+                    if not model_name:
+                        continue
+                    if provider and not get_circuit_breaker(provider, model_name).available:
+                        write_log(
+                            f"Skipping {provider}/{model_name} for discussion: circuit open",
+                            level="warning",
+                        )
+                        continue
+                    discussion_provider, discussion_model = provider, model_name
+                    break
+                else:
+                    if models:
+                        write_log(
+                            "No discussion model available, leaving "
+                            f"{len(controversial)} controversial clusters unresolved",
+                            level="warning",
+                        )
 
+            if discussion_model:
                 if verbose:
-                    write_log(f"Successfully resolved {len(resolved)} controversial clusters")
-            except (
-                requests.RequestException,
-                ValueError,
-                KeyError,
-                json.JSONDecodeError,
-                AttributeError,
-            ) as e:
-                write_log(f"Error resolving controversial clusters: {str(e)}", level="error")
+                    pool_names = ", ".join(member["model"] for member in discussion_pool)
+                    write_log(
+                        f"Resolving controversial clusters using {pool_names or discussion_model}"
+                    )
+
+                try:
+                    resolved, discussion_logs, updated_cp, updated_h = (
+                        process_controversial_clusters(
+                            marker_genes=marker_genes,
+                            controversial_clusters=controversial,
+                            model_predictions=model_results,
+                            species=species,
+                            tissue=tissue,
+                            provider=discussion_provider,
+                            model=discussion_model,
+                            api_key=api_keys.get(discussion_provider),
+                            max_discussion_rounds=max_discussion_rounds,
+                            consensus_threshold=consensus_threshold,
+                            entropy_threshold=entropy_threshold,
+                            use_cache=use_cache,
+                            cache_dir=cache_dir,
+                            batch_discussion=batch_discussion,
+                            max_context_tokens=max_context_tokens,
+                            max_in_flight=max_in_flight,
+                            discussion_pool=discussion_pool or None,
+                            pool_strategy=discussion_pool_strategy,
+                            cancel_token=cancel_token,
+                        )
+                    )
+
+                    # Update consensus proportion and entropy for resolved clusters
+                    for cluster_id, cp in updated_cp.items():
+                        consensus_proportion[cluster_id] = cp
+
+                    for cluster_id, h in updated_h.items():
+                        entropy[cluster_id] = h
+
+                    if verbose:
+                        write_log(f"Successfully resolved {len(resolved)} controversial clusters")
+                except (
+                    requests.RequestException,
+                    CircuitOpenError,
+                    ValueError,
+                    KeyError,
+                    json.JSONDecodeError,
+                    AttributeError,
+                ) as e:
+                    write_log(f"Error resolving controversial clusters: {str(e)}", level="error")
 
     # Merge consensus and resolved
     final_annotations = consensus.copy()
@@ -980,6 +2730,14 @@ def interactive_consensus_annotation(
             "consensus_threshold": consensus_threshold,
             "entropy_threshold": entropy_threshold,
             "max_discussion_rounds": max_discussion_rounds,
+            "consensus_tiers": tier_stats,
+            "sequential_voting": voting_stats,
+            "discussion_models": [member["model"] for member in discussion_pool],
+            "retries": retry_budget.used,
+            "prompt_cache": summarize_prompt_cache(since=prompt_usage),
+            "marker_compaction": marker_compaction,
+            "timings": timings,
+            "partial": bool(cancel_token is not None and cancel_token.cancelled),
         },
     }
 
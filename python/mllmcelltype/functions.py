@@ -1,8 +1,7 @@
 from __future__ import annotations
 
-import time
 from dataclasses import dataclass
-from typing import Any, Literal, Optional, Union
+from typing import TYPE_CHECKING, Any, Literal, Optional, Union
 
 import openai
 import pandas as pd
@@ -10,8 +9,12 @@ import requests
 
 from .logger import write_log
 from .providers.openrouter import process_openrouter
+from .retry import call_with_retry, raise_for_status
 from .utils import clean_annotation
 
+if TYPE_CHECKING:
+    from .ontology import CellTypeOntology
+
 # Define supported models as literals for better type checking
 ModelType = Literal[
     # OpenAI models
@@ -205,13 +208,18 @@ def select_best_prediction(predictions: list[dict[str, str]]) -> dict[str, str]:
 
 
 def identify_controversial_clusters(
-    annotations: dict[str, dict[str, str]], threshold: float = 0.6
+    annotations: dict[str, dict[str, str]],
+    threshold: float = 0.6,
+    ontology: Optional[CellTypeOntology] = None,
+    ontology_depth: Optional[int] = None,
 ) -> list[str]:
     """Identify clusters with inconsistent annotations across models.
 
     Args:
         annotations: Dictionary mapping model names to dictionaries of cluster annotations
         threshold: Agreement threshold below which a cluster is considered controversial
+        ontology: Optional cell type ontology used to treat synonymous labels as equal
+        ontology_depth: Optional ontology depth at which labels are compared
 
     Returns:
         list[str]: List of controversial cluster IDs
@@ -234,7 +242,9 @@ def identify_controversial_clusters(
         for _model, results in annotations.items():
             if cluster in results:
                 annotation = clean_annotation(results[cluster])
-                if annotation:
+                if annotation and ontology is not None:
+                    cluster_annotations.append(ontology.canonical_label(annotation, ontology_depth))
+                elif annotation:
                     cluster_annotations.append(annotation)
 
         # Count occurrences
@@ -386,8 +396,10 @@ def annotate_cell_types(
     provider_func = provider_map[provider]
 
     try:
-        # Call provider function
-        result = provider_func(prompt, model, api_key)
+        # Call provider function, retrying transient failures
+        result = call_with_retry(
+            lambda: provider_func(prompt, model, api_key), f"{provider}/{model}"
+        )
 
         # Save to cache if using cache
         if use_cache and cache_key:
@@ -428,47 +440,22 @@ def process_openai_legacy(prompt: str, model: str, api_key: str) -> list[str]:
         chunk_text = "\n".join(chunk)
         write_log(f"Processing chunk {i + 1} of {len(chunks)}")
 
-        max_retries = 3
-        retry_delay = 2
-
-        for attempt in range(max_retries):
-            try:
-                response = openai.ChatCompletion.create(
-                    model=model, messages=[{"role": "user", "content": chunk_text}]
-                )
-                result = response.choices[0].message.content.strip().split("\n")
-
-                # Verify we got the expected number of responses
-                expected_lines = len(chunk) - 3  # -3 for the header lines
-                if len(result) >= expected_lines:
-                    # If we got more lines than expected, take the first expected_lines
-                    result = result[:expected_lines]
-                    all_results.extend(result)
-                    break
-                # If we didn't get enough lines, retry
-                write_log(
-                    f"WARNING: Expected {expected_lines} lines, got {len(result)}",
-                    level="warning",
-                )
-                if attempt < max_retries - 1:
-                    write_log(f"Retrying (attempt {attempt + 2}/{max_retries})...")
-                    time.sleep(retry_delay)
-                else:
-                    # If this is the last attempt, use what we got
-                    all_results.extend(result)
-                    # Pad with "Unknown" to match expected length
-                    all_results.extend(["Unknown"] * (expected_lines - len(result)))
-            except Exception as e:
-                write_log(
-                    f"Error during OpenAI API call (attempt {attempt + 1}/{max_retries}): {str(e)}",
-                    level="error",
-                )
-                if attempt < max_retries - 1:
-                    wait_time = retry_delay * (2**attempt)
-                    write_log(f"Waiting {wait_time} seconds before retrying...")
-                    time.sleep(wait_time)
-                else:
-                    raise
+        # Transient failures are retried by the caller's retry policy
+        response = openai.ChatCompletion.create(
+            model=model, messages=[{"role": "user", "content": chunk_text}]
+        )
+        result = response.choices[0].message.content.strip().split("\n")
+
+        # Verify we got the expected number of responses
+        expected_lines = len(chunk) - 3  # -3 for the header lines
+        if len(result) < expected_lines:
+            write_log(
+                f"WARNING: Expected {expected_lines} lines, got {len(result)}",
+                level="warning",
+            )
+            # Pad with "Unknown" to match expected length
+            result.extend(["Unknown"] * (expected_lines - len(result)))
+        all_results.extend(result[:expected_lines])
 
     return [r.rstrip(",") for r in all_results]
 
@@ -481,8 +468,8 @@ def process_anthropic_legacy(prompt: str, model: str, api_key: str) -> list[str]
     try:
         import anthropic
 
-        # Create a client
-        client = anthropic.Anthropic(api_key=api_key)
+        # Create a client; retries are handled by the caller's retry policy
+        client = anthropic.Anthropic(api_key=api_key, max_retries=0)
 
         # Get the model to use
         if not model or model == "default":
@@ -533,10 +520,6 @@ def process_deepseek_legacy(prompt: str, model: str, api_key: str) -> list[str]:
     write_log(f"Using DeepSeek API with model: {model}")
 
     try:
-        # Import necessary modules for improved request handling
-        from requests.adapters import HTTPAdapter
-        from urllib3.util.retry import Retry
-
         # URL for DeepSeek API
         url = "https://api.deepseek.com/v1/chat/completions"
 
@@ -553,31 +536,13 @@ def process_deepseek_legacy(prompt: str, model: str, api_key: str) -> list[str]:
             "max_tokens": 4000,
         }
 
-        # Configure retry strategy
-        retry_strategy = Retry(
-            total=5,  # Increased from default
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["POST"],
-        )
-
-        # Create a session with the retry strategy
-        session = requests.Session()
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("https://", adapter)
-        session.mount("http://", adapter)
-
-        # Make the API call with increased timeout
-        write_log("Sending request to DeepSeek API with enhanced retry strategy and 90s timeout")
-        response = session.post(url, headers=headers, json=payload, timeout=90)
+        # Make the API call; transient failures are retried by the caller's retry policy
+        write_log("Sending request to DeepSeek API with 90s timeout")
+        response = requests.post(url, headers=headers, json=payload, timeout=90)
 
         # Check for errors
         if response.status_code != 200:
-            write_log(
-                f"DeepSeek API error: {response.status_code} - {response.text}",
-                level="error",
-            )
-            raise Exception(f"DeepSeek API error: {response.status_code} - {response.text}")
+            raise_for_status(response, "DeepSeek")
 
         # Parse response
         response_data = response.json()
@@ -0,0 +1,301 @@
+"""Per-request metrics hooks and exporters for LLMCellType."""
+
+from __future__ import annotations
+
+import dataclasses
+import functools
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from .logger import write_log
+
+
+@dataclass
+class MetricEvent:
+    """One provider request or cache access.
+
+    kind is 'request' for a provider call, with one event per call covering all of
+    its retries, or 'cache' for a cache lookup. latency is the duration of the
+    last attempt and queue_wait the rest of the call's time, spent on retry
+    backoff and on waiting for a worker thread. Token counts are those the
+    provider reported (tokens_reported), or local estimates if it reported none;
+    cached_tokens counts input tokens served from a provider prompt cache. Bytes
+    count the prompt and response text.
+    """
+
+    kind: str
+    provider: str
+    model: str
+    latency: float = 0.0
+    queue_wait: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    tokens_reported: bool = False
+    retries: int = 0
+    cache_tier: Optional[str] = None
+    cache_hit: Optional[bool] = None
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    success: bool = True
+    timestamp: float = field(default_factory=time.time)
+
+
+# Prometheus counters rendered by MetricsCollector.to_prometheus: (name, total, help)
+PROMETHEUS_COUNTERS = (
+    ("requests_total", "requests", "Provider requests"),
+    ("request_failures_total", "failures", "Failed provider requests"),
+    ("request_retries_total", "retries", "Retries of provider requests"),
+    ("request_latency_seconds_sum", "latency", "Time in provider requests"),
+    ("request_queue_wait_seconds_sum", "queue_wait", "Time waiting for retries or workers"),
+    ("input_tokens_total", "input_tokens", "Prompt tokens sent"),
+    ("output_tokens_total", "output_tokens", "Response tokens received"),
+    ("cached_input_tokens_total", "cached_tokens", "Prompt tokens served from a prompt cache"),
+    ("cache_hits_total", "cache_hits", "Cache lookups served from the cache"),
+    ("cache_misses_total", "cache_misses", "Cache lookups not found in the cache"),
+    ("bytes_sent_total", "bytes_sent", "Prompt bytes sent"),
+    ("bytes_received_total", "bytes_received", "Response bytes received"),
+)
+
+_hooks: list[Callable[[MetricEvent], None]] = []
+_hooks_lock = threading.Lock()
+
+
+def add_metrics_hook(hook: Callable[[MetricEvent], None]) -> None:
+    """Register a function that is called with every MetricEvent.
+
+    Hooks run on the thread that made the request and should return quickly.
+    Exceptions raised by a hook are logged and ignored.
+
+    Args:
+        hook: Function taking a MetricEvent
+
+    """
+    with _hooks_lock:
+        _hooks.append(hook)
+
+
+def remove_metrics_hook(hook: Callable[[MetricEvent], None]) -> None:
+    """Unregister a hook added with add_metrics_hook.
+
+    Args:
+        hook: The hook to remove
+
+    """
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def metrics_enabled() -> bool:
+    """Check whether any metrics hook is registered, so callers can skip building events."""
+    return bool(_hooks)
+
+
+def emit_metric(event: MetricEvent) -> None:
+    """Send an event to every registered hook.
+
+    Args:
+        event: The event to send
+
+    """
+    with _hooks_lock:
+        hooks = list(_hooks)
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception as e:
+            write_log(f"Metrics hook failed: {str(e)}", level="warning")
+
+
+def _new_totals() -> dict[str, Any]:
+    """Create the aggregate counters of one provider/model."""
+    return {
+        "requests": 0,
+        "failures": 0,
+        "retries": 0,
+        "latency": 0.0,
+        "max_latency": 0.0,
+        "queue_wait": 0.0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cached_tokens": 0,
+        "cache_hits": 0,
+        "cache_misses": 0,
+        "bytes_sent": 0,
+        "bytes_received": 0,
+    }
+
+
+class MetricsCollector:
+    """Metrics hook that keeps events and aggregates them per provider and model.
+
+    Register it with add_metrics_hook, then read summary() or export the events
+    with to_jsonl() and the aggregates with to_prometheus().
+    """
+
+    def __init__(self, max_events: Optional[int] = 10000):
+        """Initialize the collector.
+
+        Args:
+            max_events: Number of most recent events kept for to_jsonl. Aggregates
+                cover all events. None keeps every event.
+
+        """
+        self.max_events = max_events
+        self._events: list[MetricEvent] = []
+        self._totals: dict[tuple[str, str], dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: MetricEvent) -> None:
+        """Record an event."""
+        with self._lock:
+            self._events.append(event)
+            if self.max_events is not None and len(self._events) > self.max_events:
+                del self._events[: len(self._events) - self.max_events]
+
+            totals = self._totals.setdefault((event.provider, event.model), _new_totals())
+            if event.kind == "cache":
+                totals["cache_hits" if event.cache_hit else "cache_misses"] += 1
+                return
+            totals["requests"] += 1
+            totals["failures"] += int(not event.success)
+            totals["retries"] += event.retries
+            totals["latency"] += event.latency
+            totals["max_latency"] = max(totals["max_latency"], event.latency)
+            totals["queue_wait"] += event.queue_wait
+            totals["input_tokens"] += event.input_tokens
+            totals["output_tokens"] += event.output_tokens
+            totals["cached_tokens"] += event.cached_tokens
+            totals["bytes_sent"] += event.bytes_sent
+            totals["bytes_received"] += event.bytes_received
+
+    def events(self) -> list[MetricEvent]:
+        """Return the kept events, oldest first."""
+        with self._lock:
+            return list(self._events)
+
+    def summary(self) -> dict[str, Any]:
+        """Aggregate the recorded events.
+
+        Returns:
+            dict[str, Any]: Totals over all models, and the same counters per
+                'provider/model' under 'by_model', each with its mean latency
+
+        """
+        with self._lock:
+            by_model = {
+                f"{provider}/{model}": dict(totals)
+                for (provider, model), totals in self._totals.items()
+            }
+        overall = _new_totals()
+        for totals in by_model.values():
+            totals["mean_latency"] = (
+                totals["latency"] / totals["requests"] if totals["requests"] else None
+            )
+            for key, value in totals.items():
+                if key == "max_latency":
+                    overall[key] = max(overall[key], value)
+                elif key in overall:
+                    overall[key] += value
+        overall["mean_latency"] = (
+            overall["latency"] / overall["requests"] if overall["requests"] else None
+        )
+        overall["by_model"] = by_model
+        return overall
+
+    def to_jsonl(self, path: str) -> int:
+        """Append the kept events to a JSON Lines file.
+
+        Args:
+            path: File to append to
+
+        Returns:
+            int: Number of events written
+
+        """
+        events = self.events()
+        with open(path, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(dataclasses.asdict(event)) + "\n")
+        return len(events)
+
+    def to_prometheus(self, prefix: str = "mllmcelltype") -> str:
+        """Render the aggregates in the Prometheus text exposition format.
+
+        Args:
+            prefix: Prefix of the metric names
+
+        Returns:
+            str: The metrics, one sample per provider/model and counter
+
+        """
+        with self._lock:
+            totals = {key: dict(value) for key, value in self._totals.items()}
+
+        lines = []
+        for name, key, description in PROMETHEUS_COUNTERS:
+            lines.append(f"# HELP {prefix}_{name} {description}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for (provider, model), values in sorted(totals.items()):
+                labels = f'provider="{_escape_label(provider)}",model="{_escape_label(model)}"'
+                lines.append(f"{prefix}_{name}{{{labels}}} {values[key]}")
+        return "\n".join(lines) + "\n"
+
+
+class JsonlMetricsExporter:
+    """Metrics hook that appends every event to a JSON Lines file as it happens."""
+
+    def __init__(self, path: str):
+        """Initialize the exporter.
+
+        Args:
+            path: File the events are appended to
+
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event: MetricEvent) -> None:
+        """Write an event."""
+        line = json.dumps(dataclasses.asdict(event)) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def _escape_label(value: str) -> str:
+    """Escape a Prometheus label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def collect_run_metrics(func: Callable[..., dict[str, Any]]) -> Callable[..., dict[str, Any]]:
+    """Decorate a run function to report the metrics of its requests.
+
+    A MetricsCollector is registered while the function runs, and its summary is
+    stored in the result's metadata['metrics']. Requests made by other runs at the
+    same time are counted as well.
+
+    Args:
+        func: Function returning a result dictionary with a 'metadata' entry
+
+    Returns:
+        The decorated function
+
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> dict[str, Any]:
+        collector = MetricsCollector(max_events=0)
+        add_metrics_hook(collector)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            remove_metrics_hook(collector)
+        if isinstance(result, dict) and isinstance(result.get("metadata"), dict):
+            result["metadata"]["metrics"] = collector.summary()
+        return result
+
+    return wrapper
@@ -0,0 +1,245 @@
+"""Offline cell type ontology index for label equivalence in LLMCellType."""
+
+from __future__ import annotations
+
+import functools
+import os
+from typing import Optional
+
+from .logger import write_log
+from .utils import normalize_annotation
+
+# Bundled Cell Ontology-style table (term_id, name, parent_id, synonyms)
+DEFAULT_ONTOLOGY_FILE = os.path.join(os.path.dirname(__file__), "data", "cell_ontology.tsv")
+
+# Qualifiers that negate or change the lineage of the rest of a label
+# ('non-T cells', 'pre-B cells', 'NK T cells'); they are never dropped
+LINEAGE_QUALIFIERS = frozenset({"non", "not", "pre", "pro", "nk", "double", "triple", "negative"})
+
+# Terms above this depth (the root and broad classes such as 'epithelial cell')
+# are too general to be matched by dropping qualifiers
+MIN_SUFFIX_MATCH_DEPTH = 2
+
+
+class CellTypeOntology:
+    """Index of cell type terms, their synonyms and ancestors.
+
+    Every term name and synonym is normalized with normalize_annotation and stored
+    in a hash table, so looking up a label is a single dictionary access. Labels
+    with extra qualifiers (e.g. 'activated CD4+ T cells') fall back to their
+    longest known suffix ('CD4+ T cells'), unless a dropped word negates or
+    changes the lineage ('non-T cells', 'CD4-CD8- T cells') or the suffix is a
+    very general term such as 'cell'.
+    """
+
+    def __init__(
+        self,
+        names: dict[str, str],
+        parents: dict[str, Optional[str]],
+        synonyms: Optional[dict[str, list[str]]] = None,
+    ) -> None:
+        """Build the index.
+
+        Args:
+            names: Dictionary mapping term IDs to preferred names
+            parents: Dictionary mapping term IDs to parent term IDs (None for roots)
+            synonyms: Dictionary mapping term IDs to lists of synonyms
+
+        """
+        self.names = names
+        self.parents = parents
+        self._depths: dict[str, int] = {}
+        self._index: dict[str, str] = {}
+
+        for term_id, name in names.items():
+            labels = [name] + list((synonyms or {}).get(term_id, []))
+            for label in labels:
+                key = normalize_annotation(label)
+                if not key:
+                    continue
+                if key in self._index and self._index[key] != term_id:
+                    write_log(
+                        f"Ontology label '{label}' maps to both {self._index[key]} and "
+                        f"{term_id}, keeping {self._index[key]}",
+                        level="debug",
+                    )
+                    continue
+                self._index[key] = term_id
+
+    @classmethod
+    def from_file(cls, path: str) -> CellTypeOntology:
+        """Load an ontology from a tab-separated file.
+
+        The file has the columns term_id, name, parent_id and synonyms, where
+        synonyms are separated by '|'. Empty lines and lines starting with '#' are
+        ignored.
+
+        Args:
+            path: Path to the ontology file
+
+        Returns:
+            CellTypeOntology: The loaded ontology
+
+        """
+        names = {}
+        parents = {}
+        synonyms = {}
+
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                line = line.rstrip("\n")
+                if not line.strip() or line.startswith("#"):
+                    continue
+                fields = line.split("\t")
+                if len(fields) < 2:
+                    raise ValueError(f"Invalid ontology line {line_number} in {path}: {line}")
+                fields += [""] * (4 - len(fields))
+                term_id, name, parent_id, synonym_field = (field.strip() for field in fields[:4])
+                names[term_id] = name
+                parents[term_id] = parent_id or None
+                synonyms[term_id] = [s.strip() for s in synonym_field.split("|") if s.strip()]
+
+        write_log(f"Loaded {len(names)} ontology terms from {path}")
+        return cls(names, parents, synonyms)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def lookup(self, label: str) -> Optional[str]:
+        """Find the ontology term for a cell type label.
+
+        Args:
+            label: Cell type label
+
+        Returns:
+            Optional[str]: Term ID, or None if the label is unknown
+
+        """
+        key = normalize_annotation(label)
+        if not key:
+            return None
+
+        term_id = self._index.get(key)
+        if term_id:
+            return term_id
+
+        # Drop leading qualifiers one word at a time ('activated cd4+ t cell')
+        words = key.split(" ")
+        for start in range(1, len(words)):
+            if _is_lineage_qualifier(words[start - 1]):
+                return None
+            term_id = self._index.get(" ".join(words[start:]))
+            if term_id:
+                return term_id if self.depth(term_id) >= MIN_SUFFIX_MATCH_DEPTH else None
+
+        return None
+
+    def name(self, term_id: str) -> str:
+        """Get the preferred name of a term.
+
+        Args:
+            term_id: Term ID
+
+        Returns:
+            str: Preferred name
+
+        """
+        return self.names.get(term_id, term_id)
+
+    def ancestors(self, term_id: str) -> list[str]:
+        """Get the ancestors of a term, nearest first.
+
+        Args:
+            term_id: Term ID
+
+        Returns:
+            list[str]: Ancestor term IDs up to the root
+
+        """
+        result = []
+        parent = self.parents.get(term_id)
+        while parent and parent not in result:
+            result.append(parent)
+            parent = self.parents.get(parent)
+        return result
+
+    def depth(self, term_id: str) -> int:
+        """Get the depth of a term (0 for the root).
+
+        Args:
+            term_id: Term ID
+
+        Returns:
+            int: Number of ancestors of the term
+
+        """
+        if term_id not in self._depths:
+            self._depths[term_id] = len(self.ancestors(term_id))
+        return self._depths[term_id]
+
+    def term_at_depth(self, term_id: str, depth: int) -> str:
+        """Generalize a term to its ancestor at the given depth.
+
+        Args:
+            term_id: Term ID
+            depth: Target depth; terms at or above this depth are returned unchanged
+
+        Returns:
+            str: Term ID of the ancestor at the given depth
+
+        """
+        lineage = [term_id] + self.ancestors(term_id)
+        excess = len(lineage) - 1 - depth
+        if excess <= 0:
+            return term_id
+        return lineage[excess]
+
+    def canonical_label(self, label: str, depth: Optional[int] = None) -> str:
+        """Get a grouping key for a label, optionally generalized to a depth.
+
+        Args:
+            label: Cell type label
+            depth: Optional ontology depth to generalize the label to
+
+        Returns:
+            str: Preferred term name for known labels, the normalized label otherwise
+
+        """
+        term_id = self.lookup(label)
+        if not term_id:
+            return normalize_annotation(label)
+        if depth is not None:
+            term_id = self.term_at_depth(term_id, depth)
+        return self.name(term_id).lower()
+
+
+def _is_lineage_qualifier(word: str) -> bool:
+    """Check whether a normalized word must not be dropped from a label.
+
+    Besides LINEAGE_QUALIFIERS, this covers negative markers, which normalization
+    leaves as bare gene names ('cd4-' becomes 'cd4').
+
+    Args:
+        word: Word of a normalized label
+
+    Returns:
+        bool: True if dropping the word would change the cell type
+
+    """
+    return word in LINEAGE_QUALIFIERS or (
+        any(char.isdigit() for char in word) and not word.endswith("+")
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def load_ontology(path: Optional[str] = None) -> CellTypeOntology:
+    """Load a cell type ontology, caching it for later calls.
+
+    Args:
+        path: Path to a tab-separated ontology file. If None, uses the bundled table.
+
+    Returns:
+        CellTypeOntology: The loaded ontology
+
+    """
+    return CellTypeOntology.from_file(path or DEFAULT_ONTOLOGY_FILE)
@@ -0,0 +1,458 @@
+"""Dry-run planner that estimates the requests, tokens, cost and time of a run."""
+
+from __future__ import annotations
+
+import math
+from typing import Any, Optional, Union
+
+import pandas as pd
+
+from .annotate import (
+    CHUNK_ANSWER_TOKENS,
+    _plan_batch_requests,
+    _render_annotation_prompt,
+    get_default_model,
+    plan_annotation_chunks,
+)
+from .consensus import BUDGET_CONTROVERSIAL_RATE
+from .functions import get_provider
+from .prompts import create_batch_prompt, create_consensus_check_prompt, create_discussion_prompt
+from .router import get_provider_stats
+from .utils import (
+    compact_marker_genes,
+    create_cache_key,
+    deduplicate_marker_sets,
+    estimate_tokens,
+    parse_marker_genes,
+    validate_cache,
+)
+
+# Approximate list prices in USD per million (input, output) tokens; override with prices=
+MODEL_PRICES = {
+    "gpt-4.1": (2.0, 8.0),
+    "gpt-4.1-mini": (0.4, 1.6),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "claude-3-7-sonnet-20250219": (3.0, 15.0),
+    "claude-3-5-sonnet-20241022": (3.0, 15.0),
+    "claude-3-5-haiku-20241022": (0.8, 4.0),
+    "claude-3-opus-20240229": (15.0, 75.0),
+    "gemini-2.0-flash": (0.1, 0.4),
+    "gemini-2.5-pro-preview-03-25": (1.25, 10.0),
+    "deepseek-chat": (0.27, 1.1),
+    "deepseek-reasoner": (0.55, 2.19),
+    "grok-3-beta": (3.0, 15.0),
+    "qwen-max-2025-01-25": (1.6, 6.4),
+}
+
+# Output throughput and fixed per-request latency assumed for models without statistics
+DEFAULT_TOKENS_PER_SECOND = 50.0
+DEFAULT_REQUEST_OVERHEAD = 1.5
+
+# Estimated answer tokens of one discussion round and of one consensus check
+DISCUSSION_ANSWER_TOKENS = 400
+CONSENSUS_CHECK_ANSWER_TOKENS = 50
+
+
+def _request_entry(
+    stage: str,
+    provider: str,
+    model: str,
+    clusters: int,
+    input_tokens: int,
+    output_tokens: int,
+    cached: bool = False,
+    prices: Optional[dict[str, tuple[float, float]]] = None,
+    estimated: bool = False,
+) -> dict[str, Any]:
+    """Estimate the duration and cost of one request.
+
+    The duration uses the decode rate and per-request overhead fitted from the
+    provider statistics, or DEFAULT_TOKENS_PER_SECOND and DEFAULT_REQUEST_OVERHEAD
+    while the model has too few measured calls. Cached requests take no time and
+    cost nothing.
+
+    Args:
+        stage: Stage of the run that sends the request
+        provider: LLM provider
+        model: Model name
+        clusters: Number of clusters the request covers
+        input_tokens: Estimated prompt tokens
+        output_tokens: Estimated answer tokens
+        cached: Whether the answer would be served from the cache
+        prices: Price table in USD per million (input, output) tokens
+        estimated: Whether the prompt was approximated instead of rendered
+
+    Returns:
+        dict[str, Any]: The request with its estimated seconds and cost (None if
+            the model has no price)
+
+    """
+    price = (prices or MODEL_PRICES).get(model)
+    if cached:
+        seconds, cost = 0.0, 0.0
+    else:
+        summary = get_provider_stats().summary(provider, model)
+        if summary["decode_tokens_per_second"]:
+            seconds = (
+                summary["request_overhead"] + output_tokens / summary["decode_tokens_per_second"]
+            )
+        else:
+            seconds = DEFAULT_REQUEST_OVERHEAD + output_tokens / DEFAULT_TOKENS_PER_SECOND
+        cost = (
+            (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+            if price is not None
+            else None
+        )
+    return {
+        "stage": stage,
+        "provider": provider,
+        "model": model,
+        "clusters": clusters,
+        "input_tokens": 0 if cached else input_tokens,
+        "output_tokens": 0 if cached else output_tokens,
+        "cached": cached,
+        "estimated": estimated,
+        "seconds": seconds,
+        "cost": cost,
+    }
+
+
+def _wall_time(requests: list[dict[str, Any]], parallel: int) -> float:
+    """Estimate the wall-clock time of requests sent with up to parallel in flight."""
+    seconds = [request["seconds"] for request in requests]
+    if not seconds:
+        return 0.0
+    return max(max(seconds), sum(seconds) / max(1, parallel))
+
+
+def _annotation_requests(
+    marker_genes: dict[str, list[str]],
+    species: str,
+    provider: str,
+    model: str,
+    tissue: Optional[str] = None,
+    additional_context: Optional[str] = None,
+    use_cache: bool = True,
+    cache_dir: Optional[str] = None,
+    max_marker_tokens: Optional[int] = None,
+    fast_mode: bool = False,
+    prices: Optional[dict[str, tuple[float, float]]] = None,
+) -> list[dict[str, Any]]:
+    """Render the chunk requests annotate_clusters would send and estimate each."""
+    requests = []
+    for chunk in plan_annotation_chunks(list(marker_genes), provider, model):
+        prompt, _ = _render_annotation_prompt(
+            {cluster: marker_genes[cluster] for cluster in chunk},
+            species,
+            tissue,
+            additional_context,
+            max_marker_tokens=max_marker_tokens,
+            fast_mode=fast_mode,
+        )
+        cached = use_cache and validate_cache(create_cache_key(prompt, model, provider), cache_dir)
+        requests.append(
+            _request_entry(
+                "annotation",
+                provider,
+                model,
+                len(chunk),
+                estimate_tokens(prompt),
+                len(chunk) * CHUNK_ANSWER_TOKENS,
+                cached=cached,
+                prices=prices,
+            )
+        )
+    return requests
+
+
+def _plan_report(requests: list[dict[str, Any]], stage_seconds: dict[str, float]) -> dict[str, Any]:
+    """Aggregate planned requests into a plan report."""
+    by_stage: dict[str, dict[str, Any]] = {}
+    for request in requests:
+        stage = by_stage.setdefault(
+            request["stage"],
+            {"requests": 0, "cache_hits": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0},
+        )
+        stage["requests"] += 1
+        stage["cache_hits"] += int(request["cached"])
+        stage["input_tokens"] += request["input_tokens"]
+        stage["output_tokens"] += request["output_tokens"]
+        stage["cost"] += request["cost"] or 0.0
+    for name, stage in by_stage.items():
+        stage["seconds"] = stage_seconds.get(name, 0.0)
+
+    return {
+        "requests": requests,
+        "by_stage": by_stage,
+        "totals": {
+            "requests": len(requests),
+            "cache_hits": sum(int(request["cached"]) for request in requests),
+            "input_tokens": sum(request["input_tokens"] for request in requests),
+            "output_tokens": sum(request["output_tokens"] for request in requests),
+            "cost": sum(request["cost"] or 0.0 for request in requests),
+            "seconds": sum(stage_seconds.values()),
+        },
+        "unpriced_models": sorted(
+            {request["model"] for request in requests if request["cost"] is None}
+        ),
+    }
+
+
+def plan_consensus_run(
+    marker_genes: dict[str, list[str]],
+    species: str,
+    models: list[Union[str, dict[str, str]]],
+    tissue: Optional[str] = None,
+    additional_context: Optional[str] = None,
+    max_discussion_rounds: int = 3,
+    use_cache: bool = True,
+    cache_dir: Optional[str] = None,
+    max_parallel_chunks: int = 4,
+    max_in_flight: Optional[int] = None,
+    max_marker_tokens: Optional[int] = None,
+    fast_mode: bool = False,
+    controversial_rate: float = BUDGET_CONTROVERSIAL_RATE,
+    prices: Optional[dict[str, tuple[float, float]]] = None,
+) -> dict[str, Any]:
+    """Plan an interactive_consensus_annotation run without calling any provider.
+
+    Every initial annotation prompt is rendered as the run would send it and
+    checked against the cache. Discussions depend on the answers, so they are
+    estimated for controversial_rate of the clusters, each discussed for all
+    max_discussion_rounds rounds by the first model, followed by a consensus check
+    per round. Tokens are estimated locally, cost uses the prices table, and time
+    uses each model's measured throughput.
+
+    Args:
+        marker_genes: Dictionary mapping cluster names to lists of marker genes
+        species: Species name (e.g., 'human', 'mouse')
+        models: Models of the run, as names or {'provider': ..., 'model': ...}
+        tissue: Optional tissue name
+        additional_context: Additional context included in the prompts
+        max_discussion_rounds: Maximum number of discussion rounds
+        use_cache: Whether the run uses the cache
+        cache_dir: Cache directory of the run
+        max_parallel_chunks: Number of chunk requests annotate_clusters sends at the same time
+        max_in_flight: Number of discussion requests in flight, if pipelined
+        max_marker_tokens: Token budget for the marker genes of all clusters
+        fast_mode: Whether the initial annotations run in fast mode
+        controversial_rate: Expected share of clusters that need a discussion
+        prices: Price table in USD per million (input, output) tokens. If None,
+            uses MODEL_PRICES
+
+    Returns:
+        dict[str, Any]: Plan report with the planned 'requests', totals 'by_stage'
+            and overall 'totals' (requests, cache_hits, input_tokens,
+            output_tokens, cost in USD, seconds), and 'unpriced_models'
+
+    """
+    if max_marker_tokens is not None:
+        marker_genes, _ = compact_marker_genes(marker_genes, max_marker_tokens)
+
+    resolved = []
+    for model_item in models:
+        if isinstance(model_item, dict):
+            model_name = model_item.get("model")
+            provider = model_item.get("provider") or get_provider(model_name)
+        else:
+            model_name = model_item
+            provider = get_provider(model_item)
+        resolved.append((provider, model_name))
+
+    requests = []
+    annotation_seconds = 0.0
+    for provider, model_name in resolved:
+        model_requests = _annotation_requests(
+            marker_genes,
+            species,
+            provider,
+            model_name,
+            tissue=tissue,
+            additional_context=additional_context,
+            use_cache=use_cache,
+            cache_dir=cache_dir,
+            fast_mode=fast_mode,
+            prices=prices,
+        )
+        # Models annotate one after another, the chunks of a model in parallel
+        annotation_seconds += _wall_time(model_requests, max_parallel_chunks)
+        requests.extend(model_requests)
+
+    discussion_requests = []
+    controversial = math.ceil(controversial_rate * len(marker_genes))
+    if resolved and controversial:
+        provider, model_name = resolved[0]
+        placeholder_votes = {name: "Unknown" for _, name in resolved}
+        discussion_tokens = sum(
+            estimate_tokens(
+                create_discussion_prompt(cluster_id, genes, placeholder_votes, species, tissue)
+            )
+            for cluster_id, genes in marker_genes.items()
+        ) / len(marker_genes)
+        check_tokens = (
+            estimate_tokens(create_consensus_check_prompt(["Unknown"] * len(resolved)))
+            + DISCUSSION_ANSWER_TOKENS
+        )
+        for _ in range(controversial):
+            for round_index in range(max_discussion_rounds):
+                discussion_requests.append(
+                    _request_entry(
+                        "discussion",
+                        provider,
+                        model_name,
+                        1,
+                        round(discussion_tokens) + round_index * DISCUSSION_ANSWER_TOKENS,
+                        DISCUSSION_ANSWER_TOKENS,
+                        prices=prices,
+                        estimated=True,
+                    )
+                )
+                discussion_requests.append(
+                    _request_entry(
+                        "consensus_check",
+                        provider,
+                        model_name,
+                        1,
+                        check_tokens,
+                        CONSENSUS_CHECK_ANSWER_TOKENS,
+                        prices=prices,
+                        estimated=True,
+                    )
+                )
+    requests.extend(discussion_requests)
+
+    # Discussions run one request at a time unless pipelined
+    discussion_seconds = _wall_time(discussion_requests, max_in_flight or 1)
+    return _plan_report(
+        requests, {"annotation": annotation_seconds, "discussion": discussion_seconds}
+    )
+
+
+def plan_batch_run(
+    marker_genes_list: list[Union[dict[str, list[str]], pd.DataFrame]],
+    species: str,
+    provider: str = "openai",
+    model: Optional[str] = None,
+    tissue: Optional[Union[str, list[str]]] = None,
+    additional_context: Optional[str] = None,
+    prompt_template: Optional[str] = None,
+    use_cache: bool = True,
+    cache_dir: Optional[str] = None,
+    max_workers: int = 4,
+    deduplicate_clusters: bool = False,
+    marker_top_n: Optional[int] = None,
+    prices: Optional[dict[str, tuple[float, float]]] = None,
+) -> dict[str, Any]:
+    """Plan a batch_annotate_clusters run without calling any provider.
+
+    The batch prompts are rendered as the run would send them. Marker sets that
+    are already cached are reported as cache hits with no tokens.
+
+    Args:
+        marker_genes_list: List of dictionaries mapping cluster names to lists of
+            marker genes, or list of DataFrames with 'cluster' and 'gene' columns
+        species: Species name (e.g., 'human', 'mouse')
+        provider: LLM provider
+        model: Model name. If None, uses the provider's default model
+        tissue: Tissue name, or a list with one tissue per set
+        additional_context: Additional context included in the prompts
+        prompt_template: Custom batch prompt template
+        use_cache: Whether the run uses the cache
+        cache_dir: Cache directory of the run
+        max_workers: Maximum number of batch requests sent at the same time
+        deduplicate_clusters: Whether the run annotates each unique marker list once
+        marker_top_n: Optional number of top markers compared and sent per cluster
+        prices: Price table in USD per million (input, output) tokens. If None,
+            uses MODEL_PRICES
+
+    Returns:
+        dict[str, Any]: Plan report in the format of plan_consensus_run
+
+    """
+    parsed_marker_genes_list = [
+        parse_marker_genes(marker_genes) if isinstance(marker_genes, pd.DataFrame) else marker_genes
+        for marker_genes in marker_genes_list
+    ]
+    if isinstance(tissue, list):
+        if len(tissue) != len(parsed_marker_genes_list):
+            raise ValueError(
+                f"Got {len(tissue)} tissues for {len(parsed_marker_genes_list)} marker sets"
+            )
+        tissues = list(tissue)
+    else:
+        tissues = [tissue] * len(parsed_marker_genes_list)
+    model = model or get_default_model(provider)
+
+    requests = []
+    if deduplicate_clusters:
+        for group_tissue in dict.fromkeys(tissues):
+            unique, _ = deduplicate_marker_sets(
+                [
+                    marker_genes
+                    for marker_genes, set_tissue in zip(parsed_marker_genes_list, tissues)
+                    if set_tissue == group_tissue
+                ],
+                top_n=marker_top_n,
+            )
+            requests.extend(
+                _annotation_requests(
+                    unique,
+                    species,
+                    provider,
+                    model,
+                    tissue=group_tissue,
+                    additional_context=additional_context,
+                    use_cache=use_cache,
+                    cache_dir=cache_dir,
+                    prices=prices,
+                )
+            )
+        return _plan_report(requests, {"annotation": _wall_time(requests, max_workers)})
+
+    _, first_index, cached, batches = _plan_batch_requests(
+        parsed_marker_genes_list,
+        tissues,
+        species=species,
+        provider=provider,
+        model=model,
+        additional_context=additional_context,
+        prompt_template=prompt_template,
+        use_cache=use_cache,
+        cache_dir=cache_dir,
+    )
+    for key in cached:
+        requests.append(
+            _request_entry(
+                "batch",
+                provider,
+                model,
+                len(parsed_marker_genes_list[first_index[key]]),
+                0,
+                0,
+                cached=True,
+                prices=prices,
+            )
+        )
+    for group_tissue, keys in batches:
+        set_markers = [parsed_marker_genes_list[first_index[key]] for key in keys]
+        prompt = create_batch_prompt(
+            marker_genes_list=set_markers,
+            species=species,
+            tissue=group_tissue,
+            additional_context=additional_context,
+            prompt_template=prompt_template,
+        )
+        clusters = sum(len(marker_genes) for marker_genes in set_markers)
+        requests.append(
+            _request_entry(
+                "batch",
+                provider,
+                model,
+                clusters,
+                estimate_tokens(prompt),
+                clusters * CHUNK_ANSWER_TOKENS + len(keys) * estimate_tokens("Set 00:"),
+                prices=prices,
+            )
+        )
+    return _plan_report(requests, {"batch": _wall_time(requests, max_workers)})
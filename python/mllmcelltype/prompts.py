@@ -2,13 +2,14 @@
 
 from __future__ import annotations
 
+import string
 from typing import Optional
 
 from .logger import write_log
+from .utils import estimate_tokens
 
 # Default prompt template for single dataset annotation
 DEFAULT_PROMPT_TEMPLATE = """You are an expert single-cell RNA-seq analyst specializing in cell type annotation.
-I need you to identify cell types of {species} cells from {tissue}.
 Below is a list of marker genes for each cluster.
 Please assign the most likely cell type to each cluster based on the marker genes.
 
@@ -20,10 +21,17 @@ Cluster 1: [cell type]
 Only provide the cell type name for each cluster. Be concise but specific.
 Some clusters can be a mixture of multiple cell types.
 
+I need you to identify cell types of {species} cells from {tissue}.
+
 Here are the marker genes for each cluster:
 {markers}
 """
 
+# Appended to annotation prompts in fast mode
+FAST_MODE_INSTRUCTION = """
+Answer with the annotations in the format above only. Do not explain your reasoning, add notes, or repeat the marker genes.
+"""
+
 # Original simpler template
 SIMPLE_PROMPT_TEMPLATE = """You are a cell type annotation expert. Below are marker genes for different cell clusters in {context}.
 
@@ -41,7 +49,6 @@ Only provide the cell type name, without any additional text or explanations.
 
 # Default prompt template for batch annotation
 DEFAULT_BATCH_PROMPT_TEMPLATE = """You are an expert single-cell RNA-seq analyst specializing in cell type annotation.
-I need you to identify cell types of {species} cells from {tissue}.
 Below are lists of marker genes for clusters from multiple datasets.
 Please assign the most likely cell type to each cluster based on the marker genes.
 
@@ -57,9 +64,37 @@ Cluster 1: [cell type]
 ...and so on, IN NUMERICAL ORDER.
 
 Only provide the cell type name for each cluster. Be concise but specific.
+
+I need you to identify cell types of {species} cells from {tissue}.
+
+Here are the marker genes for each cluster:
+{markers}
 """
 
 
+# Template for checking consensus among the annotations of a single cluster
+CLUSTER_CONSENSUS_CHECK_TEMPLATE = """You are an expert in single-cell RNA-seq analysis and cell type annotation.
+
+I need you to analyze cell type annotations from different models for the same cluster and determine if there is a consensus.
+
+Please analyze these annotations and determine:
+1. If there is a consensus (1 for yes, 0 for no)
+2. The consensus proportion (between 0 and 1)
+3. An entropy value measuring the diversity of opinions (higher means more diverse)
+4. The best consensus annotation
+
+Respond with exactly 4 lines:
+Line 1: 0 or 1 (consensus reached?)
+Line 2: Consensus proportion (e.g., 0.75)
+Line 3: Entropy value (e.g., 0.85)
+Line 4: The consensus cell type (or most likely if no clear consensus)
+
+Only output these 4 lines, nothing else.
+
+The annotations are:
+{annotations}"""
+
+
 def create_consensus_check_prompt(annotations: list[str]) -> str:
     """Create a prompt for checking consensus among different annotations.
 
@@ -70,32 +105,88 @@ def create_consensus_check_prompt(annotations: list[str]) -> str:
         str: Formatted prompt for LLM to check consensus
 
     """
-    prompt = """You are an expert in single-cell RNA-seq analysis and cell type annotation.
+    # Format the annotations
+    formatted_annotations = "\n".join([f"- {anno}" for anno in annotations])
 
-I need you to analyze the following cell type annotations from different models for the same cluster and determine if there is a consensus.
+    # Replace the placeholder
+    return CLUSTER_CONSENSUS_CHECK_TEMPLATE.replace("{annotations}", formatted_annotations)
 
-The annotations are:
-{annotations}
 
-Please analyze these annotations and determine:
+# Template for checking consensus for many clusters in a single request
+DEFAULT_BATCH_CONSENSUS_CHECK_TEMPLATE = """You are an expert in single-cell RNA-seq analysis and cell type annotation.
+
+For each cluster below you are given the cell type annotations that different models produced for the same cluster. Treat annotations that differ only in wording (e.g., 'NK cells' and 'Natural killer cells') as the same cell type.
+
+For each cluster, determine:
 1. If there is a consensus (1 for yes, 0 for no)
 2. The consensus proportion (between 0 and 1)
 3. An entropy value measuring the diversity of opinions (higher means more diverse)
 4. The best consensus annotation
 
-Respond with exactly 4 lines:
-Line 1: 0 or 1 (consensus reached?)
-Line 2: Consensus proportion (e.g., 0.75)
-Line 3: Entropy value (e.g., 0.85)
-Line 4: The consensus cell type (or most likely if no clear consensus)
+Respond ONLY with a valid JSON object in the following format, with one entry per cluster and using the EXACT SAME cluster IDs as provided:
+```json
+{{
+  "clusters": [
+    {{
+      "cluster": "0",
+      "consensus": 1,
+      "consensus_proportion": 0.75,
+      "entropy": 0.81,
+      "cell_type": "T cells"
+    }}
+  ]
+}}
+```
+
+Here are the annotations for each cluster:
+{clusters}
+"""
 
-Only output these 4 lines, nothing else."""
 
-    # Format the annotations
+def format_consensus_check_block(cluster_id: str, annotations: list[str]) -> str:
+    """Format the annotations of one cluster for a batched consensus check prompt.
+
+    Args:
+        cluster_id: ID of the cluster
+        annotations: List of cell type annotations from different models
+
+    Returns:
+        str: Formatted cluster block
+
+    """
     formatted_annotations = "\n".join([f"- {anno}" for anno in annotations])
+    return f"Cluster {cluster_id}:\n{formatted_annotations}\n"
 
-    # Replace the placeholder
-    return prompt.replace("{annotations}", formatted_annotations)
+
+def create_batch_consensus_check_prompt(
+    cluster_annotations: dict[str, list[str]], prompt_template: Optional[str] = None
+) -> str:
+    """Create a prompt for checking consensus for several clusters in one request.
+
+    Args:
+        cluster_annotations: Dictionary mapping cluster IDs to lists of cell type
+            annotations from different models
+        prompt_template: Custom prompt template
+
+    Returns:
+        str: Formatted prompt for LLM to check consensus of all given clusters
+
+    """
+    write_log(f"Creating batch consensus check prompt for {len(cluster_annotations)} clusters")
+
+    # Use default template if none provided
+    if not prompt_template:
+        prompt_template = DEFAULT_BATCH_CONSENSUS_CHECK_TEMPLATE
+
+    clusters_text = "\n".join(
+        format_consensus_check_block(cluster_id, annotations)
+        for cluster_id, annotations in cluster_annotations.items()
+    )
+
+    prompt = prompt_template.format(clusters=clusters_text)
+
+    write_log(f"Generated batch consensus check prompt with {len(prompt)} characters")
+    return prompt
 
 
 # Original simpler batch template
@@ -121,7 +212,6 @@ Only provide the cell type name, without any additional text or explanations.
 
 # Default JSON format prompt template
 DEFAULT_JSON_PROMPT_TEMPLATE = """You are an expert single-cell RNA-seq analyst specializing in cell type annotation.
-I need you to identify cell types of {species} cells from {tissue}.
 Below is a list of marker genes for each cluster.
 Please assign the most likely cell type to each cluster based on the marker genes.
 
@@ -152,6 +242,8 @@ For each cluster, provide:
 3. Your confidence level (high, medium, low)
 4. A list of 2-4 key markers that support your annotation
 
+I need you to identify cell types of {species} cells from {tissue}.
+
 Here are the marker genes for each cluster:
 {markers}
 """
@@ -159,15 +251,7 @@ Here are the marker genes for each cluster:
 # Template for facilitating discussion for controversial clusters
 DEFAULT_DISCUSSION_TEMPLATE = """You are an expert in single-cell RNA-seq cell type annotation tasked with resolving disagreements between model predictions.
 
-Cluster ID: {cluster_id}
-Species: {species}
-Tissue: {tissue}
-
-Marker genes for this cluster:
-{marker_genes}
-
-Different model predictions:
-{model_votes}
+You will be given the species, tissue and marker genes of a cluster and the predictions of different models for it.
 
 Your task:
 1. Analyze the marker genes for this cluster
@@ -196,6 +280,53 @@ End with a clear final decision on the correct cell type, including:
 - Shannon Entropy (H): Calculate and provide the exact value (0 for perfect consensus)
 
 You MUST provide numerical values for both CP and H, not just qualitative descriptions.
+
+Cluster ID: {cluster_id}
+Species: {species}
+Tissue: {tissue}
+
+Marker genes for this cluster:
+{marker_genes}
+
+Different model predictions:
+{model_votes}
+"""
+
+# Template for discussing several controversial clusters in a single request
+DEFAULT_BATCH_DISCUSSION_TEMPLATE = """You are an expert in single-cell RNA-seq cell type annotation tasked with resolving disagreements between model predictions.
+
+For each cluster below you are given its marker genes, the predictions of different models and, in later rounds, the conclusion of the previous discussion round.
+
+Your task for EACH cluster:
+1. Analyze the marker genes, considering tissue context and marker gene specificity
+2. Evaluate each model's prediction and decide which is most accurate, or propose a better cell type annotation
+3. Calculate the following metrics over the model predictions and your decision:
+   a) Consensus Proportion (CP) = Number of opinions supporting the final cell type / Total number of opinions
+   b) Shannon Entropy (H) = -sum(p_i * log2(p_i)) over all unique opinions i, where p_i is the proportion of opinions for cell type i
+
+Treat annotations that differ only in wording (e.g., 'NK cells' and 'Natural killer cells') as the same cell type.
+
+Respond ONLY with a valid JSON object in the following format, with one entry per cluster and using the EXACT SAME cluster IDs as provided:
+```json
+{{
+  "clusters": [
+    {{
+      "cluster": "0",
+      "cell_type": "T cells",
+      "key_markers": ["CD3D", "CD3E"],
+      "consensus_proportion": 0.75,
+      "entropy": 0.81,
+      "reasoning": "One or two sentences explaining the decision"
+    }}
+  ]
+}}
+```
+
+Species: {species}
+Tissue: {tissue}
+
+Here are the clusters to discuss:
+{clusters}
 """
 
 # Template for checking consensus across models
@@ -219,15 +350,8 @@ Provide a final consensus annotation for each cluster and note any controversial
 # Template for checking if consensus is reached after discussion
 DEFAULT_DISCUSSION_CONSENSUS_CHECK_TEMPLATE = """You are an expert in single-cell RNA-seq analysis, evaluating whether a consensus has been reached after discussion about a controversial cluster annotation.
 
-Cluster ID: {cluster_id}
-
-Discussion summary:
-{discussion}
-
-Proposed cell type: {proposed_cell_type}
-
 Your task:
-1. Analyze the discussion and determine if there is consensus on the cell type annotation
+1. Analyze the discussion below and determine if there is consensus on the cell type annotation
 2. Normalize minor differences in terminology (e.g., 'NK cells' = 'Natural Killer cells')
 3. Calculate the following metrics:
    - Consensus Proportion = Number of supporting opinions / Total number of opinions
@@ -242,8 +366,102 @@ Line 3: Shannon Entropy (a decimal number)
 Line 4: The majority cell type prediction
 
 RESPOND WITH EXACTLY FOUR LINES AS SPECIFIED ABOVE.
+
+Cluster ID: {cluster_id}
+
+Discussion summary:
+{discussion}
+
+Proposed cell type: {proposed_cell_type}
 """
 
+# Template for the initial discussion of a single cluster
+DEFAULT_INITIAL_DISCUSSION_TEMPLATE = """You are an expert in single-cell RNA-seq analysis, assigned to identify the cell type for a specific cluster.
+
+Your task:
+1. Analyze the marker genes given below and their expression patterns
+2. Consider the cell types that might express this combination of genes
+3. Provide a detailed reasoning process
+4. Determine the most likely cell type for this cluster
+
+Give a thorough analysis, explaining which genes are most informative and why.
+End with a clear cell type determination.
+
+Cluster ID: {cluster_id}
+Species: {species}
+Tissue: {tissue}
+
+Marker genes: {marker_genes}
+"""
+
+# Shortest prompt prefix that providers cache (about 1024 tokens for Anthropic and OpenAI)
+MIN_CACHEABLE_PREFIX_TOKENS = 1024
+
+# Header of the previous round, which follow-up discussion prompts append
+PREVIOUS_DISCUSSION_HEADER = "\n\nPrevious discussion round:\n"
+
+# Templates whose leading instructions are the same in every request, so that
+# providers can cache them as a prompt prefix
+CACHEABLE_TEMPLATES = (
+    DEFAULT_PROMPT_TEMPLATE,
+    DEFAULT_BATCH_PROMPT_TEMPLATE,
+    DEFAULT_JSON_PROMPT_TEMPLATE,
+    CLUSTER_CONSENSUS_CHECK_TEMPLATE,
+    DEFAULT_BATCH_CONSENSUS_CHECK_TEMPLATE,
+    DEFAULT_DISCUSSION_TEMPLATE,
+    DEFAULT_BATCH_DISCUSSION_TEMPLATE,
+    DEFAULT_DISCUSSION_CONSENSUS_CHECK_TEMPLATE,
+    DEFAULT_INITIAL_DISCUSSION_TEMPLATE,
+)
+
+
+def _static_prefix(template: str) -> str:
+    """Get the literal text of a template before its first placeholder."""
+    prefix = []
+    for literal_text, field_name, _, _ in string.Formatter().parse(template):
+        prefix.append(literal_text)
+        if field_name is not None:
+            break
+    return "".join(prefix)
+
+
+def split_cacheable_prefix(
+    prompt: str, min_tokens: int = MIN_CACHEABLE_PREFIX_TOKENS
+) -> tuple[str, str]:
+    """Split a prompt into the prefix that later requests reuse and the rest.
+
+    For discussion prompts the prefix runs through the cluster's species, tissue,
+    marker genes and votes, which every round of its discussion repeats before
+    appending the previous round. For other prompts built from CACHEABLE_TEMPLATES
+    it is the literal start of the template. Providers only cache long prefixes,
+    so shorter ones are not split off.
+
+    Args:
+        prompt: The prompt to split
+        min_tokens: Shortest prefix worth caching, in estimated tokens
+
+    Returns:
+        tuple[str, str]: (reused prefix, variable suffix). The prefix is empty if the
+            prompt was not built from a cacheable template or the prefix is shorter
+            than min_tokens.
+
+    """
+    prefix = max(
+        (
+            _static_prefix(template)
+            for template in CACHEABLE_TEMPLATES
+            if prompt.startswith(_static_prefix(template))
+        ),
+        key=len,
+        default="",
+    )
+    if prefix and prefix == _static_prefix(DEFAULT_DISCUSSION_TEMPLATE):
+        end = prompt.find(PREVIOUS_DISCUSSION_HEADER)
+        prefix = prompt[:end] if end >= 0 else prompt.rstrip()
+    if not prefix or estimate_tokens(prefix) < min_tokens:
+        return "", prompt
+    return prefix, prompt[len(prefix) :]
+
 
 def create_prompt(
     marker_genes: dict[str, list[str]],
@@ -251,6 +469,7 @@ def create_prompt(
     tissue: Optional[str] = None,
     additional_context: Optional[str] = None,
     prompt_template: Optional[str] = None,
+    fast_mode: bool = False,
 ) -> str:
     """Create a prompt for cell type annotation.
 
@@ -260,6 +479,7 @@ def create_prompt(
         tissue: Tissue name (e.g., 'brain', 'liver')
         additional_context: Additional context to include in the prompt
         prompt_template: Custom prompt template
+        fast_mode: Whether to ask for the annotations without any rationale
 
     Returns:
         str: The generated prompt
@@ -274,13 +494,14 @@ def create_prompt(
     # Check if using the new or old template format
     if "{context}" in prompt_template and "{clusters}" in prompt_template:
         # Using old template format
-        return create_prompt_legacy(
+        prompt = create_prompt_legacy(
             marker_genes=marker_genes,
             species=species,
             tissue=tissue,
             additional_context=additional_context,
             prompt_template=prompt_template,
         )
+        return f"{prompt}{FAST_MODE_INSTRUCTION}" if fast_mode else prompt
 
     # Default tissue if none provided
     tissue_text = tissue if tissue else "unknown tissue"
@@ -306,6 +527,9 @@ def create_prompt(
         else:
             prompt = f"{prompt}{context_text}"
 
+    if fast_mode:
+        prompt = f"{prompt}{FAST_MODE_INSTRUCTION}"
+
     write_log(f"Generated prompt with {len(prompt)} characters")
     return prompt
 
@@ -557,11 +781,10 @@ def create_discussion_prompt(
 
     # Modify template for iterative discussion if previous discussion exists
     if previous_discussion:
-        # Create a modified template that includes previous discussion
-        iterative_template = prompt_template.replace(
-            "Your task:",
-            "Previous discussion round:\n{previous_discussion}\n\nYour task:",
-        )
+        # Append the previous round so the instructions stay a stable prefix
+        iterative_template = prompt_template
+        if "{previous_discussion}" not in iterative_template:
+            iterative_template = f"{iterative_template.rstrip()}{PREVIOUS_DISCUSSION_HEADER}{{previous_discussion}}\n"
 
         # Fill in the template with previous discussion
         prompt = iterative_template.format(
@@ -586,6 +809,79 @@ def create_discussion_prompt(
     return prompt
 
 
+def format_discussion_block(
+    cluster_id: str,
+    marker_genes: list[str],
+    model_votes: dict[str, str],
+    previous_discussion: Optional[str] = None,
+) -> str:
+    """Format one cluster for a batched discussion prompt.
+
+    Args:
+        cluster_id: ID of the cluster
+        marker_genes: List of marker genes for the cluster
+        model_votes: Dictionary mapping model names to cell type annotations
+        previous_discussion: Optional conclusion of the previous discussion round
+
+    Returns:
+        str: Formatted cluster block
+
+    """
+    lines = [f"Cluster {cluster_id}:", f"Marker genes: {', '.join(marker_genes)}", "Predictions:"]
+    lines.extend(f"- {model}: {vote}" for model, vote in model_votes.items())
+    if previous_discussion:
+        lines.append(f"Previous round: {previous_discussion}")
+    return "\n".join(lines) + "\n"
+
+
+def create_batch_discussion_prompt(
+    marker_genes: dict[str, list[str]],
+    model_votes: dict[str, dict[str, str]],
+    species: str,
+    tissue: Optional[str] = None,
+    previous_discussion: Optional[dict[str, str]] = None,
+    prompt_template: Optional[str] = None,
+) -> str:
+    """Create a prompt for discussing several controversial clusters in one request.
+
+    Args:
+        marker_genes: Dictionary mapping cluster IDs to lists of marker genes
+        model_votes: Dictionary mapping cluster IDs to dictionaries of model annotations
+        species: Species name (e.g., 'human', 'mouse')
+        tissue: Tissue name (e.g., 'brain', 'blood')
+        previous_discussion: Optional dictionary mapping cluster IDs to the conclusion
+            of the previous discussion round
+        prompt_template: Custom prompt template
+
+    Returns:
+        str: The generated prompt
+
+    """
+    write_log(f"Creating batch discussion prompt for {len(marker_genes)} clusters")
+
+    # Use default template if none provided
+    if not prompt_template:
+        prompt_template = DEFAULT_BATCH_DISCUSSION_TEMPLATE
+
+    # Default tissue if none provided
+    tissue_text = tissue if tissue else "unknown tissue"
+
+    clusters_text = "\n".join(
+        format_discussion_block(
+            cluster_id,
+            cluster_markers,
+            model_votes.get(cluster_id, {}),
+            (previous_discussion or {}).get(cluster_id),
+        )
+        for cluster_id, cluster_markers in marker_genes.items()
+    )
+
+    prompt = prompt_template.format(species=species, tissue=tissue_text, clusters=clusters_text)
+
+    write_log(f"Generated batch discussion prompt with {len(prompt)} characters")
+    return prompt
+
+
 def create_model_consensus_check_prompt(
     predictions: dict[str, dict[str, str]],
     species: str,
@@ -701,27 +997,8 @@ def create_initial_discussion_prompt(
     # Format marker genes text
     marker_genes_text = ", ".join(marker_genes)
 
-    # Template for initial discussion
-    template = """You are an expert in single-cell RNA-seq analysis, assigned to identify the cell type for a specific cluster.
-
-Cluster ID: {cluster_id}
-Species: {species}
-Tissue: {tissue}
-
-Marker genes: {marker_genes}
-
-Your task:
-1. Analyze these marker genes and their expression patterns
-2. Consider the cell types that might express this combination of genes
-3. Provide a detailed reasoning process
-4. Determine the most likely cell type for this cluster
-
-Give a thorough analysis, explaining which genes are most informative and why.
-End with a clear cell type determination.
-"""
-
     # Fill in the template
-    prompt = template.format(
+    prompt = DEFAULT_INITIAL_DISCUSSION_TEMPLATE.format(
         cluster_id=cluster_id,
         species=species,
         tissue=tissue_text,
@@ -1,20 +1,54 @@
 """Anthropic provider module for LLMCellType."""
 
 import json
-import time
+from typing import Any, Optional, Union
 
 import requests
 
 from ..logger import write_log
+from ..prompts import split_cacheable_prefix
+from ..retry import raise_for_status
+from ..router import record_prompt_usage
+from .response import ProviderResponse, split_response_text
 
 
-def process_anthropic(prompt: str, model: str, api_key: str) -> list[str]:
+def _message_content(prompt: str) -> Union[str, list[dict[str, Any]]]:
+    """Build the user message content, marking the static prompt prefix for caching.
+
+    Args:
+        prompt: The prompt to send
+
+    Returns:
+        The prompt as is, or as text blocks whose first block carries cache_control
+
+    """
+    prefix, suffix = split_cacheable_prefix(prompt)
+    if not prefix:
+        return prompt
+    if not suffix.strip():
+        # The first round of a discussion is all prefix; text blocks must not be blank
+        return [{"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}]
+    return [
+        {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": suffix},
+    ]
+
+
+def process_anthropic(
+    prompt: str,
+    model: str,
+    api_key: str,
+    max_tokens: Optional[int] = None,
+    stop: Optional[list[str]] = None,
+) -> list[str]:
     """Process request using Anthropic Claude models.
 
     Args:
         prompt: The prompt to send to the API
         model: The model name (e.g., 'claude-3-opus', 'claude-3-sonnet')
         api_key: Anthropic API key
+        max_tokens: Optional output token limit of the response
+        stop: Optional stop sequences that end the response
 
     Returns:
         List[str]: Processed responses, one per cluster
@@ -65,18 +99,34 @@ def process_anthropic(prompt: str, model: str, api_key: str) -> list[str]:
                 "Anthropic Python SDK not installed. Please install with 'pip install anthropic'."
             ) from err
 
-        # Create client
-        client = anthropic.Anthropic(api_key=api_key)
+        # Create client; retries are handled by the provider layer, not the SDK
+        client = anthropic.Anthropic(api_key=api_key, max_retries=0)
 
         # Send the message
         write_log("Sending API request to Anthropic...")
+        options = {"stop_sequences": stop} if stop else {}
         response = client.messages.create(
-            model=model, max_tokens=4000, messages=[{"role": "user", "content": prompt}]
+            model=model,
+            max_tokens=max_tokens or 4000,
+            messages=[{"role": "user", "content": _message_content(prompt)}],
+            **options,
         )
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            usage = {
+                "input_tokens": getattr(usage, "input_tokens", 0),
+                "output_tokens": getattr(usage, "output_tokens", 0),
+                "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0),
+                "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0),
+            }
+            record_prompt_usage("anthropic", model, usage)
+
+        stop_reason = getattr(response, "stop_reason", None)
+        if stop_reason == "max_tokens":
+            write_log("Response was cut at the output token limit", level="warning")
 
         # Get response content
-        content = response.content[0].text
-        lines = content.strip().split("\n")
+        lines = split_response_text(response.content[0].text if response.content else None)
 
         write_log(f"Got response with {len(lines)} lines")
         write_log(f"Raw response from Anthropic:\n{lines}")
@@ -98,7 +148,7 @@ def process_anthropic(prompt: str, model: str, api_key: str) -> list[str]:
             lines = lines[:expected_lines]
 
         # Clean up response
-        return [line.rstrip(",") for line in lines]
+        return ProviderResponse([line.rstrip(",") for line in lines], stop_reason, usage)
 
     except (
         requests.RequestException,
@@ -110,10 +160,16 @@ def process_anthropic(prompt: str, model: str, api_key: str) -> list[str]:
         write_log(f"Error during Anthropic API call: {str(e)}", level="error")
 
         # Try alternative method with direct REST API if SDK fails
-        return process_anthropic_direct(prompt, model, api_key)
+        return process_anthropic_direct(prompt, model, api_key, max_tokens, stop)
 
 
-def process_anthropic_direct(prompt: str, model: str, api_key: str) -> list[str]:
+def process_anthropic_direct(
+    prompt: str,
+    model: str,
+    api_key: str,
+    max_tokens: Optional[int] = None,
+    stop: Optional[list[str]] = None,
+) -> list[str]:
     """Fallback method using direct API calls if the SDK fails"""
 
     write_log("Falling back to direct API calls for Anthropic")
@@ -128,9 +184,11 @@ def process_anthropic_direct(prompt: str, model: str, api_key: str) -> list[str]
     # Prepare the request body
     body = {
         "model": model,
-        "messages": [{"role": "user", "content": prompt}],
-        "max_tokens": 4096,
+        "messages": [{"role": "user", "content": _message_content(prompt)}],
+        "max_tokens": max_tokens or 4096,
     }
+    if stop:
+        body["stop_sequences"] = stop
 
     write_log("Sending direct API request...")
     # Make the API request
@@ -140,71 +198,32 @@ def process_anthropic_direct(prompt: str, model: str, api_key: str) -> list[str]
         "anthropic-version": "2023-06-01",
     }
 
-    max_retries = 3
-    retry_delay = 2
+    response = requests.post(url=url, headers=headers, data=json.dumps(body), timeout=30)
+
+    # Check for errors; transient failures are retried by the provider layer
+    if response.status_code != 200:
+        raise_for_status(response, "Anthropic")
+
+    # Parse the response
+    content = response.json()
+    record_prompt_usage("anthropic", model, content.get("usage"))
+    stop_reason = content.get("stop_reason")
+    if stop_reason == "max_tokens":
+        write_log("Response was cut at the output token limit", level="warning")
+    res = split_response_text(content["content"][0]["text"] if content.get("content") else None)
+    write_log(f"Got response with {len(res)} lines")
+
+    # If we got fewer lines than expected, pad with "Unknown"
+    if len(res) < expected_lines:
+        write_log(
+            f"Warning: Got {len(res)} lines but expected {expected_lines}. Padding with 'Unknown'."
+        )
+        res.extend(["Unknown"] * (expected_lines - len(res)))
 
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url=url, headers=headers, data=json.dumps(body), timeout=30)
-
-            # Check for errors
-            if response.status_code != 200:
-                try:
-                    error_message = response.json()
-                    error_detail = error_message.get("error", {}).get("message", f"model: {model}")
-                    write_log(f"ERROR: Anthropic API request failed: {error_detail}")
-                except (ValueError, KeyError, json.JSONDecodeError):
-                    write_log(
-                        f"ERROR: Anthropic API request failed with status {response.status_code}"
-                    )
-
-                # If rate limited, wait and retry
-                if response.status_code == 429 and attempt < max_retries - 1:
-                    wait_time = retry_delay * (2**attempt)
-                    write_log(f"Rate limited. Waiting {wait_time} seconds before retrying...")
-                    time.sleep(wait_time)
-                    continue
-
-                response.raise_for_status()
-
-            # Parse the response
-            content = response.json()
-            res = content["content"][0]["text"].strip().split("\n")
-            write_log(f"Got response with {len(res)} lines")
-
-            # If we got fewer lines than expected, pad with "Unknown"
-            if len(res) < expected_lines:
-                write_log(
-                    f"Warning: Got {len(res)} lines but expected {expected_lines}. Padding with 'Unknown'."
-                )
-                res.extend(["Unknown"] * (expected_lines - len(res)))
-
-            # If we got more lines than expected, truncate
-            if len(res) > expected_lines:
-                write_log(
-                    f"Warning: Got {len(res)} lines but expected {expected_lines}. Truncating."
-                )
-                res = res[:expected_lines]
-
-            # Clean up results (remove commas at the end of lines)
-            return [line.rstrip(",") for line in res]
-
-        except (
-            requests.RequestException,
-            ValueError,
-            json.JSONDecodeError,
-            KeyError,
-        ) as e:
-            write_log(
-                f"Error during direct API call (attempt {attempt + 1}/{max_retries}): {str(e)}"
-            )
-            if attempt < max_retries - 1:
-                wait_time = retry_delay * (2**attempt)
-                write_log(f"Waiting {wait_time} seconds before retrying...")
-                time.sleep(wait_time)
-            else:
-                # If all attempts failed, return empty results
-                write_log("All API attempts failed. Returning empty results.", level="error")
-                return ["Unknown"] * expected_lines
-    # 如果所有重试都失败，返回空结果
-    return ["Unknown"] * expected_lines
+    # If we got more lines than expected, truncate
+    if len(res) > expected_lines:
+        write_log(f"Warning: Got {len(res)} lines but expected {expected_lines}. Truncating.")
+        res = res[:expected_lines]
+
+    # Clean up results (remove commas at the end of lines)
+    return ProviderResponse([line.rstrip(",") for line in res], stop_reason, content.get("usage"))
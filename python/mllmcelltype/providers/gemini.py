@@ -1,20 +1,30 @@
 """Gemini provider module for LLMCellType."""
 
-import time
+from typing import Optional
 
 from google import genai
 from google.genai import types
 
 from ..logger import write_log
+from ..router import record_prompt_usage
+from .response import ProviderResponse, split_response_text
 
 
-def process_gemini(prompt: str, model: str, api_key: str) -> list[str]:
+def process_gemini(
+    prompt: str,
+    model: str,
+    api_key: str,
+    max_tokens: Optional[int] = None,
+    stop: Optional[list[str]] = None,
+) -> list[str]:
     """Process request using Google Gemini models.
 
     Args:
         prompt: The prompt to send to the API
         model: The model name (e.g., 'gemini-2.0-flash', 'gemini-2.0-pro')
         api_key: Google API key
+        max_tokens: Optional output token limit of the response
+        stop: Optional stop sequences that end the response
 
     Returns:
         List[str]: Processed responses, one per cluster
@@ -32,37 +42,41 @@ def process_gemini(prompt: str, model: str, api_key: str) -> list[str]:
     client = genai.Client(api_key=api_key)
     write_log(f"Using model: {model}")
 
-    # Set up retry parameters
-    max_retries = 3
-    retry_delay = 2
-
-    # Try to generate content with retries
-    for attempt in range(max_retries):
-        try:
-            write_log("Sending API request...")
-
-            # Generate content
-            response = client.models.generate_content(
-                model=model,
-                contents=prompt,
-                config=types.GenerateContentConfig(temperature=0.7, max_output_tokens=4096),
-            )
-
-            # Parse the response
-            result = response.text.strip().split("\n")
-            write_log(f"Got response with {len(result)} lines")
-            write_log(f"Raw response from Gemini:\n{result}")
-
-            # Clean up results (remove commas at the end of lines)
-            return [line.rstrip(",") for line in result]
-
-        except Exception as e:
-            write_log(f"Error during API call (attempt {attempt + 1}/{max_retries}): {str(e)}")
-            if attempt < max_retries - 1:
-                wait_time = retry_delay * (2**attempt)
-                write_log(f"Waiting {wait_time} seconds before retrying...")
-                time.sleep(wait_time)
-            else:
-                raise
-    # 如果所有重试都失败，返回空结果
-    return ["Unknown"]
+    write_log("Sending API request...")
+
+    # Generate content; transient failures are retried by the provider layer
+    response = client.models.generate_content(
+        model=model,
+        contents=prompt,
+        config=types.GenerateContentConfig(
+            temperature=0.7,
+            max_output_tokens=max_tokens or 4096,
+            stop_sequences=stop or None,
+        ),
+    )
+    candidates = getattr(response, "candidates", None) or []
+    finish_reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+    if finish_reason is not None:
+        # The SDK reports an enum such as FinishReason.MAX_TOKENS
+        finish_reason = str(getattr(finish_reason, "name", finish_reason)).rsplit(".", 1)[-1]
+    if finish_reason == "MAX_TOKENS":
+        write_log("Response was cut at the output token limit", level="warning")
+
+    # Gemini caches repeated prompt prefixes implicitly and reports the cached share
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        usage = {
+            "prompt_token_count": getattr(usage, "prompt_token_count", 0),
+            "cached_content_token_count": getattr(usage, "cached_content_token_count", 0),
+            "candidates_token_count": getattr(usage, "candidates_token_count", 0),
+            "thoughts_token_count": getattr(usage, "thoughts_token_count", 0),
+        }
+        record_prompt_usage("gemini", model, usage)
+
+    # Parse the response
+    result = split_response_text(response.text)
+    write_log(f"Got response with {len(result)} lines")
+    write_log(f"Raw response from Gemini:\n{result}")
+
+    # Clean up results (remove commas at the end of lines)
+    return ProviderResponse([line.rstrip(",") for line in result], finish_reason, usage)
@@ -1,20 +1,31 @@
 """Grok provider module for LLMCellType."""
 
 import json
-import time
+from typing import Optional
 
 import requests
 
 from ..logger import write_log
-
-
-def process_grok(prompt: str, model: str, api_key: str) -> list[str]:
+from ..retry import raise_for_status
+from ..router import record_prompt_usage
+from .response import ProviderResponse, split_response_text
+
+
+def process_grok(
+    prompt: str,
+    model: str,
+    api_key: str,
+    max_tokens: Optional[int] = None,
+    stop: Optional[list[str]] = None,
+) -> list[str]:
     """Process request using Grok models from xAI.
 
     Args:
         prompt: The prompt to send to the API
         model: The model name (e.g., 'grok-3-latest')
         api_key: xAI API key
+        max_tokens: Optional output token limit of the response
+        stop: Optional stop sequences that end the response
 
     Returns:
         List[str]: Processed responses, one per cluster
@@ -32,58 +43,32 @@ def process_grok(prompt: str, model: str, api_key: str) -> list[str]:
     url = "https://api.x.ai/v1/chat/completions"
     write_log(f"Using model: {model}")
 
-    # Process all input at once
-    write_log("Processing input in 1 chunk")
-
     # Prepare the request body
     body = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+    if max_tokens:
+        body["max_tokens"] = max_tokens
+    if stop:
+        body["stop"] = stop
 
     write_log("Sending API request...")
     # Make the API request
     headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
 
-    max_retries = 3
-    retry_delay = 2
-
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url=url, headers=headers, data=json.dumps(body), timeout=30)
-
-            # Check for errors
-            if response.status_code != 200:
-                error_message = response.json()
-                write_log(
-                    f"ERROR: Grok API request failed: {error_message.get('error', {}).get('message', 'Unknown error')}"
-                )
-
-                # If rate limited, wait and retry
-                if response.status_code == 429 and attempt < max_retries - 1:
-                    wait_time = retry_delay * (2**attempt)
-                    write_log(f"Rate limited. Waiting {wait_time} seconds before retrying...")
-                    time.sleep(wait_time)
-                    continue
-
-                response.raise_for_status()
-
-            # Parse the response
-            content = response.json()
-            res = content["choices"][0]["message"]["content"].strip().split("\n")
-            write_log(f"Got response with {len(res)} lines")
-            write_log(f"Raw response from Grok:\n{res}")
-
-            # Success, exit retry loop
-            write_log("All chunks processed successfully")
-            # Clean up results (remove commas at the end of lines)
-            return [line.rstrip(",") for line in res]
-
-        except Exception as e:
-            write_log(f"Error during API call (attempt {attempt + 1}/{max_retries}): {str(e)}")
-            if attempt < max_retries - 1:
-                wait_time = retry_delay * (2**attempt)
-                write_log(f"Waiting {wait_time} seconds before retrying...")
-                time.sleep(wait_time)
-            else:
-                raise
-
-    # This should not be reached if all retries fail (an exception would be raised)
-    return []
+    response = requests.post(url=url, headers=headers, data=json.dumps(body), timeout=30)
+
+    # Check for errors; transient failures are retried by the provider layer
+    if response.status_code != 200:
+        raise_for_status(response, "Grok")
+
+    # Parse the response
+    content = response.json()
+    record_prompt_usage("grok", model, content.get("usage"))
+    finish_reason = content["choices"][0].get("finish_reason") if content.get("choices") else None
+    if finish_reason == "length":
+        write_log("Response was cut at the output token limit", level="warning")
+    res = split_response_text(content["choices"][0]["message"]["content"])
+    write_log(f"Got response with {len(res)} lines")
+    write_log(f"Raw response from Grok:\n{res}")
+
+    # Clean up results (remove commas at the end of lines)
+    return ProviderResponse([line.rstrip(",") for line in res], finish_reason, content.get("usage"))
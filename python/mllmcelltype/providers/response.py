@@ -0,0 +1,61 @@
+"""Response type shared by the provider modules of LLMCellType."""
+
+from __future__ import annotations
+
+from collections.abc import Iterable
+from typing import Any, Optional
+
+# Stop reasons with which providers report a response cut at its output token limit
+TRUNCATION_REASONS = ("length", "max_tokens")
+
+
+class ProviderResponse(list):
+    """Response lines of a provider call, with the reason the model stopped and its usage.
+
+    It is the list of lines the providers have always returned, so callers that
+    only need the text are unaffected. The stop reason and usage do not survive
+    copying or caching the lines.
+    """
+
+    def __init__(
+        self,
+        lines: Iterable[str] = (),
+        finish_reason: Optional[str] = None,
+        usage: Optional[dict[str, Any]] = None,
+    ):
+        """Create a response.
+
+        Args:
+            lines: Response lines
+            finish_reason: Stop reason reported by the provider ('stop', 'length',
+                'max_tokens', ...), or None if it reported none
+            usage: Usage object reported by the provider (see read_usage_tokens),
+                or None if it reported none
+
+        """
+        super().__init__(lines)
+        self.finish_reason = finish_reason
+        self.usage = usage
+
+    @property
+    def truncated(self) -> Optional[bool]:
+        """Whether the response was cut at its output token limit, or None if unknown."""
+        if self.finish_reason is None:
+            return None
+        return self.finish_reason.lower() in TRUNCATION_REASONS
+
+
+def split_response_text(text: Optional[str]) -> list[str]:
+    """Split response text into lines, reading a missing text as empty.
+
+    Thinking models can spend their whole output limit on hidden reasoning and
+    return no text at all.
+
+    Args:
+        text: Response text, or None
+
+    Returns:
+        list[str]: The stripped text split into lines
+
+    """
+    return (text or "").strip().split("\n")
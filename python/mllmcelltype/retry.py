@@ -0,0 +1,459 @@
+"""Retry policy, deadlines and cancellation for provider calls in LLMCellType."""
+
+from __future__ import annotations
+
+import email.utils
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional, TypeVar
+
+import requests
+
+from .logger import write_log
+
+T = TypeVar("T")
+
+# HTTP status codes that indicate a transient failure worth retrying
+RETRY_STATUS_CODES = (408, 409, 425, 429, 500, 502, 503, 504, 529)
+
+# Headers that report when a rate limit resets, as durations or timestamps
+RATE_LIMIT_RESET_HEADERS = (
+    "x-ratelimit-reset-requests",
+    "x-ratelimit-reset-tokens",
+    "x-ratelimit-reset",
+    "anthropic-ratelimit-requests-reset",
+    "anthropic-ratelimit-tokens-reset",
+)
+
+
+@dataclass
+class RetryPolicy:
+    """How provider calls are retried.
+
+    Each call gets at most max_attempts attempts and must finish within deadline
+    seconds, retries included. Waits use full-jitter exponential backoff unless
+    the server says how long to wait (Retry-After or rate-limit reset headers).
+    All calls of a run share a budget of retry_budget retries, so an outage
+    cannot multiply into hundreds of retries.
+    """
+
+    max_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+    deadline: Optional[float] = 180.0
+    retry_budget: Optional[int] = 50
+
+    def backoff(self, attempt: int) -> float:
+        """Get a full-jitter backoff delay.
+
+        Args:
+            attempt: Number of the failed attempt, starting at 0
+
+        Returns:
+            float: Delay in seconds, uniform between 0 and the exponential cap
+
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class RetryBudget:
+    """Thread-safe count of the retries left in a run."""
+
+    def __init__(self, limit: Optional[int]):
+        """Create a budget.
+
+        Args:
+            limit: Number of retries allowed, or None for no limit
+
+        """
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def consume(self) -> bool:
+        """Take one retry from the budget.
+
+        Returns:
+            bool: False if the budget is exhausted
+
+        """
+        with self._lock:
+            if self.limit is not None and self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call is abandoned because its run was cancelled or ran out of time."""
+
+
+class CancellationToken:
+    """Deadline and cancellation flag shared by all calls of a run.
+
+    Pass the same token down the pipeline; once it is cancelled or its deadline
+    passes, pending provider calls are abandoned and new ones fail immediately
+    with DeadlineExceeded.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, parent: Optional[CancellationToken] = None):
+        """Create a token.
+
+        Args:
+            timeout: Seconds from now until the deadline, or None for no deadline
+            parent: Optional token of the enclosing run. This token is cancelled
+                whenever the parent is, and never outlives its deadline.
+
+        """
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        if parent is not None and parent.deadline is not None:
+            self.deadline = min(self.deadline or parent.deadline, parent.deadline)
+        self.parent = parent
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        """Cancel the run."""
+        self._event.set()
+
+    def _is_set(self) -> bool:
+        return self._event.is_set() or (self.parent is not None and self.parent._is_set())
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the run was cancelled or its deadline has passed."""
+        return self._is_set() or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+    def remaining(self) -> Optional[float]:
+        """Get the time left until the deadline.
+
+        Returns:
+            Optional[float]: Seconds left (0 if cancelled), or None without a deadline
+
+        """
+        if self._is_set():
+            return 0.0
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def wait(self, seconds: float) -> bool:
+        """Sleep for up to the given time, waking up early on cancellation.
+
+        Args:
+            seconds: Time to sleep
+
+        Returns:
+            bool: True if the token was cancelled
+
+        """
+        remaining = self.remaining()
+        if remaining is not None and remaining < seconds:
+            self._event.wait(remaining)
+            return True
+        if self.parent is not None:
+            # Poll so that cancelling the parent is noticed
+            end = time.monotonic() + seconds
+            while not self._event.wait(min(0.05, max(0.0, end - time.monotonic()))):
+                if self._is_set():
+                    return True
+                if time.monotonic() >= end:
+                    return False
+            return True
+        return self._event.wait(seconds)
+
+    def raise_if_cancelled(self, description: str) -> None:
+        """Raise DeadlineExceeded if the token was cancelled.
+
+        Args:
+            description: Name of the call used in the error message
+
+        """
+        if self._is_set():
+            raise DeadlineExceeded(f"{description}: run cancelled")
+        if self.cancelled:
+            raise DeadlineExceeded(f"{description}: deadline exceeded")
+
+
+def run_cancellable(func: Callable[[], T], token: CancellationToken, description: str) -> T:
+    """Run a blocking call, abandoning it when the token is cancelled.
+
+    The call runs on a daemon thread. An abandoned call keeps running in the
+    background until its own timeout, but its result is ignored.
+
+    Args:
+        func: The blocking call
+        token: Cancellation token of the run
+        description: Name of the call used in error messages
+
+    Returns:
+        The result of the call
+
+    """
+    token.raise_if_cancelled(description)
+    done = threading.Event()
+    outcome: dict[str, Any] = {}
+
+    def target() -> None:
+        try:
+            outcome["result"] = func()
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=target, name=f"call-{description}", daemon=True).start()
+    # Poll so that cancel() is noticed while waiting
+    while not done.wait(0.05):
+        token.raise_if_cancelled(description)
+
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+_default_policy = RetryPolicy()
+_budget = RetryBudget(_default_policy.retry_budget)
+
+
+def configure_retry(policy: RetryPolicy) -> None:
+    """Set the retry policy applied to every provider call and reset the budget.
+
+    Args:
+        policy: The retry policy
+
+    """
+    global _default_policy
+    _default_policy = policy
+    reset_retry_budget()
+
+
+def get_retry_policy() -> RetryPolicy:
+    """Get the retry policy applied to provider calls.
+
+    Returns:
+        RetryPolicy: The configured policy
+
+    """
+    return _default_policy
+
+
+def reset_retry_budget() -> RetryBudget:
+    """Start a new run-level retry budget.
+
+    Returns:
+        RetryBudget: The new budget
+
+    """
+    global _budget
+    _budget = RetryBudget(_default_policy.retry_budget)
+    return _budget
+
+
+def get_retry_budget() -> RetryBudget:
+    """Get the retry budget of the current run.
+
+    Returns:
+        RetryBudget: The current budget
+
+    """
+    return _budget
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Parse a reset header value into seconds from now.
+
+    Accepts plain seconds, durations like '1m30s' or '250ms', Unix timestamps
+    in seconds or milliseconds, and RFC 3339 timestamps.
+    """
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+
+    if number is not None:
+        if number > 1e12:
+            return number / 1000 - time.time()
+        if number > 1e9:
+            return number - time.time()
+        return number
+
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(n) * units[u] for n, u in parts)
+
+    try:
+        reset = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if reset.tzinfo is None:
+        reset = reset.replace(tzinfo=timezone.utc)
+    return (reset - datetime.now(timezone.utc)).total_seconds()
+
+
+def parse_retry_after(headers: Any, status_code: Optional[int] = None) -> Optional[float]:
+    """Get the wait time a server asks for before the next request.
+
+    Retry-After (seconds or HTTP date) and retry-after-ms are always honored.
+    Rate-limit reset headers are only used for 429 responses, since providers
+    send them with every response.
+
+    Args:
+        headers: Response headers
+        status_code: HTTP status code of the response
+
+    Returns:
+        Optional[float]: Seconds to wait, or None if the server gave no hint
+
+    """
+    if not headers:
+        return None
+    lower = {str(key).lower(): str(value) for key, value in dict(headers).items()}
+
+    if "retry-after-ms" in lower:
+        try:
+            return max(0.0, float(lower["retry-after-ms"]) / 1000)
+        except ValueError:
+            pass
+
+    if "retry-after" in lower:
+        value = lower["retry-after"]
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(value)
+                return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+
+    if status_code == 429:
+        resets = [_parse_duration(lower[key]) for key in RATE_LIMIT_RESET_HEADERS if key in lower]
+        resets = [reset for reset in resets if reset is not None]
+        if resets:
+            return max(0.0, max(resets))
+
+    return None
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if isinstance(status, int):
+        return status
+    for attr in ("status_code", "code", "status"):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Check whether a failed provider call is worth retrying.
+
+    Timeouts, connection errors and transient HTTP statuses (rate limits,
+    overload, server errors) are retried. Client errors such as invalid keys or
+    bad requests, and malformed responses, are not.
+
+    Args:
+        error: The exception raised by the provider
+
+    Returns:
+        bool: True if the call should be retried
+
+    """
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return True
+    # SDK clients (anthropic, google-genai) raise their own connection errors
+    if type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return True
+    return _status_code(error) in RETRY_STATUS_CODES
+
+
+def raise_for_status(response: requests.Response, provider: str) -> None:
+    """Log a failed API response and raise it as requests.HTTPError.
+
+    Args:
+        response: The failed response
+        provider: Provider name used in the log message
+
+    """
+    try:
+        detail = response.json().get("error", {})
+        message = detail.get("message", "Unknown error") if isinstance(detail, dict) else detail
+    except ValueError:
+        message = response.text[:200]
+    write_log(f"ERROR: {provider} API request failed with status {response.status_code}: {message}")
+    response.raise_for_status()
+    # Some non-200 statuses (e.g. 1xx, 3xx) do not raise in requests
+    raise requests.HTTPError(f"Unexpected status {response.status_code}", response=response)
+
+
+def call_with_retry(
+    func: Callable[[], T],
+    description: str,
+    policy: Optional[RetryPolicy] = None,
+    cancel_token: Optional[CancellationToken] = None,
+) -> T:
+    """Call a function, retrying transient failures according to a retry policy.
+
+    Args:
+        func: Function making one attempt
+        description: Name of the call used in log messages
+        policy: Retry policy. If None, uses the configured policy.
+        cancel_token: Optional cancellation token. No retry is started that would
+            end after its deadline, and waits end early when it is cancelled.
+
+    Returns:
+        The result of the first successful attempt
+
+    """
+    policy = policy or _default_policy
+    start_time = time.monotonic()
+
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            attempt += 1
+            if attempt >= policy.max_attempts or not is_retryable(e):
+                raise
+
+            response = getattr(e, "response", None)
+            delay = parse_retry_after(getattr(response, "headers", None), _status_code(e))
+            if delay is None:
+                delay = policy.backoff(attempt - 1)
+            elif delay > policy.max_delay:
+                write_log(
+                    f"{description}: server asked to wait {delay:.0f}s, not retrying",
+                    level="warning",
+                )
+                raise
+
+            elapsed = time.monotonic() - start_time
+            if policy.deadline is not None and elapsed + delay > policy.deadline:
+                write_log(f"{description}: deadline reached, not retrying", level="warning")
+                raise
+            remaining = cancel_token.remaining() if cancel_token else None
+            if remaining is not None and delay > remaining:
+                write_log(f"{description}: run deadline reached, not retrying", level="warning")
+                raise
+            if not _budget.consume():
+                write_log(f"{description}: retry budget exhausted, not retrying", level="warning")
+                raise
+
+            write_log(
+                f"{description} failed (attempt {attempt}/{policy.max_attempts}): {str(e)}. "
+                f"Retrying in {delay:.1f}s",
+                level="warning",
+            )
+            if cancel_token is None:
+                time.sleep(delay)
+            elif cancel_token.wait(delay):
+                cancel_token.raise_if_cancelled(description)
@@ -0,0 +1,651 @@
+"""Latency- and health-aware model routing for LLMCellType."""
+
+from __future__ import annotations
+
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from .logger import write_log
+
+# Default location of the persistent provider statistics
+DEFAULT_STATS_FILE = os.path.join(
+    os.path.expanduser("~"), ".llmcelltype", "stats", "provider_stats.json"
+)
+
+# Successful calls, and their spread in output tokens, needed to fit a decode rate
+MIN_DECODE_SAMPLES = 5
+MIN_DECODE_TOKEN_SPREAD = 200
+
+
+@dataclass
+class RoutingConstraints:
+    """User constraints on which models the router may pick for auxiliary calls."""
+
+    max_error_rate: float = 0.5
+    max_latency: Optional[float] = None
+    allowed_providers: Optional[list[str]] = None
+    excluded_models: Optional[list[str]] = None
+    min_samples: int = 3
+
+
+@dataclass
+class HedgingPolicy:
+    """Policy for sending a duplicate request when the first one is slow.
+
+    A hedge is sent once a request has run longer than the given latency
+    percentile of its model (or min_delay while there are no statistics). It goes
+    to the backup configured for the model in backups, given as
+    {'provider/model': (provider, model)}, or to the same model otherwise.
+    """
+
+    percentile: float = 95
+    min_delay: float = 2.0
+    backups: Optional[dict[str, tuple[str, str]]] = None
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a call is refused because the model's circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Circuit breaker for one provider/model.
+
+    The breaker opens after failure_threshold consecutive failures and refuses
+    calls while open. After reset_timeout seconds it lets a single probe call
+    through (half-open): success closes it again, failure reopens it.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        """Create a closed breaker.
+
+        Args:
+            failure_threshold: Consecutive failures after which the breaker opens
+            reset_timeout: Seconds to stay open before letting a probe call through
+
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """Whether a call would currently be let through."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                return time.monotonic() - self._opened_at >= self.reset_timeout
+            return False
+
+    def allow(self) -> bool:
+        """Check whether a call may proceed, moving to half-open when a probe is due.
+
+        Returns:
+            bool: True if the call may proceed
+
+        """
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Let exactly one probe call through
+                self.state = "half_open"
+                return True
+            return False
+
+    def record_success(self) -> None:
+        """Record a successful call, closing the breaker."""
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def release_probe(self) -> None:
+        """Give up a probe call without an outcome, so the next call probes instead."""
+        with self._lock:
+            if self.state == "half_open":
+                # The reset timeout has already passed, so the next allow() probes again
+                self.state = "open"
+
+    def record_failure(self) -> None:
+        """Record a failed call, opening the breaker if needed."""
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    write_log(
+                        f"Circuit breaker opened after {self.failures} consecutive failures",
+                        level="warning",
+                    )
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class ProviderStats:
+    """Rolling per-model statistics on latency, errors and token throughput.
+
+    Statistics are kept per 'provider/model' over the most recent calls and are
+    persisted as a small JSON file, so routing decisions carry over between runs.
+    Latencies and outcomes older than max_age are dropped, so a model excluded
+    for its error rate or latency is measured afresh once they expire.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        window: int = 100,
+        save_every: int = 10,
+        max_age: Optional[float] = 3600.0,
+    ):
+        """Load the statistics.
+
+        Args:
+            path: Path of the JSON stats file. If None, statistics are kept in memory only.
+            window: Number of recent calls kept per model
+            save_every: Save to disk after this many recorded calls
+            max_age: Seconds after which a recorded latency or outcome expires. If None,
+                they are kept until pushed out of the window.
+
+        """
+        self.path = path
+        self.window = window
+        self.save_every = save_every
+        self.max_age = max_age
+        self._entries: dict[str, dict[str, Any]] = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                write_log(f"Could not load provider stats from {path}: {str(e)}", level="warning")
+
+    @staticmethod
+    def _key(provider: str, model: str) -> str:
+        return f"{provider.lower()}/{model}"
+
+    def _expire(self, entry: dict[str, Any]) -> None:
+        """Drop latencies and outcomes older than max_age from an entry; call under the lock."""
+        if self.max_age is None:
+            return
+        cutoff = time.time() - self.max_age
+        for times_key, values_keys in (
+            ("latency_times", ("latencies", "output_tokens")),
+            ("outcome_times", ("outcomes",)),
+        ):
+            # Entries saved without timestamps have expired
+            times = entry.get(times_key) or [0.0] * len(entry[values_keys[0]])
+            kept = sum(1 for recorded in times if recorded >= cutoff)
+            entry[times_key] = times[len(times) - kept :]
+            for values_key in values_keys:
+                values = entry.get(values_key, [])
+                entry[values_key] = values[max(0, len(values) - kept) :]
+
+    def record(
+        self,
+        provider: str,
+        model: str,
+        latency: float,
+        success: bool,
+        output_tokens: int = 0,
+    ) -> None:
+        """Record the outcome of one call.
+
+        Args:
+            provider: Provider name
+            model: Model name
+            latency: Wall-clock time of the call in seconds
+            success: Whether the call returned a response
+            output_tokens: Estimated number of tokens in the response
+
+        """
+        with self._lock:
+            entry = self._entries.setdefault(
+                self._key(provider, model),
+                {"latencies": [], "outcomes": [], "tokens": 0, "time": 0.0},
+            )
+            self._expire(entry)
+            now = round(time.time(), 3)
+            if success:
+                entry["latencies"] = (entry["latencies"] + [round(latency, 3)])[-self.window :]
+                entry["latency_times"] = (entry.get("latency_times", []) + [now])[-self.window :]
+                entry["output_tokens"] = (entry.get("output_tokens", []) + [output_tokens])[
+                    -self.window :
+                ]
+                entry["tokens"] += output_tokens
+                entry["time"] += latency
+            entry["outcomes"] = (entry["outcomes"] + [1 if success else 0])[-self.window :]
+            entry["outcome_times"] = (entry.get("outcome_times", []) + [now])[-self.window :]
+            self._unsaved += 1
+            should_save = self.path and self._unsaved >= self.save_every
+
+        if should_save:
+            self.save()
+
+    def record_hedge(self, provider: str, model: str, won: bool) -> None:
+        """Record a hedged request sent for a slow call to a model.
+
+        Args:
+            provider: Provider name of the original request
+            model: Model name of the original request
+            won: Whether the hedge answered before the original request
+
+        """
+        with self._lock:
+            entry = self._entries.setdefault(
+                self._key(provider, model),
+                {"latencies": [], "outcomes": [], "tokens": 0, "time": 0.0},
+            )
+            entry["hedges"] = entry.get("hedges", 0) + 1
+            entry["hedge_wins"] = entry.get("hedge_wins", 0) + (1 if won else 0)
+
+    def record_prompt_usage(
+        self, provider: str, model: str, prompt_tokens: int, cached_tokens: int
+    ) -> None:
+        """Record the input tokens of one call and how many were served from a prompt cache.
+
+        Args:
+            provider: Provider name
+            model: Model name
+            prompt_tokens: Input tokens of the call, including cached ones
+            cached_tokens: Input tokens read from the provider's prompt cache
+
+        """
+        with self._lock:
+            entry = self._entries.setdefault(
+                self._key(provider, model),
+                {"latencies": [], "outcomes": [], "tokens": 0, "time": 0.0},
+            )
+            entry["prompt_tokens"] = entry.get("prompt_tokens", 0) + prompt_tokens
+            entry["cached_tokens"] = entry.get("cached_tokens", 0) + cached_tokens
+
+    def prompt_usage(self) -> dict[str, dict[str, int]]:
+        """Get the recorded input and cached tokens of every model.
+
+        Returns:
+            dict[str, dict[str, int]]: Dictionary mapping 'provider/model' to its
+                'prompt_tokens' and 'cached_tokens'
+
+        """
+        with self._lock:
+            return {
+                key: {
+                    "prompt_tokens": entry.get("prompt_tokens", 0),
+                    "cached_tokens": entry.get("cached_tokens", 0),
+                }
+                for key, entry in self._entries.items()
+                if entry.get("prompt_tokens")
+            }
+
+    def percentile(self, provider: str, model: str, q: float) -> Optional[float]:
+        """Get a latency percentile of successful calls.
+
+        Args:
+            provider: Provider name
+            model: Model name
+            q: Percentile between 0 and 100
+
+        Returns:
+            Optional[float]: Latency in seconds, or None without successful calls
+
+        """
+        with self._lock:
+            entry = self._entries.get(self._key(provider, model))
+            if entry:
+                self._expire(entry)
+            latencies = sorted(entry["latencies"]) if entry else []
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, max(0, math.ceil(q / 100 * len(latencies)) - 1))
+        return latencies[index]
+
+    def summary(self, provider: str, model: str) -> dict[str, Any]:
+        """Summarize the statistics of a model.
+
+        Args:
+            provider: Provider name
+            model: Model name
+
+        Returns:
+            dict[str, Any]: Number of calls, error rate, p50/p90/p95 latency, output
+                tokens per second over the whole call time, the decode rate and fixed
+                per-request overhead fitted by fit_decode_rate (None until enough
+                calls of different lengths were seen), the number of hedges sent and
+                won, and the input tokens sent and served from a prompt cache
+
+        """
+        with self._lock:
+            entry = self._entries.get(self._key(provider, model))
+            if entry:
+                self._expire(entry)
+            outcomes = list(entry["outcomes"]) if entry else []
+            latencies = list(entry["latencies"]) if entry else []
+            output_tokens = list(entry.get("output_tokens", [])) if entry else []
+            tokens = entry["tokens"] if entry else 0
+            total_time = entry["time"] if entry else 0.0
+            hedges = entry.get("hedges", 0) if entry else 0
+            hedge_wins = entry.get("hedge_wins", 0) if entry else 0
+            prompt_tokens = entry.get("prompt_tokens", 0) if entry else 0
+            cached_tokens = entry.get("cached_tokens", 0) if entry else 0
+
+        decode_rate, overhead = fit_decode_rate(output_tokens, latencies)
+        return {
+            "calls": len(outcomes),
+            "error_rate": outcomes.count(0) / len(outcomes) if outcomes else 0.0,
+            "p50": self.percentile(provider, model, 50),
+            "p90": self.percentile(provider, model, 90),
+            "p95": self.percentile(provider, model, 95),
+            "tokens_per_second": tokens / total_time if total_time > 0 else None,
+            "decode_tokens_per_second": decode_rate,
+            "request_overhead": overhead,
+            "hedges": hedges,
+            "hedge_wins": hedge_wins,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+        }
+
+    def save(self) -> None:
+        """Write the statistics to disk."""
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps(self._entries)
+            self._unsaved = 0
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(data)
+        except OSError as e:
+            write_log(f"Could not save provider stats to {self.path}: {str(e)}", level="warning")
+
+
+def fit_decode_rate(
+    output_tokens: list[int], latencies: list[float]
+) -> tuple[Optional[float], Optional[float]]:
+    """Fit call latency as a fixed overhead plus output tokens over a decode rate.
+
+    Dividing all output tokens by all latency mixes the fixed cost of each request
+    into the rate and lets short answers drag it down, so the latency of successful
+    calls is regressed on their output tokens instead.
+
+    Args:
+        output_tokens: Output tokens of successful calls, oldest first
+        latencies: Latencies of the same calls in seconds
+
+    Returns:
+        tuple[Optional[float], Optional[float]]: Decode rate in output tokens per
+            second and per-request overhead in seconds, or (None, None) without
+            MIN_DECODE_SAMPLES calls spanning MIN_DECODE_TOKEN_SPREAD output tokens
+
+    """
+    # Older stats files have latencies without token counts; both lists end together
+    count = min(len(output_tokens), len(latencies))
+    if count < MIN_DECODE_SAMPLES:
+        return None, None
+    tokens = output_tokens[-count:]
+    seconds = latencies[-count:]
+    if max(tokens) - min(tokens) < MIN_DECODE_TOKEN_SPREAD:
+        return None, None
+
+    mean_tokens = sum(tokens) / count
+    mean_seconds = sum(seconds) / count
+    variance = sum((t - mean_tokens) ** 2 for t in tokens)
+    covariance = sum((t - mean_tokens) * (s - mean_seconds) for t, s in zip(tokens, seconds))
+    if covariance <= 0:
+        return None, None
+    seconds_per_token = covariance / variance
+    return 1 / seconds_per_token, max(0.0, mean_seconds - seconds_per_token * mean_tokens)
+
+
+_default_stats: Optional[ProviderStats] = None
+_default_constraints = RoutingConstraints()
+_default_hedging: Optional[HedgingPolicy] = None
+_breaker_settings = {"failure_threshold": 3, "reset_timeout": 60.0}
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_provider_stats() -> ProviderStats:
+    """Get the shared provider statistics, loading them on first use.
+
+    Returns:
+        ProviderStats: The shared statistics store
+
+    """
+    global _default_stats
+    if _default_stats is None:
+        _default_stats = ProviderStats(DEFAULT_STATS_FILE)
+        atexit.register(_default_stats.save)
+    return _default_stats
+
+
+def read_usage_tokens(usage: Optional[dict[str, Any]]) -> Optional[dict[str, int]]:
+    """Read the input, cached and output token counts from a provider's usage object.
+
+    Understands the usage fields of OpenAI-compatible APIs (prompt_tokens,
+    completion_tokens, prompt_tokens_details.cached_tokens), DeepSeek
+    (prompt_cache_hit_tokens), Anthropic (input_tokens, output_tokens,
+    cache_read_input_tokens) and Gemini (prompt_token_count, candidates_token_count,
+    thoughts_token_count, cached_content_token_count).
+
+    Args:
+        usage: Usage object of the response, or None if the provider reported none
+
+    Returns:
+        Optional[dict[str, int]]: 'input_tokens' (including cached ones),
+            'cached_tokens' and 'output_tokens' (including reasoning), or None if
+            the usage reports no tokens
+
+    """
+    if not usage:
+        return None
+    if "input_tokens" in usage:
+        # Anthropic counts cache reads and writes separately from the other input
+        cached_tokens = usage.get("cache_read_input_tokens") or 0
+        input_tokens = (
+            (usage.get("input_tokens") or 0)
+            + cached_tokens
+            + (usage.get("cache_creation_input_tokens") or 0)
+        )
+        output_tokens = usage.get("output_tokens") or 0
+    else:
+        input_tokens = usage.get("prompt_tokens") or usage.get("prompt_token_count") or 0
+        details = usage.get("prompt_tokens_details") or {}
+        cached_tokens = (
+            details.get("cached_tokens")
+            or usage.get("prompt_cache_hit_tokens")
+            or usage.get("cached_content_token_count")
+            or 0
+        )
+        output_tokens = usage.get("completion_tokens") or (
+            (usage.get("candidates_token_count") or 0) + (usage.get("thoughts_token_count") or 0)
+        )
+    if not input_tokens and not output_tokens:
+        return None
+    return {
+        "input_tokens": input_tokens,
+        "cached_tokens": cached_tokens,
+        "output_tokens": output_tokens,
+    }
+
+
+def record_prompt_usage(provider: str, model: str, usage: Optional[dict[str, Any]]) -> None:
+    """Record the prompt and cached token counts a provider reported for a call.
+
+    Args:
+        provider: Provider name
+        model: Model name
+        usage: Usage object of the response (see read_usage_tokens), or None if the
+            provider reported none
+
+    """
+    tokens = read_usage_tokens(usage)
+    if tokens and tokens["input_tokens"]:
+        get_provider_stats().record_prompt_usage(
+            provider, model, tokens["input_tokens"], tokens["cached_tokens"]
+        )
+
+
+def summarize_prompt_cache(
+    since: Optional[dict[str, dict[str, int]]] = None,
+) -> dict[str, Any]:
+    """Summarize input and cached tokens recorded in the shared statistics.
+
+    Args:
+        since: Optional earlier ProviderStats.prompt_usage() snapshot. If given, only
+            tokens recorded after it are counted.
+
+    Returns:
+        dict[str, Any]: Total 'prompt_tokens' and 'cached_tokens', and the same
+            counts per 'provider/model' under 'models'
+
+    """
+    since = since or {}
+    models = {}
+    for key, usage in get_provider_stats().prompt_usage().items():
+        before = since.get(key, {})
+        delta = {name: usage[name] - before.get(name, 0) for name in usage}
+        if delta["prompt_tokens"] > 0:
+            models[key] = delta
+    return {
+        "prompt_tokens": sum(usage["prompt_tokens"] for usage in models.values()),
+        "cached_tokens": sum(usage["cached_tokens"] for usage in models.values()),
+        "models": models,
+    }
+
+
+def configure_router(
+    constraints: Optional[RoutingConstraints] = None,
+    stats: Optional[ProviderStats] = None,
+    hedging: Optional[HedgingPolicy] = None,
+    disable_hedging: bool = False,
+    failure_threshold: Optional[int] = None,
+    reset_timeout: Optional[float] = None,
+) -> None:
+    """Set the routing constraints, statistics store and hedging policy used by default.
+
+    Args:
+        constraints: Constraints applied when ranking models
+        stats: Statistics store to record calls in and rank models by
+        hedging: Hedging policy applied to every provider call
+        disable_hedging: Whether to turn off a previously configured hedging policy
+        failure_threshold: Consecutive failures after which a model's circuit opens
+        reset_timeout: Seconds an open circuit waits before probing the model again
+
+    """
+    global _default_stats, _default_constraints, _default_hedging
+    if constraints is not None:
+        _default_constraints = constraints
+    if stats is not None:
+        _default_stats = stats
+    if hedging is not None:
+        _default_hedging = hedging
+    if disable_hedging:
+        _default_hedging = None
+    if failure_threshold is not None or reset_timeout is not None:
+        if failure_threshold is not None:
+            _breaker_settings["failure_threshold"] = failure_threshold
+        if reset_timeout is not None:
+            _breaker_settings["reset_timeout"] = reset_timeout
+        with _breakers_lock:
+            for breaker in _breakers.values():
+                breaker.failure_threshold = _breaker_settings["failure_threshold"]
+                breaker.reset_timeout = _breaker_settings["reset_timeout"]
+
+
+def get_circuit_breaker(provider: str, model: str) -> CircuitBreaker:
+    """Get the circuit breaker of a provider/model, creating it on first use.
+
+    Args:
+        provider: Provider name
+        model: Model name
+
+    Returns:
+        CircuitBreaker: The breaker shared by all calls to the model
+
+    """
+    key = f"{provider.lower()}/{model}"
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(**_breaker_settings)
+        return _breakers[key]
+
+
+def get_hedging_policy() -> Optional[HedgingPolicy]:
+    """Get the hedging policy applied to provider calls by default.
+
+    Returns:
+        Optional[HedgingPolicy]: The configured policy, or None if hedging is off
+
+    """
+    return _default_hedging
+
+
+def rank_models(
+    candidates: list[tuple[str, str]],
+    constraints: Optional[RoutingConstraints] = None,
+    stats: Optional[ProviderStats] = None,
+) -> list[tuple[str, str]]:
+    """Order candidate models from fastest healthy to least preferred.
+
+    Models with enough samples are ordered by median latency. Models with too
+    few samples keep their given order after them, so the caller's preference
+    still applies until statistics exist. Models that violate the constraints,
+    whose error rate or p95 latency is too high, or whose circuit is open, are
+    left out; the first two only until the samples behind them expire (see
+    ProviderStats.max_age), after which the model is tried again.
+
+    Args:
+        candidates: List of (provider, model) pairs in order of preference
+        constraints: Routing constraints. If None, uses the configured defaults.
+        stats: Statistics store. If None, uses the shared store.
+
+    Returns:
+        list[tuple[str, str]]: Eligible (provider, model) pairs, best first
+
+    """
+    constraints = constraints or _default_constraints
+    stats = stats or get_provider_stats()
+
+    measured = []
+    unmeasured = []
+    for provider, model in candidates:
+        if constraints.allowed_providers and provider not in constraints.allowed_providers:
+            continue
+        if constraints.excluded_models and model in constraints.excluded_models:
+            continue
+        if not get_circuit_breaker(provider, model).available:
+            write_log(f"Router skipping {provider}/{model}: circuit open", level="debug")
+            continue
+
+        summary = stats.summary(provider, model)
+        if summary["calls"] < constraints.min_samples:
+            unmeasured.append((provider, model))
+            continue
+
+        if summary["p50"] is None or summary["error_rate"] > constraints.max_error_rate:
+            write_log(
+                f"Router skipping {provider}/{model}: error rate {summary['error_rate']:.2f}",
+                level="debug",
+            )
+            continue
+        if constraints.max_latency is not None and summary["p95"] > constraints.max_latency:
+            write_log(
+                f"Router skipping {provider}/{model}: p95 latency {summary['p95']:.1f}s",
+                level="debug",
+            )
+            continue
+        measured.append((summary["p50"], provider, model))
+
+    measured.sort(key=lambda item: item[0])
+    return [(provider, model) for _, provider, model in measured] + unmeasured
@@ -0,0 +1,482 @@
+"""Lightweight tracing spans for LLMCellType runs."""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import functools
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# OTLP status codes
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+# Instrumentation scope reported in exported traces
+SCOPE_NAME = "mllmcelltype"
+
+_tracer: Optional[Tracer] = None
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "mllmcelltype_current_span", default=None
+)
+
+
+class Span:
+    """A timed operation in a trace.
+
+    Used as a context manager, the span becomes the current span of the block, so
+    spans started inside it are its children, and it ends when the block exits.
+    Started with start_span and never entered, it must be ended with end().
+    """
+
+    __slots__ = (
+        "tracer",
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "attributes",
+        "start_ns",
+        "end_ns",
+        "status",
+        "status_message",
+        "_token",
+    )
+
+    def __init__(
+        self,
+        tracer: Tracer,
+        name: str,
+        parent: Optional[Span],
+        attributes: dict[str, Any],
+    ) -> None:
+        """Start the span.
+
+        Args:
+            tracer: Tracer receiving the span when it ends
+            name: Name of the operation
+            parent: Parent span, or None for the root of a new trace
+            attributes: Attributes of the span
+
+        """
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self._token = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        """Duration in seconds, or None while the span is running."""
+        return (self.end_ns - self.start_ns) / 1e9 if self.end_ns is not None else None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Set an attribute of the span."""
+        self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        """End the span and hand it to its tracer. Ending it again has no effect.
+
+        Args:
+            error: Optional exception that ended the operation
+
+        """
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.status = STATUS_ERROR
+            self.status_message = f"{type(error).__name__}: {error}"
+        self.tracer._record(self)
+
+    def __enter__(self) -> Span:
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Optional[BaseException], tb: Any) -> None:
+        _current_span.reset(self._token)
+        self.end(exc)
+
+
+class _NoopSpan:
+    """Span returned while tracing is off. Every method does nothing."""
+
+    __slots__ = ()
+
+    duration = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+    def __enter__(self) -> _NoopSpan:
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Optional[BaseException], tb: Any) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Collects finished spans and exports them.
+
+    Activate it with set_tracer or the tracing() context manager. While no tracer
+    is active, start_span returns a shared no-op span and nothing is recorded.
+    """
+
+    def __init__(self, max_spans: Optional[int] = 100000):
+        """Initialize the tracer.
+
+        Args:
+            max_spans: Maximum number of spans kept. Later spans are counted in
+                'dropped' but not kept. None keeps every span.
+
+        """
+        self.max_spans = max_spans
+        self.dropped = 0
+        self._spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def _record(self, span: Span) -> None:
+        with self._lock:
+            if self.max_spans is not None and len(self._spans) >= self.max_spans:
+                self.dropped += 1
+            else:
+                self._spans.append(span)
+
+    def spans(self) -> list[Span]:
+        """Return the finished spans in the order they ended."""
+        with self._lock:
+            return list(self._spans)
+
+    def breakdown(self) -> dict[str, dict[str, Any]]:
+        """Aggregate the finished spans by name.
+
+        Returns:
+            dict[str, dict[str, Any]]: Per span name, the number of spans, their total
+                seconds, and their self seconds (total minus the time of their children)
+
+        """
+        spans = self.spans()
+        child_seconds: dict[str, float] = {}
+        for span in spans:
+            if span.parent_id is not None:
+                parent_seconds = child_seconds.get(span.parent_id, 0.0)
+                child_seconds[span.parent_id] = parent_seconds + span.duration
+
+        breakdown: dict[str, dict[str, Any]] = {}
+        for span in spans:
+            entry = breakdown.setdefault(
+                span.name, {"count": 0, "seconds": 0.0, "self_seconds": 0.0}
+            )
+            entry["count"] += 1
+            entry["seconds"] += span.duration
+            # Children running in parallel can add up to more than their parent
+            entry["self_seconds"] += max(0.0, span.duration - child_seconds.get(span.span_id, 0.0))
+        return breakdown
+
+    def folded_stacks(self) -> str:
+        """Render the self time of every span as folded stacks for flame graph tools.
+
+        Returns:
+            str: One 'root;child;leaf microseconds' line per distinct stack
+
+        """
+        spans = self.spans()
+        by_id = {span.span_id: span for span in spans}
+        child_ns: dict[str, int] = {}
+        for span in spans:
+            if span.parent_id is not None:
+                parent_ns = child_ns.get(span.parent_id, 0)
+                child_ns[span.parent_id] = parent_ns + span.end_ns - span.start_ns
+
+        stacks: dict[str, int] = {}
+        for span in spans:
+            names = [span.name]
+            parent = by_id.get(span.parent_id)
+            while parent is not None:
+                names.append(parent.name)
+                parent = by_id.get(parent.parent_id)
+            stack = ";".join(reversed(names))
+            self_ns = max(0, span.end_ns - span.start_ns - child_ns.get(span.span_id, 0))
+            stacks[stack] = stacks.get(stack, 0) + self_ns // 1000
+        return "".join(f"{stack} {micros}\n" for stack, micros in sorted(stacks.items()))
+
+    def to_otlp(self) -> dict[str, Any]:
+        """Convert the finished spans to the OpenTelemetry (OTLP) JSON trace format.
+
+        Returns:
+            dict[str, Any]: A trace export request with one resource and scope
+
+        """
+        from . import __version__
+
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": _otlp_attributes({"service.name": SCOPE_NAME})},
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": SCOPE_NAME, "version": __version__},
+                            "spans": [_otlp_span(span) for span in self.spans()],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def export(self, path: str) -> int:
+        """Write the finished spans to a file in the OTLP JSON trace format.
+
+        Args:
+            path: File to write
+
+        Returns:
+            int: Number of spans written
+
+        """
+        otlp = self.to_otlp()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(otlp, f)
+        return len(otlp["resourceSpans"][0]["scopeSpans"][0]["spans"])
+
+
+def _otlp_value(value: Any) -> dict[str, Any]:
+    """Convert an attribute value to an OTLP AnyValue."""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP JSON encodes 64-bit integers as strings
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict[str, Any]) -> list[dict[str, Any]]:
+    """Convert an attribute dictionary to a list of OTLP key-values."""
+    return [
+        {"key": key, "value": _otlp_value(value)}
+        for key, value in attributes.items()
+        if value is not None
+    ]
+
+
+def _otlp_span(span: Span) -> dict[str, Any]:
+    """Convert a finished span to an OTLP span."""
+    status = {"code": span.status}
+    if span.status_message:
+        status["message"] = span.status_message
+    return {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "parentSpanId": span.parent_id or "",
+        "name": span.name,
+        # SPAN_KIND_INTERNAL
+        "kind": 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _otlp_attributes(span.attributes),
+        "status": status,
+    }
+
+
+def set_tracer(tracer: Optional[Tracer]) -> Optional[Tracer]:
+    """Activate a tracer for all threads, or turn tracing off with None.
+
+    Args:
+        tracer: Tracer receiving the spans, or None
+
+    Returns:
+        Optional[Tracer]: The previously active tracer
+
+    """
+    global _tracer
+    previous = _tracer
+    _tracer = tracer
+    return previous
+
+
+def get_tracer() -> Optional[Tracer]:
+    """Get the active tracer, or None while tracing is off."""
+    return _tracer
+
+
+def tracing_enabled() -> bool:
+    """Check whether a tracer is active, so callers can skip work only needed for spans."""
+    return _tracer is not None
+
+
+@contextlib.contextmanager
+def tracing(path: Optional[str] = None, tracer: Optional[Tracer] = None) -> Iterator[Tracer]:
+    """Trace the runs inside a block.
+
+    Example:
+        with tracing("trace.json") as tracer:
+            result = interactive_consensus_annotation(...)
+        print(tracer.breakdown())
+
+    Args:
+        path: Optional file the spans are exported to in OTLP JSON when the block
+            exits (see Tracer.export)
+        tracer: Optional tracer to activate. A new Tracer by default.
+
+    Yields:
+        Tracer: The active tracer
+
+    """
+    tracer = tracer if tracer is not None else Tracer()
+    previous = set_tracer(tracer)
+    try:
+        yield tracer
+    finally:
+        set_tracer(previous)
+        if path is not None:
+            tracer.export(path)
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+    """Start a span, or return the no-op span while tracing is off.
+
+    Args:
+        name: Name of the operation
+        parent: Parent span. Defaults to the current span of this thread.
+        **attributes: Attributes of the span. None values are not exported.
+
+    Returns:
+        Span: The started span. Use it in a with statement to make it current, or
+            call end() on it.
+
+    """
+    tracer = _tracer
+    if tracer is None:
+        return NOOP_SPAN
+    if parent is None or parent is NOOP_SPAN:
+        parent = _current_span.get()
+    return Span(tracer, name, parent, attributes)
+
+
+def current_span() -> Optional[Span]:
+    """Get the current span of this thread, or None."""
+    return _current_span.get()
+
+
+class _UsedSpan:
+    """Context manager making an existing span current without ending it."""
+
+    __slots__ = ("span", "_token")
+
+    def __init__(self, span: Span) -> None:
+        self.span = span
+        self._token = None
+
+    def __enter__(self) -> Span:
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type: Any, exc: Optional[BaseException], tb: Any) -> None:
+        _current_span.reset(self._token)
+
+
+def use_span(span: Optional[Span]) -> Any:
+    """Make a span current for a block without ending it at the end of the block.
+
+    Args:
+        span: The span, or None or the no-op span to leave the current span as is
+
+    Returns:
+        A context manager
+
+    """
+    if span is None or span is NOOP_SPAN:
+        return NOOP_SPAN
+    return _UsedSpan(span)
+
+
+def in_current_span(func: Callable[..., T]) -> Callable[..., T]:
+    """Bind a function to the current span, for running it on another thread.
+
+    Worker threads do not inherit the current span, so spans started by a function
+    handed to a thread pool would otherwise start new traces.
+
+    Args:
+        func: The function
+
+    Returns:
+        The function itself while tracing is off, else a wrapper that runs it with
+        this thread's current span as its current span
+
+    """
+    parent = _current_span.get()
+    if _tracer is None or parent is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        with _UsedSpan(parent):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def traced(name: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Decorate a function to run in a span of the given name.
+
+    Args:
+        name: Name of the span
+
+    Returns:
+        The decorator
+
+    """
+
+    def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> T:
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with start_span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def stage(name: str, timings: dict[str, float], **attributes: Any) -> Iterator[Any]:
+    """Time one stage of a run.
+
+    The stage's seconds are added to the timings dictionary whether or not tracing
+    is on, and while it is on the stage also runs in a span of the same name.
+
+    Args:
+        name: Name of the stage, used as the timings key and span name
+        timings: Dictionary receiving the seconds spent in the stage
+        **attributes: Attributes of the span
+
+    Yields:
+        Span: The stage's span, or the no-op span while tracing is off
+
+    """
+    start = time.perf_counter()
+    try:
+        with start_span(name, **attributes) as span:
+            yield span
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
@@ -8,12 +8,22 @@ import math
 import os
 import re
 import time
-from typing import Any, Optional, Union
+from typing import TYPE_CHECKING, Any, Optional, Union
 
 import pandas as pd
 
 from .logger import write_log
 
+if TYPE_CHECKING:
+    from .ontology import CellTypeOntology
+
+
+# Ranking columns where smaller values rank a marker gene higher
+ASCENDING_RANK_COLUMNS = ("p_val_adj", "p_val", "pvals_adj", "pvals")
+
+# Marker genes every cluster keeps when compacting marker lists
+MIN_MARKER_GENES = 3
+
 
 def load_api_key(provider: str) -> str:
     """Load API key for a specific provider from environment variables or .env file.
@@ -119,6 +129,24 @@ def create_cache_key(prompt: str, model: str, provider: str) -> str:
     return hash_object.hexdigest()
 
 
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text without calling a tokenizer.
+
+    Uses the common approximation of about four characters per token, which is
+    close enough for sizing prompts across providers.
+
+    Args:
+        text: The text to estimate
+
+    Returns:
+        int: Estimated number of tokens
+
+    """
+    if not text:
+        return 0
+    return math.ceil(len(str(text)) / 4)
+
+
 def save_to_cache(
     cache_key: str,
     results: Union[list[str], dict[str, Any]],
@@ -207,11 +235,21 @@ def load_from_cache(
         return None
 
 
-def parse_marker_genes(marker_genes_df: pd.DataFrame) -> dict[str, list[str]]:
+def parse_marker_genes(
+    marker_genes_df: pd.DataFrame,
+    rank_by: Optional[str] = None,
+    top_n: Optional[int] = None,
+) -> dict[str, list[str]]:
     """Parse marker genes dataframe into a dictionary.
 
+    With rank_by, the genes of each cluster are ordered by that column before
+    top_n is applied: descending for scores such as 'avg_log2FC', ascending for
+    p-value columns such as 'p_val_adj'.
+
     Args:
         marker_genes_df: DataFrame containing marker genes
+        rank_by: Optional column to rank the genes of each cluster by
+        top_n: Optional number of top ranked genes to keep per cluster
 
     Returns:
         dict[str, list[str]]: Dictionary mapping cluster names to lists of marker genes
@@ -237,13 +275,153 @@ def parse_marker_genes(marker_genes_df: pd.DataFrame) -> dict[str, list[str]]:
         write_log("ERROR: 'gene' column not found in marker genes dataframe", level="error")
         raise ValueError("'gene' column not found in marker genes dataframe")
 
+    if rank_by is not None and rank_by not in columns:
+        write_log(f"ERROR: '{rank_by}' column not found in marker genes dataframe", level="error")
+        raise ValueError(f"'{rank_by}' column not found in marker genes dataframe")
+
     # Group by cluster and get list of genes
     for cluster, group in marker_genes_df.groupby("cluster"):
-        result[str(cluster)] = group["gene"].tolist()
+        if rank_by is not None:
+            group = group.sort_values(
+                rank_by, ascending=rank_by in ASCENDING_RANK_COLUMNS, kind="stable"
+            )
+        genes = group["gene"].tolist()
+        result[str(cluster)] = genes[:top_n] if top_n is not None else genes
 
     return result
 
 
+def _marker_lines_tokens(marker_genes: dict[str, list[str]], top_k: int) -> int:
+    """Estimate the tokens of the marker lines of a prompt keeping top_k genes."""
+    return sum(
+        estimate_tokens(f"Cluster {cluster}: {', '.join(genes[:top_k])}")
+        for cluster, genes in marker_genes.items()
+    )
+
+
+def compact_marker_genes(
+    marker_genes: dict[str, list[str]],
+    max_tokens: int,
+    min_genes: int = MIN_MARKER_GENES,
+) -> tuple[dict[str, list[str]], dict[str, int]]:
+    """Trim marker lists so that the markers of one request fit a token budget.
+
+    Every cluster keeps the same number k of its top ranked genes, with k the
+    largest number whose marker lines fit into max_tokens (estimated locally with
+    estimate_tokens). Lists must already be ranked from most to least specific,
+    e.g. by parse_marker_genes(rank_by=...).
+
+    Args:
+        marker_genes: Dictionary mapping cluster names to ranked lists of marker genes
+        max_tokens: Token budget for the marker lines of the prompt
+        min_genes: Number of genes every cluster keeps even if the budget is exceeded
+
+    Returns:
+        tuple[dict[str, list[str]], dict[str, int]]: The compacted marker genes and
+            the number of genes dropped per truncated cluster
+
+    """
+    longest = max((len(genes) for genes in marker_genes.values()), default=0)
+    if _marker_lines_tokens(marker_genes, longest) <= max_tokens:
+        return dict(marker_genes), {}
+
+    # Largest k that fits; the estimate grows with k, so bisect
+    low, high = 0, longest
+    while low < high:
+        middle = (low + high + 1) // 2
+        if _marker_lines_tokens(marker_genes, middle) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    top_k = max(low, min_genes)
+    if low < min_genes:
+        write_log(
+            f"Marker genes exceed {max_tokens} tokens even with {min_genes} genes per cluster",
+            level="warning",
+        )
+
+    compacted = {cluster: genes[:top_k] for cluster, genes in marker_genes.items()}
+    truncated = {
+        cluster: len(genes) - top_k for cluster, genes in marker_genes.items() if len(genes) > top_k
+    }
+    write_log(
+        f"Kept the top {top_k} marker genes of each cluster to fit {max_tokens} tokens, "
+        f"dropping {sum(truncated.values())} genes from {len(truncated)} clusters"
+    )
+    return compacted, truncated
+
+
+def canonicalize_markers(genes: list[str], top_n: Optional[int] = None) -> tuple[str, ...]:
+    """Reduce a marker list to a canonical form for deduplication.
+
+    Markers are truncated to the top_n highest ranked, upper-cased, stripped,
+    de-duplicated and sorted, so lists that differ only in case or order match.
+
+    Args:
+        genes: Marker genes, ranked from most to least specific
+        top_n: Optional number of top markers to keep before canonicalizing
+
+    Returns:
+        tuple[str, ...]: The canonical marker list
+
+    """
+    if top_n is not None:
+        genes = list(genes)[:top_n]
+    return tuple(sorted({str(gene).strip().upper() for gene in genes if str(gene).strip()}))
+
+
+def deduplicate_marker_sets(
+    marker_genes_list: list[dict[str, list[str]]], top_n: Optional[int] = None
+) -> tuple[dict[str, list[str]], list[dict[str, str]]]:
+    """Collapse clusters with canonically identical markers across datasets.
+
+    Args:
+        marker_genes_list: List of dictionaries mapping cluster names to lists of
+            marker genes, one per dataset
+        top_n: Optional number of top markers compared and sent per cluster
+
+    Returns:
+        tuple: (unique marker lists keyed by new numeric cluster IDs, and for every
+            dataset a dictionary mapping its cluster names to those IDs)
+
+    """
+    unique: dict[str, list[str]] = {}
+    ids: dict[tuple[str, ...], str] = {}
+    mappings = []
+    for marker_genes in marker_genes_list:
+        mapping = {}
+        for cluster, genes in marker_genes.items():
+            key = canonicalize_markers(genes, top_n)
+            if key not in ids:
+                ids[key] = str(len(ids) + 1)
+                unique[ids[key]] = list(genes)[:top_n] if top_n is not None else list(genes)
+            mapping[str(cluster)] = ids[key]
+        mappings.append(mapping)
+
+    total = sum(len(mapping) for mapping in mappings)
+    write_log(f"Deduplicated {total} clusters into {len(unique)} unique marker lists")
+    return unique, mappings
+
+
+def expand_deduplicated_annotations(
+    annotations: dict[str, str], mappings: list[dict[str, str]]
+) -> list[dict[str, str]]:
+    """Fan annotations of unique marker lists back out to every dataset.
+
+    Args:
+        annotations: Annotations keyed by the IDs from deduplicate_marker_sets
+        mappings: Per-dataset cluster mappings from deduplicate_marker_sets
+
+    Returns:
+        list[dict[str, str]]: Annotations of each dataset keyed by its own cluster names
+
+    """
+    return [
+        {cluster: annotations.get(unique_id, "Unknown") for cluster, unique_id in mapping.items()}
+        for mapping in mappings
+    ]
+
+
 def get_annotation_metadata(
     annotation_result: dict[str, str],
 ) -> dict[str, dict[str, Any]]:
@@ -274,6 +452,48 @@ def get_annotation_metadata(
         return {}
 
 
+def _parse_json_response(lines: list[str]) -> Any:
+    """Parse a JSON object from LLM response lines.
+
+    Handles JSON wrapped in code fences and fixes common formatting issues such
+    as missing commas between fields.
+
+    Args:
+        lines: Non-empty response lines
+
+    Returns:
+        Any: The parsed JSON data
+
+    Raises:
+        json.JSONDecodeError: If no valid JSON could be parsed
+
+    """
+    # Join all lines and try to find JSON content
+    full_text = "\n".join(lines)
+
+    # Extract JSON content if it's wrapped in ```json and ``` markers
+    json_match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", full_text)
+    if json_match:
+        json_str = json_match.group(1)
+    else:
+        # If no code blocks, try to find JSON object directly
+        json_match = re.search(r"(\{[\s\S]*\})", full_text)
+        # Extract JSON content or use full text
+        json_str = json_match.group(1) if json_match else full_text
+
+    # Fix common JSON formatting issues
+    # Add missing commas between JSON objects
+    json_str = re.sub(r'("[^"]+")\s*\n\s*("[^"]+")', r"\1,\n\2", json_str)
+    # Add missing commas after closing brackets
+    json_str = re.sub(r'(\])\s*\n\s*("[^"]+")', r"\1,\n\2", json_str)
+    # Add missing commas after closing braces
+    json_str = re.sub(r'(\})\s*\n\s*("[^"]+")', r"\1,\n\2", json_str)
+    # Add missing commas after closing braces before opening braces
+    json_str = re.sub(r"(\})\s*\n\s*(\{)", r"\1,\n\2", json_str)
+
+    return json.loads(json_str)
+
+
 def format_results(results: list[str], clusters: list[str]) -> dict[str, str]:
     """Format results into a dictionary mapping cluster names to annotations.
 
@@ -315,31 +535,7 @@ def format_results(results: list[str], clusters: list[str]) -> dict[str, str]:
 
     # Case 2: Try to parse JSON response
     try:
-        # Join all lines and try to find JSON content
-        full_text = "\n".join(clean_results)
-
-        # Extract JSON content if it's wrapped in ```json and ``` markers
-        json_match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", full_text)
-        if json_match:
-            json_str = json_match.group(1)
-        else:
-            # If no code blocks, try to find JSON object directly
-            json_match = re.search(r"(\{[\s\S]*\})", full_text)
-            # Extract JSON content or use full text
-            json_str = json_match.group(1) if json_match else full_text
-
-        # Fix common JSON formatting issues
-        # Add missing commas between JSON objects
-        json_str = re.sub(r'("[^"]+")\s*\n\s*("[^"]+")', r"\1,\n\2", json_str)
-        # Add missing commas after closing brackets
-        json_str = re.sub(r'(\])\s*\n\s*("[^"]+")', r"\1,\n\2", json_str)
-        # Add missing commas after closing braces
-        json_str = re.sub(r'(\})\s*\n\s*("[^"]+")', r"\1,\n\2", json_str)
-        # Add missing commas after closing braces before opening braces
-        json_str = re.sub(r"(\})\s*\n\s*(\{)", r"\1,\n\2", json_str)
-
-        # Parse JSON
-        data = json.loads(json_str)
+        data = _parse_json_response(clean_results)
 
         # Extract annotations from JSON structure
         if "annotations" in data and isinstance(data["annotations"], list):
@@ -428,6 +624,110 @@ def format_results(results: list[str], clusters: list[str]) -> dict[str, str]:
     return result
 
 
+# Annotations with more words than this read as prose rather than a cell type label
+MAX_LABEL_WORDS = 10
+
+
+def find_unparsed_clusters(
+    results: list[str], annotations: dict[str, str], clusters: list[str]
+) -> list[str]:
+    """Find clusters whose annotation could not be reliably read from a response.
+
+    A cluster is suspicious when it has no annotation or an empty one, when its
+    annotation reads like prose instead of a label, or when the response neither
+    names the cluster nor has exactly one line per cluster, so that format_results
+    had to guess it from the line position.
+
+    Args:
+        results: Raw response lines
+        annotations: Annotations parsed from the response by format_results
+        clusters: Cluster names the response should cover
+
+    Returns:
+        list[str]: Suspicious cluster names, in the given order
+
+    """
+    clean_results = [line.strip() for line in results if line.strip()]
+
+    # Labels of the clusters the response names explicitly, by line prefix or JSON entry
+    named = {}
+    line_names = []
+    for line in clean_results:
+        match = re.match(r"Cluster\s+([^:\s]+):\s*(.*)", line)
+        line_names.append(match.group(1) if match else None)
+        if match:
+            named.setdefault(match.group(1), match.group(2).strip())
+    try:
+        data = _parse_json_response(clean_results)
+        if isinstance(data, dict) and isinstance(data.get("annotations"), list):
+            for entry in data["annotations"]:
+                if isinstance(entry, dict) and "cluster" in entry:
+                    named.setdefault(str(entry["cluster"]), str(entry.get("cell_type", "")))
+    except (json.JSONDecodeError, ValueError, TypeError):
+        pass
+
+    positional = len(clean_results) == len(clusters)
+    unparsed = []
+    for index, cluster in enumerate(clusters):
+        cluster = str(cluster)
+        annotation = str(annotations.get(cluster) or "").strip()
+        if not annotation or len(annotation.split()) > MAX_LABEL_WORDS:
+            suspicious = True
+        elif cluster in named:
+            # A named cluster must not have been mapped by position to another line
+            suspicious = annotation != named[cluster].strip()
+        else:
+            # Mapping by position only holds if the line does not name another cluster
+            suspicious = not positional or line_names[index] is not None
+        if suspicious:
+            unparsed.append(cluster)
+    return unparsed
+
+
+# Ranks of the confidence levels requested by the JSON prompt
+CONFIDENCE_LEVELS = {"low": 0, "medium": 1, "high": 2}
+
+
+def extract_annotation_confidence(results: list[str]) -> dict[str, int]:
+    """Extract per-cluster confidence from a JSON annotation response.
+
+    Confidence may be given as a level ('low', 'medium', 'high') or as a number
+    between 0 and 1, which is binned into the same levels.
+
+    Args:
+        results: List of annotation result lines
+
+    Returns:
+        dict[str, int]: Dictionary mapping cluster IDs to confidence ranks from
+            CONFIDENCE_LEVELS. Clusters without a readable confidence are omitted.
+
+    """
+    clean_results = [line.strip() for line in results if line.strip()]
+    try:
+        data = _parse_json_response(clean_results)
+    except (json.JSONDecodeError, ValueError, TypeError) as e:
+        write_log(f"No JSON confidence found in response: {str(e)}", level="debug")
+        return {}
+
+    if not isinstance(data, dict) or not isinstance(data.get("annotations"), list):
+        return {}
+
+    confidence = {}
+    for annotation in data["annotations"]:
+        if not isinstance(annotation, dict) or "cluster" not in annotation:
+            continue
+        value = annotation.get("confidence")
+        if isinstance(value, str) and value.strip().lower() in CONFIDENCE_LEVELS:
+            rank = CONFIDENCE_LEVELS[value.strip().lower()]
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            rank = 2 if value >= 0.8 else 1 if value >= 0.5 else 0
+        else:
+            continue
+        confidence[str(annotation["cluster"])] = rank
+
+    return confidence
+
+
 def clean_annotation(annotation: str) -> str:
     """Clean up cell type annotation from LLM response.
 
@@ -502,13 +802,75 @@ def clean_annotation(annotation: str) -> str:
     return annotation
 
 
+# Common wording variants of the same cell type, keyed by normalized form
+CELL_TYPE_SYNONYMS = {
+    "t lymphocyte": "t cell",
+    "b lymphocyte": "b cell",
+    "natural killer cell": "nk cell",
+    "natural killer": "nk cell",
+    "nk": "nk cell",
+    "monocyte": "monocyte",
+    "classical monocyte": "cd14+ monocyte",
+    "non-classical monocyte": "cd16+ monocyte",
+    "nonclassical monocyte": "cd16+ monocyte",
+    "helper t cell": "cd4+ t cell",
+    "t helper cell": "cd4+ t cell",
+    "cd4 t cell": "cd4+ t cell",
+    "cytotoxic t cell": "cd8+ t cell",
+    "cd8 t cell": "cd8+ t cell",
+    "dc": "dendritic cell",
+    "pdc": "plasmacytoid dendritic cell",
+    "plasma b cell": "plasma cell",
+    "red blood cell": "erythrocyte",
+    "rbc": "erythrocyte",
+    "thrombocyte": "platelet",
+    "megakaryocyte/platelet": "platelet",
+}
+
+
+def normalize_annotation(annotation: str) -> str:
+    """Normalize a cell type annotation so that wording variants compare equal.
+
+    Lowercases the label, unifies separators, singularizes plural nouns and maps
+    known synonyms (e.g. 'Natural killer cells' and 'NK cells') to one form.
+
+    Args:
+        annotation: Cell type annotation
+
+    Returns:
+        str: Normalized annotation
+
+    """
+    annotation = clean_annotation(annotation).lower()
+    if not annotation:
+        return ""
+
+    # Unify separators and whitespace
+    annotation = re.sub(r"[_\s]+", " ", annotation.replace("-", " ")).strip()
+    annotation = annotation.replace("non classical", "non-classical")
+
+    # Singularize plural words (e.g. 'cells' -> 'cell', 'lymphocytes' -> 'lymphocyte')
+    words = []
+    for word in annotation.split(" "):
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    annotation = " ".join(words)
+
+    return CELL_TYPE_SYNONYMS.get(annotation, annotation)
+
+
 def find_agreement(
     annotations: dict[str, dict[str, str]],
+    ontology: Optional[CellTypeOntology] = None,
+    ontology_depth: Optional[int] = None,
 ) -> tuple[dict[str, str], dict[str, float], dict[str, float]]:
     """Find the level of agreement between different model annotations.
 
     Args:
         annotations: Dictionary mapping model names to dictionaries of cluster annotations
+        ontology: Optional cell type ontology used to treat synonymous labels as equal
+        ontology_depth: Optional ontology depth at which labels are compared
 
     Returns:
         tuple[dict[str, str], dict[str, float], dict[str, float]]:
@@ -538,7 +900,9 @@ def find_agreement(
         for _model, results in annotations.items():
             if cluster in results:
                 annotation = clean_annotation(results[cluster])
-                if annotation:
+                if annotation and ontology is not None:
+                    cluster_annotations.append(ontology.canonical_label(annotation, ontology_depth))
+                elif annotation:
                     cluster_annotations.append(
                         annotation.lower()
                     )  # Convert to lowercase for case-insensitive comparison
@@ -14,6 +14,7 @@ setup(
     name="mllmcelltype",
     version="1.2.1",
     packages=find_packages(),
+    package_data={"mllmcelltype": ["data/*.tsv"]},
     description="A Python module for cell type annotation using various LLMs.",
     long_description=long_description,
     long_description_content_type="text/markdown",
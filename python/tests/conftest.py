@@ -8,6 +8,22 @@ Fixtures and configuration for pytest.
 import pandas as pd
 import pytest
 
+from mllmcelltype import retry, router
+
+
+@pytest.fixture(autouse=True)
+def isolated_provider_stats(monkeypatch):
+    """Keep provider statistics in memory and reset routing and retry state between tests."""
+    stats = router.ProviderStats()
+    monkeypatch.setattr(router, "_default_stats", stats)
+    monkeypatch.setattr(router, "_default_constraints", router.RoutingConstraints())
+    monkeypatch.setattr(router, "_default_hedging", None)
+    monkeypatch.setattr(router, "_breakers", {})
+    monkeypatch.setattr(router, "_breaker_settings", dict(router._breaker_settings))
+    monkeypatch.setattr(retry, "_default_policy", retry.RetryPolicy())
+    monkeypatch.setattr(retry, "_budget", retry.RetryBudget(retry.RetryPolicy().retry_budget))
+    return stats
+
 
 # Sample marker genes for testing
 @pytest.fixture
@@ -6,14 +6,18 @@ Tests for annotation functionality in mLLMCelltype.
 """
 
 import os
+import re
 from unittest.mock import MagicMock, patch
 
+import pandas as pd
 import pytest
 
 from mllmcelltype.annotate import (
     annotate_clusters,
     batch_annotate_clusters,
     get_model_response,
+    plan_annotation_chunks,
+    plan_output_budget,
 )
 
 
@@ -78,6 +82,321 @@ class TestAnnotation:
         assert result["1"] == "T cells"
         assert result["2"] == "B cells"
 
+    @patch("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {})
+    def test_annotate_clusters_cascade(self):
+        """Test that only low-confidence and unknown clusters reach the escalation model."""
+        from mllmcelltype.annotate import PROVIDER_FUNCTIONS
+
+        cheap_response = [
+            '{"annotations": [',
+            '{"cluster": "1", "cell_type": "T cells", "confidence": "high"},',
+            '{"cluster": "2", "cell_type": "B cells", "confidence": "low"},',
+            '{"cluster": "3", "cell_type": "Unknown", "confidence": "high"}',
+            "]}",
+        ]
+        strong_prompts = []
+
+        def strong_model(prompt, model, api_key):
+            strong_prompts.append(prompt)
+            return ["Cluster 2: Plasma cells", "Cluster 3: NK cells"]
+
+        PROVIDER_FUNCTIONS["cheap"] = lambda *args, **kwargs: cheap_response
+        PROVIDER_FUNCTIONS["strong"] = strong_model
+
+        result = annotate_clusters(
+            marker_genes={"1": ["TRAC"], "2": ["MZB1"], "3": ["NKG7"]},
+            species="human",
+            provider="cheap",
+            model="cheap_model",
+            api_key="test-key",
+            use_cache=False,
+            escalation_model="strong_model",
+            escalation_provider="strong",
+            escalation_api_key="test-key",
+        )
+
+        assert result == {"1": "T cells", "2": "Plasma cells", "3": "NK cells"}
+        assert len(strong_prompts) == 1
+        assert "TRAC" not in strong_prompts[0]
+        assert "MZB1" in strong_prompts[0]
+
+    @patch("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {})
+    def test_annotate_clusters_cascade_keeps_request_options(self):
+        """Test that the escalation request fails over and keeps the output limit."""
+        from mllmcelltype.annotate import PROVIDER_FUNCTIONS
+
+        cheap_response = [
+            '{"annotations": [',
+            '{"cluster": "1", "cell_type": "T cells", "confidence": "high"},',
+            '{"cluster": "2", "cell_type": "B cells", "confidence": "low"}',
+            "]}",
+        ]
+        fallback_calls = []
+
+        def strong_model(prompt, model, api_key):
+            raise ValueError("service unavailable")
+
+        def fallback_model(prompt, model, api_key):
+            fallback_calls.append(model)
+            return ['{"annotations": [{"cluster": "2", "cell_type": "Plasma cells"}]}']
+
+        PROVIDER_FUNCTIONS["cheap"] = lambda *args, **kwargs: cheap_response
+        PROVIDER_FUNCTIONS["strong"] = strong_model
+        PROVIDER_FUNCTIONS["backup"] = fallback_model
+
+        with patch(
+            "mllmcelltype.annotate.plan_annotation_chunks",
+            side_effect=lambda clusters, *args, **kwargs: [list(clusters)],
+        ) as plan:
+            result = annotate_clusters(
+                marker_genes={"1": ["TRAC"], "2": ["MZB1"]},
+                species="human",
+                provider="cheap",
+                model="cheap_model",
+                api_key="test-key",
+                use_cache=False,
+                escalation_model="strong_model",
+                escalation_provider="strong",
+                escalation_api_key="test-key",
+                fallback_model="backup_model",
+                fallback_provider="backup",
+                fallback_api_key="test-key",
+                max_output_tokens=2048,
+            )
+
+        assert result == {"1": "T cells", "2": "Plasma cells"}
+        assert fallback_calls == ["backup_model"]
+        assert [call.kwargs["max_output_tokens"] for call in plan.call_args_list] == [2048, 2048]
+
+    @patch("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {})
+    def test_annotate_clusters_chunked(self):
+        """Test that a large cluster set is split into chunks and merged in order."""
+        from mllmcelltype.annotate import PROVIDER_FUNCTIONS
+
+        marker_genes = {str(i): [f"GENE{i}"] for i in range(40)}
+        chunk_sizes = []
+
+        def provider(prompt, model, api_key):
+            clusters = re.findall(r"^Cluster (\d+): GENE", prompt, flags=re.MULTILINE)
+            chunk_sizes.append(len(clusters))
+            return [f"Cluster {c}: Type {c}" for c in clusters]
+
+        PROVIDER_FUNCTIONS["mock_provider"] = provider
+
+        chunks = plan_annotation_chunks(list(marker_genes), "mock_provider", "mock_model", 300)
+        assert len(chunks) > 1
+        assert [c for chunk in chunks for c in chunk] == list(marker_genes)
+
+        result = annotate_clusters(
+            marker_genes=marker_genes,
+            species="human",
+            provider="mock_provider",
+            model="mock_model",
+            api_key="test-key",
+            use_cache=False,
+            max_output_tokens=300,
+        )
+
+        assert result == {c: f"Type {c}" for c in marker_genes}
+        assert sorted(chunk_sizes) == sorted(len(chunk) for chunk in chunks)
+
+        # Slow short answers do not move the chunk boundaries
+        from mllmcelltype.router import get_provider_stats
+
+        for _ in range(5):
+            get_provider_stats().record("mock_provider", "mock_model", 30.0, True, 20)
+        assert plan_annotation_chunks(list(marker_genes), "mock_provider", "mock_model", 300) == (
+            chunks
+        )
+
+    @patch("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {})
+    def test_annotate_clusters_repairs_unparsed(self):
+        """Test that only unparsed clusters are re-requested."""
+        from mllmcelltype.annotate import PROVIDER_FUNCTIONS
+
+        prompts = []
+
+        def provider(prompt, model, api_key):
+            prompts.append(prompt)
+            if len(prompts) == 1:
+                return [
+                    "Cluster 1: T cells",
+                    "Cluster 2: These markers point to a B cell lineage, although plasma "
+                    "cells cannot be ruled out without further markers",
+                    "Cluster 3: NK cells",
+                ]
+            return ["Cluster 2: B cells"]
+
+        PROVIDER_FUNCTIONS["mock_provider"] = provider
+
+        result = annotate_clusters(
+            marker_genes={"1": ["TRAC"], "2": ["MS4A1"], "3": ["NKG7"]},
+            species="human",
+            provider="mock_provider",
+            model="mock_model",
+            api_key="test-key",
+            use_cache=False,
+        )
+
+        assert result == {"1": "T cells", "2": "B cells", "3": "NK cells"}
+        assert len(prompts) == 2
+        assert "MS4A1" in prompts[1]
+        assert "TRAC" not in prompts[1]
+
+    @patch("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {})
+    def test_annotate_clusters_compacts_markers(self):
+        """Test that marker lists are ranked and cut to the request budget."""
+        from mllmcelltype.annotate import PROVIDER_FUNCTIONS
+
+        prompts = []
+
+        def provider(prompt, model, api_key):
+            prompts.append(prompt)
+            return ["Cluster 1: T cells", "Cluster 2: B cells"]
+
+        PROVIDER_FUNCTIONS["mock_provider"] = provider
+
+        marker_genes_df = pd.DataFrame(
+            {
+                "cluster": [1] * 50 + [2] * 50,
+                "gene": [f"T{i}" for i in range(50)] + [f"B{i}" for i in range(50)],
+                "avg_log2FC": list(range(50)) * 2,
+            }
+        )
+        compaction_stats = {}
+        result = annotate_clusters(
+            marker_genes=marker_genes_df,
+            species="human",
+            provider="mock_provider",
+            model="mock_model",
+            api_key="test-key",
+            use_cache=False,
+            rank_by="avg_log2FC",
+            max_marker_tokens=40,
+            compaction_stats=compaction_stats,
+        )
+
+        assert result == {"1": "T cells", "2": "B cells"}
+        # Highest fold changes are kept, the lowest dropped
+        assert "Cluster 1: T49, T48" in prompts[0]
+        assert "T0," not in prompts[0]
+        assert set(compaction_stats) == {"1", "2"}
+        assert compaction_stats["1"] > 0
+
+    def test_plan_output_budget(self):
+        """Test output limits derived from the cluster count and answer format."""
+        small = plan_output_budget(2, "openai", "gpt-4o")
+        large = plan_output_budget(40, "openai", "gpt-4o")
+        assert small.max_tokens < large.max_tokens
+        assert small.stop
+
+        assert plan_output_budget(40, "openai", "gpt-4o", json_output=True).stop is None
+        assert plan_output_budget(1000, "anthropic", "claude-3-5-haiku").max_tokens == 4000
+        assert plan_output_budget(5, "openai", "o3-mini") is None
+        assert plan_output_budget(5, "gemini", "gemini-2.5-pro-preview-03-25") is None
+        assert plan_output_budget(5, "openrouter", "deepseek/deepseek-r1") is None
+        assert len(plan_output_budget(5, "zhipu", "glm-4").stop) == 1
+
+    @patch("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {})
+    def test_annotate_clusters_fast_mode_plans_budget_per_model(self):
+        """Test that a fallback model gets a budget planned for it, not for the primary."""
+        from mllmcelltype.annotate import PROVIDER_FUNCTIONS
+
+        calls = []
+
+        def failing_provider(prompt, model, api_key, max_tokens=None, stop=None):
+            raise ValueError("service unavailable")
+
+        def fallback_provider(prompt, model, api_key, max_tokens=None, stop=None):
+            calls.append((model, max_tokens, stop))
+            return ["Cluster 1: T cells", "Cluster 2: B cells"]
+
+        PROVIDER_FUNCTIONS["anthropic"] = failing_provider
+        PROVIDER_FUNCTIONS["openai"] = fallback_provider
+
+        result = annotate_clusters(
+            marker_genes={"1": ["CD3D"], "2": ["MS4A1"]},
+            species="human",
+            provider="anthropic",
+            model="claude-3-5-haiku",
+            api_key="test-key",
+            use_cache=False,
+            fast_mode=True,
+            fallback_model="o3-mini",
+            fallback_provider="openai",
+            fallback_api_key="test-key",
+        )
+
+        assert result == {"1": "T cells", "2": "B cells"}
+        assert calls == [("o3-mini", None, None)]
+
+    @patch("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {})
+    def test_annotate_clusters_fast_mode_uses_stop_reason(self):
+        """Test that the reported stop reason decides whether a response was cut off."""
+        from mllmcelltype.annotate import PROVIDER_FUNCTIONS
+        from mllmcelltype.providers.response import ProviderResponse
+
+        calls = []
+
+        def provider(prompt, model, api_key, max_tokens=None, stop=None):
+            calls.append(prompt)
+            if len(calls) == 1:
+                # Short, but cut at the limit in the middle of the second line
+                return ProviderResponse(["Cluster 1: T cells", "Cluster 2: B"], "length")
+            return ProviderResponse(["Cluster 2: B cells"], "stop")
+
+        PROVIDER_FUNCTIONS["mock_provider"] = provider
+
+        result = annotate_clusters(
+            marker_genes={"1": ["CD3D"], "2": ["MS4A1"]},
+            species="human",
+            provider="mock_provider",
+            model="mock_model",
+            api_key="test-key",
+            use_cache=False,
+            fast_mode=True,
+        )
+
+        assert result == {"1": "T cells", "2": "B cells"}
+        assert len(calls) == 2
+        assert "MS4A1" in calls[1] and "CD3D" not in calls[1]
+
+    @patch("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {})
+    def test_annotate_clusters_fast_mode_continues_truncated(self):
+        """Test that a response cut at its output limit is continued."""
+        from mllmcelltype.annotate import PROVIDER_FUNCTIONS
+
+        calls = []
+
+        def provider(prompt, model, api_key, max_tokens=None, stop=None):
+            calls.append((prompt, max_tokens, stop))
+            if len(calls) == 1:
+                return [
+                    "Cluster 1: T cells",
+                    "Cluster 2: B cells",
+                    "Cluster 3: Natural killer cells, because " + "GNLY and NKG7 " * 30,
+                ]
+            return ["Cluster 3: NK cells", "Cluster 4: Monocytes"]
+
+        PROVIDER_FUNCTIONS["mock_provider"] = provider
+
+        result = annotate_clusters(
+            marker_genes={"1": ["CD3D"], "2": ["MS4A1"], "3": ["NKG7"], "4": ["CD14"]},
+            species="human",
+            provider="mock_provider",
+            model="mock_model",
+            api_key="test-key",
+            use_cache=False,
+            fast_mode=True,
+        )
+
+        assert result == {"1": "T cells", "2": "B cells", "3": "NK cells", "4": "Monocytes"}
+        assert len(calls) == 2
+        assert "Do not explain" in calls[0][0]
+        assert calls[0][1] == plan_output_budget(4, "mock_provider", "mock_model").max_tokens
+        assert calls[0][2]
+        assert "NKG7" in calls[1][0] and "MS4A1" not in calls[1][0]
+
     @patch("mllmcelltype.annotate.load_api_key")
     @patch("mllmcelltype.annotate.get_default_model")
     @patch("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {"mock_provider": MagicMock()})
@@ -121,6 +440,90 @@ class TestAnnotation:
         assert result[0]["1"] == "T cells"
         assert result[0]["2"] == "B cells"
 
+    @patch("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {})
+    def test_batch_annotate_clusters_dedup_and_cache(self, tmp_path):
+        """Test that identical sets are sent once and cached sets are not sent again."""
+        from mllmcelltype.annotate import PROVIDER_FUNCTIONS
+
+        labels = {"CD3D": "T cells", "CD19": "B cells", "NKG7": "NK cells", "CD14": "Monocytes"}
+        prompts = []
+
+        def provider(prompt, model, api_key):
+            prompts.append(prompt)
+            response = []
+            for line in prompt.split("\n"):
+                match = re.match(r"(Set \d+:)|Cluster (\w+): (\w+)", line)
+                if match and match.group(1):
+                    response.append(match.group(1))
+                elif match:
+                    response.append(f"Cluster {match.group(2)}: {labels[match.group(3)]}")
+            return response
+
+        PROVIDER_FUNCTIONS["mock_provider"] = provider
+        set_a = {"1": ["CD3D"], "2": ["CD19"]}
+        set_b = {"1": ["NKG7"]}
+        set_c = {"5": ["CD14"]}
+
+        def run(marker_genes_list, tissue):
+            return batch_annotate_clusters(
+                marker_genes_list=marker_genes_list,
+                species="human",
+                provider="mock_provider",
+                model="mock_model",
+                api_key="test-key",
+                tissue=tissue,
+                cache_dir=str(tmp_path),
+            )
+
+        result = run([set_a, set_b, set_a], ["blood", "lung", "blood"])
+        assert result == [
+            {"1": "T cells", "2": "B cells"},
+            {"1": "NK cells"},
+            {"1": "T cells", "2": "B cells"},
+        ]
+        # One request per tissue, with the duplicate set sent once
+        assert len(prompts) == 2
+        assert sum(prompt.count("CD3D") for prompt in prompts) == 1
+
+        prompts.clear()
+        result = run([set_a, set_b, set_c], ["blood", "lung", "blood"])
+        assert result[2] == {"5": "Monocytes"}
+        assert len(prompts) == 1
+        assert "CD14" in prompts[0]
+        assert "CD3D" not in prompts[0]
+
+    @patch("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {})
+    def test_batch_annotate_clusters_deduplicates_clusters(self):
+        """Test that matching marker lists across sets are sent once and fanned out."""
+        from mllmcelltype.annotate import PROVIDER_FUNCTIONS
+
+        labels = {"CD3D": "T cells", "CD19": "B cells", "CD14": "Monocytes"}
+        prompts = []
+
+        def provider(prompt, model, api_key):
+            prompts.append(prompt)
+            clusters = re.findall(r"^Cluster (\d+): (\w+)", prompt, flags=re.MULTILINE)
+            return [f"Cluster {cluster}: {labels[gene]}" for cluster, gene in clusters]
+
+        PROVIDER_FUNCTIONS["mock_provider"] = provider
+
+        result = batch_annotate_clusters(
+            marker_genes_list=[
+                {"0": ["CD3D", "CD3E"], "1": ["CD19"]},
+                {"7": ["cd3e", "CD3D"], "8": ["CD14"]},
+            ],
+            species="human",
+            provider="mock_provider",
+            model="mock_model",
+            api_key="test-key",
+            use_cache=False,
+            deduplicate_clusters=True,
+        )
+
+        assert result == [{"0": "T cells", "1": "B cells"}, {"7": "T cells", "8": "Monocytes"}]
+        assert len(prompts) == 1
+        assert prompts[0].count("CD3E") == 1
+
     # Fix parameter name issues
     @patch("mllmcelltype.annotate.PROVIDER_FUNCTIONS")
     @patch("mllmcelltype.utils.load_api_key")
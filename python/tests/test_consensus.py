@@ -5,14 +5,18 @@
 Tests for consensus and comparison functionality in mLLMCelltype.
 """
 
+import time
 from unittest.mock import patch
 
 import pytest
 
 from mllmcelltype.consensus import (
+    _plan_budget,
     check_consensus,
     check_consensus_with_llm,
+    check_consensus_with_llm_batch,
     interactive_consensus_annotation,
+    process_controversial_clusters,
 )
 
 
@@ -70,6 +74,38 @@ class TestConsensus:
         assert consensus_proportion["3"] == 1.0  # Complete agreement, should be 1.0
         assert entropy["3"] == 0.0  # Complete agreement, entropy should be 0
 
+    @patch("mllmcelltype.consensus._request_consensus_check")
+    def test_check_consensus_with_llm_batch(self, mock_request):
+        """Test batched consensus check with a small token budget."""
+        mock_request.side_effect = lambda prompt, api_keys, cancel_token=None: (
+            "```json\n"
+            '{"clusters": ['
+            '{"cluster": "1", "consensus": 1, "consensus_proportion": 1.0, '
+            '"entropy": 0.0, "cell_type": "T cells"},'
+            '{"cluster": "2", "consensus": 0, "consensus_proportion": 0.67, '
+            '"entropy": 0.92, "cell_type": "B cells"}'
+            "]}\n```"
+        )
+
+        consensus, consensus_proportion, entropy = check_consensus_with_llm_batch(
+            predictions=self.model_annotations, max_prompt_tokens=1
+        )
+
+        # A budget of one token forces one request per cluster
+        assert mock_request.call_count == 3
+        assert consensus["1"] == "T cells"
+        assert consensus_proportion["2"] == 0.67
+        assert entropy["2"] == 0.92
+        # Cluster 3 is missing from the reply, so simple consensus is used
+        assert consensus["3"] == "NK cells"
+        assert consensus_proportion["3"] == pytest.approx(2 / 3)
+
+        # A generous budget checks all clusters in a single request
+        mock_request.reset_mock()
+        check_consensus_with_llm_batch(predictions=self.model_annotations)
+        assert mock_request.call_count == 1
+        assert "Cluster 3:" in mock_request.call_args[0][0]
+
     @patch("mllmcelltype.consensus.check_consensus_with_llm")
     def test_check_consensus(self, mock_check_consensus_with_llm):
         """Test check_consensus function."""
@@ -105,6 +141,92 @@ class TestConsensus:
         assert consensus["3"] == "NK cells"
         assert "2" in controversial  # cluster 2 should be identified as controversial
 
+    @patch("mllmcelltype.consensus.check_consensus_with_llm")
+    def test_check_consensus_tiered(self, mock_check_consensus_with_llm):
+        """Test that only clusters ambiguous after the cheap tiers reach the LLM."""
+        mock_check_consensus_with_llm.return_value = (
+            {"2": "B cells"},
+            {"2": 0.9},
+            {"2": 0.3},
+        )
+        predictions = {
+            "model1": {"1": "T cells", "2": "B cells", "3": "NK cells", "4": "Monocytes"},
+            "model2": {"1": "T cells", "2": "Plasma cells", "3": "Natural killer cells"},
+            "model3": {"1": "t cells.", "2": "Macrophages", "3": "NK cells", "4": "Monocyte"},
+        }
+
+        tier_stats = {}
+        consensus, consensus_proportion, entropy, controversial = check_consensus(
+            predictions=predictions,
+            consensus_threshold=0.7,
+            entropy_threshold=1.0,
+            tier_stats=tier_stats,
+        )
+
+        # Only cluster 2 is sent to the LLM
+        llm_predictions = mock_check_consensus_with_llm.call_args[0][0]
+        assert llm_predictions == {
+            "model1": {"2": "B cells"},
+            "model2": {"2": "Plasma cells"},
+            "model3": {"2": "Macrophages"},
+        }
+        assert consensus["1"] == "T cells"
+        assert consensus["3"] == "NK cells"
+        assert consensus_proportion["3"] == 1.0
+        assert entropy["3"] == 0.0
+        assert consensus["2"] == "B cells"
+        assert consensus_proportion["2"] == 0.9
+        assert controversial == []
+        assert tier_stats["exact"]["clusters"] == 1
+        assert tier_stats["synonym"]["clusters"] == 2
+        assert tier_stats["llm"]["clusters"] == 1
+
+    @patch("mllmcelltype.consensus.check_consensus_with_llm")
+    def test_check_consensus_tiered_skips_llm_when_unanimous(self, mock_check_consensus_with_llm):
+        """Test that unanimous predictions never reach the LLM."""
+        predictions = {
+            "model1": {"1": "T cells", "2": "B cells"},
+            "model2": {"1": "T cells", "2": "B cells"},
+        }
+
+        consensus, consensus_proportion, _entropy, controversial = check_consensus(predictions)
+
+        mock_check_consensus_with_llm.assert_not_called()
+        assert consensus == {"1": "T cells", "2": "B cells"}
+        assert consensus_proportion == {"1": 1.0, "2": 1.0}
+        assert controversial == []
+
+    @patch("mllmcelltype.consensus.check_consensus_with_llm")
+    def test_check_consensus_lexical_tier_keeps_subsets_apart(self, mock_check_consensus_with_llm):
+        """Test that lexically similar but distinct cell types are left to the LLM."""
+        mock_check_consensus_with_llm.return_value = ({}, {}, {})
+        predictions = {
+            "model1": {"1": "CD4+ T cells", "2": "NK cells", "3": "Type I pneumocytes"},
+            "model2": {"1": "CD8+ T cells", "2": "NKT cells", "3": "Type II pneumocytes"},
+        }
+
+        for similarity_threshold in (None, 0.85):
+            tier_stats = {}
+            check_consensus(
+                predictions,
+                similarity_threshold=similarity_threshold,
+                tier_stats=tier_stats,
+            )
+            assert mock_check_consensus_with_llm.call_args[0][0] == predictions
+            assert tier_stats["lexical"]["clusters"] == 0
+
+        # Spelling variants are merged once the lexical tier is enabled
+        mock_check_consensus_with_llm.reset_mock()
+        typos = {
+            "model1": {"1": "Oligodendrocytes"},
+            "model2": {"1": "Oligodendrocites"},
+        }
+        consensus, consensus_proportion, _entropy, _controversial = check_consensus(
+            typos, similarity_threshold=0.85
+        )
+        mock_check_consensus_with_llm.assert_not_called()
+        assert consensus_proportion["1"] == 1.0
+
     @patch("mllmcelltype.functions.get_provider")
     @patch("mllmcelltype.annotate.annotate_clusters")
     @patch("mllmcelltype.consensus.check_consensus")
@@ -179,6 +301,492 @@ class TestConsensus:
         assert result["consensus_proportion"]["2"] == 0.85
         assert result["entropy"]["2"] == 0.40
 
+    @patch("mllmcelltype.consensus.process_controversial_clusters")
+    @patch("mllmcelltype.consensus.check_consensus_with_llm")
+    @patch("mllmcelltype.annotate.annotate_clusters")
+    def test_interactive_consensus_annotation_sequential_voting(
+        self, mock_annotate_clusters, mock_check_consensus_with_llm, mock_process_controversial
+    ):
+        """Test that sequential voting only sends open clusters to further models."""
+        answers = {"1": "T cells", "2": "B cells", "3": "NK cells"}
+        requested = []
+
+        def annotate(marker_genes, **kwargs):
+            requested.append(sorted(marker_genes))
+            model = kwargs["model"]
+            results = {cluster_id: answers[cluster_id] for cluster_id in marker_genes}
+            if "3" in results and model != "gpt-4o":
+                results["3"] = f"Cell type {len(requested)}"
+            return results
+
+        mock_annotate_clusters.side_effect = annotate
+        mock_check_consensus_with_llm.return_value = ({}, {}, {})
+        mock_process_controversial.return_value = ({}, {}, {}, {})
+
+        result = interactive_consensus_annotation(
+            marker_genes={cluster_id: ["CD3D"] for cluster_id in answers},
+            species="human",
+            models=[
+                "gpt-4o",
+                "gpt-4-turbo",
+                "claude-3-opus",
+                "claude-3-5-sonnet-latest",
+                "gemini-1.5-pro",
+            ],
+            api_keys={"openai": "test-key", "anthropic": "test-key", "gemini": "test-key"},
+            consensus_threshold=0.6,
+            max_discussion_rounds=0,
+            use_cache=False,
+            sequential_voting=True,
+        )
+
+        # Cluster 3 is ruled out by the quorum of 3; clusters 1 and 2 could still fail the
+        # entropy threshold with 3/1/1 votes, so they are settled only after 4 votes
+        assert requested == [["1", "2", "3"]] * 3 + [["1", "2"]]
+        assert result["metadata"]["sequential_voting"]["cluster_queries"] == 11
+        assert result["metadata"]["sequential_voting"]["cluster_queries_saved"] == 4
+        assert result["consensus"]["1"] == "T cells"
+        assert result["consensus"]["2"] == "B cells"
+        assert "3" in result["controversial_clusters"]
+
+    @patch("mllmcelltype.consensus.process_controversial_clusters")
+    @patch("mllmcelltype.consensus.check_consensus_with_llm")
+    @patch("mllmcelltype.annotate.annotate_clusters")
+    def test_interactive_consensus_annotation_sequential_voting_split_vote(
+        self, mock_annotate_clusters, mock_check_consensus_with_llm, mock_process_controversial
+    ):
+        """Test that sequential voting finds the same controversial clusters as full voting."""
+        models = [
+            "gpt-4o",
+            "gpt-4-turbo",
+            "claude-3-opus",
+            "claude-3-5-sonnet-latest",
+            "gemini-1.5-pro",
+        ]
+        # 3/1/1 meets a 0.6 consensus proportion, but its entropy of 1.37 exceeds 1.0
+        votes = dict(zip(models, ["T cells", "T cells", "T cells", "NK cells", "B cells"]))
+        mock_annotate_clusters.side_effect = lambda marker_genes, **kwargs: dict.fromkeys(
+            marker_genes, votes[kwargs["model"]]
+        )
+        mock_check_consensus_with_llm.return_value = ({}, {}, {})
+        mock_process_controversial.return_value = ({}, {}, {}, {})
+
+        results = [
+            interactive_consensus_annotation(
+                marker_genes={"1": ["CD3D"]},
+                species="human",
+                models=models,
+                api_keys={"openai": "test-key", "anthropic": "test-key", "gemini": "test-key"},
+                consensus_threshold=0.6,
+                entropy_threshold=1.0,
+                max_discussion_rounds=0,
+                use_cache=False,
+                sequential_voting=sequential_voting,
+            )
+            for sequential_voting in [False, True]
+        ]
+
+        assert mock_annotate_clusters.call_count == 10
+        assert results[0]["controversial_clusters"] == ["1"]
+        assert results[1]["controversial_clusters"] == ["1"]
+        assert results[1]["metadata"]["sequential_voting"]["cluster_queries_saved"] == 0
+
+    @patch("mllmcelltype.annotate.get_model_response")
+    def test_process_controversial_clusters_batch(self, mock_get_model_response):
+        """Test that batched discussion drops resolved clusters from later rounds."""
+        mock_get_model_response.side_effect = [
+            '{"clusters": ['
+            '{"cluster": "1", "cell_type": "T cells", "consensus_proportion": 0.9,'
+            ' "entropy": 0.3, "reasoning": "CD3D and CD3E"},'
+            '{"cluster": "2", "cell_type": "B cells", "consensus_proportion": 0.5,'
+            ' "entropy": 1.5, "reasoning": "Unclear"}]}',
+            '{"clusters": ['
+            '{"cluster": "2", "cell_type": "Plasma cells", "consensus_proportion": 0.8,'
+            ' "entropy": 0.7, "reasoning": "MZB1 and JCHAIN"}]}',
+        ]
+
+        resolved, history, proportion, entropy = process_controversial_clusters(
+            marker_genes={"1": ["CD3D", "CD3E"], "2": ["MZB1", "JCHAIN"]},
+            controversial_clusters=["1", "2"],
+            model_predictions={
+                "model1": {"1": "T cells", "2": "B cells"},
+                "model2": {"1": "NK cells", "2": "Plasma cells"},
+            },
+            species="human",
+            provider="openai",
+            model="gpt-4o",
+            api_key="test-key",
+            use_cache=False,
+            batch_discussion=True,
+        )
+
+        assert mock_get_model_response.call_count == 2
+        second_prompt = mock_get_model_response.call_args_list[1][0][0]
+        assert "Cluster 1:" not in second_prompt
+        assert "Previous round: proposed B cells" in second_prompt
+        assert resolved == {"1": "T cells", "2": "Plasma cells"}
+        assert proportion == {"1": 0.9, "2": 0.8}
+        assert entropy == {"1": 0.3, "2": 0.7}
+        assert "Consensus reached in round 2" in history["2"][-1]
+
+    @patch("mllmcelltype.annotate.get_model_response")
+    def test_process_controversial_clusters_bounded_context(self, mock_get_model_response):
+        """Test that follow-up discussion prompts stay within max_context_tokens."""
+        from mllmcelltype.utils import estimate_tokens
+
+        discussion_prompts = []
+        long_reasoning = "CD3D and CD3E point to T cells. " + "More reasoning. " * 500
+
+        def respond(prompt, *args, **kwargs):
+            if "Marker genes for this cluster" in prompt:
+                discussion_prompts.append(prompt)
+                return long_reasoning + "\nFinal cell type determination: T cells"
+            return "0\n0.5\n1.5\nT cells"
+
+        mock_get_model_response.side_effect = respond
+
+        process_controversial_clusters(
+            marker_genes={"1": ["CD3D", "CD3E", "MS4A1"]},
+            controversial_clusters=["1"],
+            model_predictions={"model1": {"1": "T cells"}, "model2": {"1": "NK cells"}},
+            species="human",
+            provider="openai",
+            model="gpt-4o",
+            api_key="test-key",
+            max_discussion_rounds=3,
+            use_cache=False,
+            max_context_tokens=800,
+        )
+
+        assert len(discussion_prompts) == 3
+        for prompt in discussion_prompts[1:]:
+            assert estimate_tokens(prompt) <= 800
+            assert "Proposed cell type: T cells" in prompt
+            assert "Key evidence genes: CD3D, CD3E" in prompt
+
+    @patch("mllmcelltype.annotate.get_model_response")
+    def test_process_controversial_clusters_pipelined(self, mock_get_model_response):
+        """Test that pipelined discussions keep a fixed number of requests in flight."""
+        import threading
+        import time
+
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def respond(prompt, *args, **kwargs):
+            with lock:
+                active.append(prompt)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(prompt)
+            if "Marker genes for this cluster" in prompt:
+                return "Final cell type determination: T cells\nCP: 0.9\nH: 0.2"
+            return "1\n0.9\n0.2\nT cells"
+
+        mock_get_model_response.side_effect = respond
+        clusters = ["1", "2", "3", "4"]
+
+        resolved, history, _proportion, _entropy = process_controversial_clusters(
+            marker_genes={cluster_id: ["CD3D", f"GENE{cluster_id}"] for cluster_id in clusters},
+            controversial_clusters=clusters,
+            model_predictions={
+                "model1": dict.fromkeys(clusters, "T cells"),
+                "model2": dict.fromkeys(clusters, "NK cells"),
+            },
+            species="human",
+            provider="openai",
+            model="gpt-4o",
+            api_key="test-key",
+            max_discussion_rounds=2,
+            use_cache=False,
+            max_in_flight=2,
+        )
+
+        assert max(peak) == 2
+        assert resolved == dict.fromkeys(clusters, "T cells")
+        assert set(history) == set(clusters)
+
+    @pytest.mark.parametrize("strategy", ["round_robin", "least_loaded"])
+    @patch("mllmcelltype.annotate.get_model_response")
+    def test_process_controversial_clusters_discussion_pool(
+        self, mock_get_model_response, strategy
+    ):
+        """Test that discussion requests are spread across a pool of models."""
+        mock_get_model_response.return_value = '{"clusters": []}'
+        clusters = ["1", "2", "3", "4"]
+
+        process_controversial_clusters(
+            marker_genes={cluster_id: ["CD3D"] for cluster_id in clusters},
+            controversial_clusters=clusters,
+            model_predictions={
+                "model1": dict.fromkeys(clusters, "T cells"),
+                "model2": dict.fromkeys(clusters, "NK cells"),
+            },
+            species="human",
+            max_discussion_rounds=2,
+            use_cache=False,
+            batch_discussion=True,
+            max_prompt_tokens=1,
+            discussion_pool=[
+                {"provider": "openai", "model": "gpt-4o", "api_key": "key1"},
+                {"provider": "anthropic", "model": "claude-3-opus", "api_key": "key2"},
+            ],
+            pool_strategy=strategy,
+        )
+
+        # One request per cluster and round, alternating between the two models
+        used_models = [call[0][2] for call in mock_get_model_response.call_args_list]
+        assert len(used_models) == 8
+        assert used_models.count("gpt-4o") == 4
+        assert used_models.count("claude-3-opus") == 4
+
+    @patch("mllmcelltype.annotate.get_model_response")
+    def test_process_controversial_clusters_discussion_pool_pipelined(
+        self, mock_get_model_response
+    ):
+        """Test that a discussion pool keeps one request in flight per model by default."""
+        import threading
+        import time
+
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def respond(prompt, *args, **kwargs):
+            with lock:
+                active.append(prompt)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(prompt)
+            if "Marker genes for this cluster" in prompt:
+                return "Final cell type determination: T cells\nCP: 0.9\nH: 0.2"
+            return "1\n0.9\n0.2\nT cells"
+
+        mock_get_model_response.side_effect = respond
+        clusters = ["1", "2", "3", "4"]
+
+        resolved, _history, _proportion, _entropy = process_controversial_clusters(
+            marker_genes={cluster_id: ["CD3D", f"GENE{cluster_id}"] for cluster_id in clusters},
+            controversial_clusters=clusters,
+            model_predictions={
+                "model1": dict.fromkeys(clusters, "T cells"),
+                "model2": dict.fromkeys(clusters, "NK cells"),
+            },
+            species="human",
+            max_discussion_rounds=2,
+            use_cache=False,
+            discussion_pool=[
+                {"provider": "openai", "model": "gpt-4o", "api_key": "key1"},
+                {"provider": "anthropic", "model": "claude-3-opus", "api_key": "key2"},
+            ],
+        )
+
+        assert max(peak) == 2
+        assert resolved == dict.fromkeys(clusters, "T cells")
+
+    def test_process_controversial_clusters_circuit_opens_mid_discussion(self):
+        """Test that a circuit opening during pipelined discussions fails the open clusters."""
+        import requests
+
+        from mllmcelltype.retry import RetryPolicy, configure_retry
+        from mllmcelltype.router import configure_router, get_circuit_breaker
+
+        def timing_out(prompt, model, api_key):
+            raise requests.Timeout("read timed out")
+
+        # The first failed request opens the circuit, so clusters 5 and 6 are refused
+        configure_retry(RetryPolicy(max_attempts=1, base_delay=0))
+        configure_router(failure_threshold=1)
+        clusters = ["1", "2", "3", "4", "5", "6"]
+
+        with patch.dict("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {"openai": timing_out}):
+            resolved, history, _proportion, _entropy = process_controversial_clusters(
+                marker_genes={cluster_id: ["CD3D"] for cluster_id in clusters},
+                controversial_clusters=clusters,
+                model_predictions={
+                    "model1": dict.fromkeys(clusters, "T cells"),
+                    "model2": dict.fromkeys(clusters, "NK cells"),
+                },
+                species="human",
+                provider="openai",
+                model="gpt-4o",
+                api_key="test-key",
+                max_discussion_rounds=2,
+                use_cache=False,
+                max_in_flight=4,
+            )
+
+        assert get_circuit_breaker("openai", "gpt-4o").state == "open"
+        assert set(resolved) == set(clusters)
+        assert "Circuit open" in history["5"][0]
+        assert "Circuit open" in history["6"][0]
+        assert all(
+            annotation.startswith("Error during discussion") for annotation in resolved.values()
+        )
+
+    @patch("mllmcelltype.annotate.get_model_response")
+    def test_process_controversial_clusters_discussion_pool_skips_open_circuit(
+        self, mock_get_model_response
+    ):
+        """Test that a pool model whose circuit is open gets no discussion requests."""
+        from mllmcelltype.router import get_circuit_breaker
+
+        breaker = get_circuit_breaker("openai", "gpt-4o")
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        mock_get_model_response.return_value = '{"clusters": []}'
+        clusters = ["1", "2"]
+
+        process_controversial_clusters(
+            marker_genes={cluster_id: ["CD3D"] for cluster_id in clusters},
+            controversial_clusters=clusters,
+            model_predictions={
+                "model1": dict.fromkeys(clusters, "T cells"),
+                "model2": dict.fromkeys(clusters, "NK cells"),
+            },
+            species="human",
+            max_discussion_rounds=2,
+            use_cache=False,
+            batch_discussion=True,
+            max_prompt_tokens=1,
+            discussion_pool=[
+                {"provider": "openai", "model": "gpt-4o", "api_key": "key1"},
+                {"provider": "anthropic", "model": "claude-3-opus", "api_key": "key2"},
+            ],
+        )
+
+        used_models = [call[0][2] for call in mock_get_model_response.call_args_list]
+        assert used_models == ["claude-3-opus"] * 4
+
+    @patch("mllmcelltype.consensus.process_controversial_clusters")
+    @patch("mllmcelltype.consensus.check_consensus")
+    @patch("mllmcelltype.annotate.annotate_clusters")
+    def test_interactive_consensus_annotation_all_circuits_open(
+        self, mock_annotate_clusters, mock_check_consensus, mock_process_controversial
+    ):
+        """Test that controversial clusters stay unresolved when every circuit is open."""
+        from mllmcelltype.router import get_circuit_breaker
+
+        mock_annotate_clusters.side_effect = [
+            {"1": "T cells", "2": "B cells"},
+            {"1": "T cells", "2": "Monocytes"},
+        ]
+        mock_check_consensus.return_value = (
+            {"1": "T cells"},
+            {"1": 1.0, "2": 0.5},
+            {"1": 0.0, "2": 1.0},
+            ["2"],
+        )
+        for provider, model in [("openai", "gpt-4o"), ("anthropic", "claude-3-opus")]:
+            breaker = get_circuit_breaker(provider, model)
+            for _ in range(breaker.failure_threshold):
+                breaker.record_failure()
+
+        result = interactive_consensus_annotation(
+            marker_genes={"1": ["CD3D"], "2": ["MS4A1"]},
+            species="human",
+            models=["gpt-4o", "claude-3-opus"],
+            api_keys={"openai": "key1", "anthropic": "key2"},
+            use_cache=False,
+        )
+
+        mock_process_controversial.assert_not_called()
+        assert result["controversial_clusters"] == ["2"]
+        assert result["resolved"] == {}
+        assert result["consensus"] == {"1": "T cells"}
+
+    def test_interactive_consensus_annotation_timeout(self):
+        """Test that a slow model is abandoned and a partial result returned in time."""
+
+        def fast_provider(prompt, model, api_key):
+            return ["Cluster 1: T cells", "Cluster 2: B cells"]
+
+        def slow_provider(prompt, model, api_key):
+            time.sleep(2)
+            return ["Cluster 1: NK cells", "Cluster 2: Monocytes"]
+
+        start_time = time.time()
+        with patch.dict(
+            "mllmcelltype.annotate.PROVIDER_FUNCTIONS",
+            {"openai": fast_provider, "anthropic": slow_provider},
+        ):
+            result = interactive_consensus_annotation(
+                marker_genes=self.marker_genes_dict,
+                species="human",
+                models=["gpt-4o", "claude-3-5-sonnet-latest", "gpt-4o-mini"],
+                api_keys={"openai": "key1", "anthropic": "key2"},
+                use_cache=False,
+                timeout=0.3,
+            )
+
+        assert time.time() - start_time < 1.5
+        assert result["metadata"]["partial"] is True
+        assert list(result["model_annotations"]) == ["gpt-4o"]
+        assert result["consensus"] == {"1": "T cells", "2": "B cells"}
+
+    def test_plan_budget_prioritises_large_clusters(self):
+        """Test that the budget plan favours large clusters and skips what does not fit."""
+        marker_genes = {"a": ["CD3D"], "b": ["CD19"], "c": ["NKG7"]}
+        sizes = {"a": 10, "b": 5000, "c": 3000}
+
+        full, single, skipped, _ = _plan_budget(marker_genes, 2, cluster_sizes=sizes)
+        assert full == ["b", "c"]
+        assert single == ["a"]
+        assert skipped == []
+
+        full, single, skipped, used = _plan_budget(
+            marker_genes, 2, token_budget=1300, cluster_sizes=sizes
+        )
+        assert full == ["b"]
+        assert single == ["c", "a"]
+        assert skipped == []
+        assert used <= 1300
+
+        full, single, skipped, _ = _plan_budget(
+            marker_genes, 2, token_budget=290, cluster_sizes=sizes
+        )
+        assert full == []
+        assert single == ["b", "c"]
+        assert skipped == ["a"]
+
+    def test_interactive_consensus_annotation_budgeted(self):
+        """Test that low-impact clusters get single-model annotation in a budgeted run."""
+        labels = {"1": "T cells", "2": "B cells", "3": "NK cells"}
+        requested = []
+
+        markers = {"1": "CD3D", "2": "CD19", "3": "NKG7"}
+
+        def provider(prompt, model, api_key):
+            cluster_ids = [cluster_id for cluster_id in labels if markers[cluster_id] in prompt]
+            requested.append((model, cluster_ids))
+            return [f"Cluster {cluster_id}: {labels[cluster_id]}" for cluster_id in cluster_ids]
+
+        with patch.dict(
+            "mllmcelltype.annotate.PROVIDER_FUNCTIONS",
+            {"openai": provider, "anthropic": provider},
+        ):
+            result = interactive_consensus_annotation(
+                marker_genes={cluster_id: [gene] for cluster_id, gene in markers.items()},
+                species="human",
+                models=["gpt-4o", "claude-3-5-sonnet-latest"],
+                api_keys={"openai": "key1", "anthropic": "key2"},
+                use_cache=False,
+                time_budget=10,
+                cluster_sizes={"1": 4000, "2": 3000, "3": 20},
+            )
+
+        budget = result["metadata"]["budget"]
+        assert budget["full_consensus_clusters"] == ["1", "2"]
+        assert budget["single_model_clusters"] == ["3"]
+        assert budget["skipped_clusters"] == []
+        assert result["consensus"] == labels
+        assert list(result["consensus"]) == ["1", "2", "3"]
+        assert result["metadata"]["partial"] is False
+        assert sum(1 for _, cluster_ids in requested if "3" in cluster_ids) == 1
+
 
 if __name__ == "__main__":
     pytest.main(["-xvs", __file__])
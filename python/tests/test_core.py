@@ -15,11 +15,17 @@ import pytest
 
 # Import utility functions
 from mllmcelltype.utils import (
+    canonicalize_markers,
     clean_annotation,
+    compact_marker_genes,
     create_cache_key,
+    deduplicate_marker_sets,
+    estimate_tokens,
+    expand_deduplicated_annotations,
     format_results,
     load_api_key,
     load_from_cache,
+    normalize_annotation,
     parse_marker_genes,
     save_to_cache,
 )
@@ -39,6 +45,48 @@ def test_parse_marker_genes(sample_marker_genes_df):
     assert "CD19" in parsed["2"]
 
 
+def test_parse_marker_genes_ranked(sample_marker_genes_df):
+    """Test ranking and truncating marker genes by a column."""
+    by_fold_change = parse_marker_genes(sample_marker_genes_df, rank_by="avg_log2FC", top_n=2)
+    assert by_fold_change["1"] == ["CD3D", "CD3E"]
+
+    by_p_value = parse_marker_genes(sample_marker_genes_df, rank_by="p_val_adj", top_n=1)
+    assert by_p_value["2"] == ["CD19"]
+
+    with pytest.raises(ValueError, match="'score' column not found"):
+        parse_marker_genes(sample_marker_genes_df, rank_by="score")
+
+
+def test_compact_marker_genes():
+    """Test trimming marker lists to a token budget."""
+    marker_genes = {
+        "1": [f"TGENE{i}" for i in range(100)],
+        "2": [f"BGENE{i}" for i in range(40)],
+        "3": ["NKG7", "GNLY"],
+    }
+
+    compacted, truncated = compact_marker_genes(marker_genes, max_tokens=100)
+    assert len(compacted["1"]) == len(compacted["2"])
+    assert compacted["1"] == marker_genes["1"][: len(compacted["1"])]
+    assert compacted["3"] == ["NKG7", "GNLY"]
+    assert truncated == {
+        "1": 100 - len(compacted["1"]),
+        "2": 40 - len(compacted["2"]),
+    }
+    assert (
+        sum(
+            estimate_tokens(f"Cluster {cluster}: {', '.join(genes)}")
+            for cluster, genes in compacted.items()
+        )
+        <= 100
+    )
+
+    # Small enough lists are left alone, tiny budgets keep min_genes
+    assert compact_marker_genes(marker_genes, max_tokens=10_000) == (marker_genes, {})
+    compacted, _ = compact_marker_genes(marker_genes, max_tokens=1, min_genes=3)
+    assert len(compacted["1"]) == 3
+
+
 def test_parse_marker_genes_empty():
     """Test parsing empty marker genes DataFrame."""
     empty_df = pd.DataFrame()
@@ -205,5 +253,35 @@ def test_clean_annotation():
         assert clean_annotation(input_str) == expected
 
 
+def test_normalize_annotation():
+    """Test normalizing wording variants of cell type annotations."""
+    assert normalize_annotation("NK cells") == normalize_annotation("Natural killer cells")
+    assert normalize_annotation("T-cells") == normalize_annotation("T lymphocytes")
+    assert normalize_annotation("Cluster 1: B cells.") == "b cell"
+    assert normalize_annotation("CD14+ Monocytes") != normalize_annotation("CD16+ Monocytes")
+    assert normalize_annotation("") == ""
+
+
+def test_deduplicate_marker_sets():
+    """Test collapsing canonically identical marker lists across datasets."""
+    assert canonicalize_markers(["cd3d", " CD3E", "CD2"]) == canonicalize_markers(
+        ["CD2", "CD3D", "cd3e"]
+    )
+    assert canonicalize_markers(["CD3D", "CD3E", "NKG7"], top_n=2) == ("CD3D", "CD3E")
+
+    datasets = [
+        {"0": ["CD3D", "CD3E"], "1": ["MS4A1", "CD79A"]},
+        {"a": ["cd3e", "cd3d"], "b": ["LYZ", "CD14"]},
+    ]
+    unique, mappings = deduplicate_marker_sets(datasets)
+    assert len(unique) == 3
+    assert mappings[0]["0"] == mappings[1]["a"]
+
+    annotations = {unique_id: f"type {unique_id}" for unique_id in unique}
+    expanded = expand_deduplicated_annotations(annotations, mappings)
+    assert expanded[0]["0"] == expanded[1]["a"]
+    assert set(expanded[1]) == {"a", "b"}
+
+
 if __name__ == "__main__":
     pytest.main(["-xvs", __file__])
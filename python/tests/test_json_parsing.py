@@ -12,7 +12,7 @@ import unittest
 # Add parent directory to path to import mllmcelltype
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from mllmcelltype.utils import format_results
+from mllmcelltype.utils import find_unparsed_clusters, format_results
 
 
 class TestJsonParsing(unittest.TestCase):
@@ -125,6 +125,26 @@ class TestJsonParsing(unittest.TestCase):
         print("JSON parsing result with incorrect format:", result)
         self.assertEqual(result, self.expected_result)
 
+    def test_find_unparsed_clusters(self):
+        """Test detection of clusters that could not be read from a response."""
+        result = format_results(self.json_response, self.clusters)
+        self.assertEqual(find_unparsed_clusters(self.json_response, result, self.clusters), [])
+
+        # Cluster 3 is missing and the remaining lines were mapped by position
+        response = ["Cluster 1: T cells", "Cluster 2: B cells", "Monocytes", "Extra line"]
+        result = format_results(response, self.clusters)
+        self.assertEqual(find_unparsed_clusters(response, result, self.clusters), ["3"])
+
+        # Prose instead of a label
+        response = [
+            "Cluster 1: T cells",
+            "Cluster 2: Based on these markers this cluster most likely contains a mix of "
+            "B cells and plasma cells",
+            "Cluster 3: Monocytes",
+        ]
+        result = format_results(response, self.clusters)
+        self.assertEqual(find_unparsed_clusters(response, result, self.clusters), ["2"])
+
 
 if __name__ == "__main__":
     unittest.main()
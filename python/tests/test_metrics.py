@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the per-request metrics hooks in mLLMCelltype.
+"""
+
+import json
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from mllmcelltype.annotate import annotate_clusters
+from mllmcelltype.metrics import (
+    MetricEvent,
+    MetricsCollector,
+    add_metrics_hook,
+    collect_run_metrics,
+    emit_metric,
+    remove_metrics_hook,
+)
+from mllmcelltype.providers.response import ProviderResponse
+from mllmcelltype.retry import RetryPolicy, configure_retry
+
+
+def test_annotate_clusters_reports_requests_and_cache(tmp_path):
+    """Test that provider requests, retries and cache lookups are reported to hooks."""
+    calls = []
+
+    def provider(prompt, model, api_key):
+        calls.append(prompt)
+        if len(calls) == 1:
+            raise requests.ConnectionError("connection reset")
+        return ["Cluster 1: T cells", "Cluster 2: B cells"]
+
+    marker_genes = {"1": ["CD3D", "CD3E"], "2": ["MS4A1", "CD79A"]}
+    collector = MetricsCollector()
+    add_metrics_hook(collector)
+    configure_retry(RetryPolicy(max_attempts=3, base_delay=0.01))
+    try:
+        with patch.dict("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {"mock_provider": provider}):
+            with patch("mllmcelltype.retry.time.sleep"):
+                for _ in range(2):
+                    annotate_clusters(
+                        marker_genes,
+                        species="human",
+                        provider="mock_provider",
+                        model="mock_model",
+                        api_key="test-key",
+                        cache_dir=str(tmp_path),
+                    )
+    finally:
+        remove_metrics_hook(collector)
+
+    events = collector.events()
+    request = next(event for event in events if event.kind == "request")
+    assert request.retries == 1
+    assert request.success
+    assert request.input_tokens > 0
+    assert not request.tokens_reported
+    assert request.bytes_received > 0
+    assert [event.cache_hit for event in events if event.kind == "cache"] == [False, True]
+
+    summary = collector.summary()
+    assert summary["requests"] == 1
+    assert summary["retries"] == 1
+    assert summary["cache_hits"] == 1
+    assert summary["cache_misses"] == 1
+    assert summary["by_model"]["mock_provider/mock_model"]["mean_latency"] is not None
+
+    text = collector.to_prometheus()
+    assert 'mllmcelltype_requests_total{provider="mock_provider",model="mock_model"} 1' in text
+    assert "# TYPE mllmcelltype_cache_hits_total counter" in text
+
+    path = tmp_path / "metrics.jsonl"
+    assert collector.to_jsonl(str(path)) == len(events)
+    lines = path.read_text().splitlines()
+    assert json.loads(lines[0])["provider"] == "mock_provider"
+
+
+def test_request_metrics_use_reported_usage():
+    """Test that token counts reported by the provider replace the local estimates."""
+
+    def provider(prompt, model, api_key):
+        return ProviderResponse(
+            ["Cluster 1: T cells"],
+            "stop",
+            {
+                "prompt_tokens": 1500,
+                "completion_tokens": 9,
+                "prompt_tokens_details": {"cached_tokens": 1024},
+            },
+        )
+
+    collector = MetricsCollector()
+    add_metrics_hook(collector)
+    try:
+        with patch.dict("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {"openai": provider}):
+            annotate_clusters(
+                {"1": ["CD3D", "CD3E"]},
+                species="human",
+                provider="openai",
+                model="gpt-4o",
+                api_key="test-key",
+                use_cache=False,
+            )
+    finally:
+        remove_metrics_hook(collector)
+
+    request = next(event for event in collector.events() if event.kind == "request")
+    assert request.tokens_reported
+    assert (request.input_tokens, request.output_tokens, request.cached_tokens) == (1500, 9, 1024)
+    assert collector.summary()["cached_tokens"] == 1024
+    assert 'mllmcelltype_cached_input_tokens_total{provider="openai",model="gpt-4o"} 1024' in (
+        collector.to_prometheus()
+    )
+
+
+def test_collect_run_metrics():
+    """Test that the decorator stores a run's metrics and isolates failing hooks."""
+
+    def failing_hook(event):
+        raise RuntimeError("hook failed")
+
+    @collect_run_metrics
+    def run():
+        emit_metric(MetricEvent(kind="request", provider="p", model="m", latency=2.0))
+        emit_metric(MetricEvent(kind="cache", provider="p", model="m", cache_hit=True))
+        return {"metadata": {}}
+
+    add_metrics_hook(failing_hook)
+    try:
+        result = run()
+    finally:
+        remove_metrics_hook(failing_hook)
+
+    metrics = result["metadata"]["metrics"]
+    assert metrics["requests"] == 1
+    assert metrics["latency"] == 2.0
+    assert metrics["cache_hits"] == 1
+    assert metrics["by_model"]["p/m"]["mean_latency"] == 2.0
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
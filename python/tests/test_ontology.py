@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the offline cell type ontology in mLLMCelltype.
+"""
+
+from unittest.mock import patch
+
+from mllmcelltype.consensus import check_consensus
+from mllmcelltype.functions import identify_controversial_clusters
+from mllmcelltype.ontology import load_ontology
+from mllmcelltype.utils import find_agreement
+
+
+def test_ontology_lookup():
+    """Test resolving names, synonyms and qualified labels to terms."""
+    ontology = load_ontology()
+
+    assert len(ontology) > 0
+    assert ontology.lookup("CD4+ T cells") == "CL:0000624"
+    assert ontology.lookup("Helper T cells") == "CL:0000624"
+    assert ontology.lookup("Natural killer cells") == ontology.lookup("NK cells")
+    assert ontology.lookup("activated CD4+ T cells") == "CL:0000624"
+    assert ontology.lookup("Unknown blob") is None
+
+
+def test_ontology_lookup_keeps_qualifiers():
+    """Test that the suffix fallback keeps lineage qualifiers and avoids general terms."""
+    ontology = load_ontology()
+
+    for label in [
+        "NKT cells",
+        "Cancer stem cells",
+        "Proliferating cells",
+        "Non-T cells",
+        "NK T cells",
+        "CD4-CD8- T cells",
+        "Pre-B cells",
+        "Pro-B cells",
+    ]:
+        assert ontology.lookup(label) is None, label
+    assert ontology.lookup("CD4+ CD25+ regulatory T cells") == ontology.lookup("Tregs")
+
+    annotations = {"model1": {"1": "Non-T cells"}, "model2": {"1": "T cells"}}
+    _, consensus_proportion, _ = find_agreement(annotations, ontology=ontology)
+    assert consensus_proportion["1"] < 1.0
+
+
+def test_ontology_depth():
+    """Test generalizing terms to a shallower ontology depth."""
+    ontology = load_ontology()
+    cd4 = ontology.lookup("CD4+ T cells")
+    cd8 = ontology.lookup("CD8+ T cells")
+
+    assert ontology.depth(cd4) > ontology.depth(ontology.lookup("T cells"))
+    assert ontology.canonical_label("CD4+ T cells") != ontology.canonical_label("CD8+ T cells")
+    assert ontology.term_at_depth(cd4, ontology.depth(cd4) - 1) == ontology.lookup("T cells")
+    assert ontology.term_at_depth(cd8, ontology.depth(cd8) - 1) == ontology.lookup("T cells")
+    assert ontology.canonical_label("Unknown blob", depth=2) == "unknown blob"
+
+
+def test_find_agreement_with_ontology():
+    """Test that synonymous labels agree when an ontology is given."""
+    ontology = load_ontology()
+    annotations = {
+        "model1": {"1": "NK cells"},
+        "model2": {"1": "Natural killer cells"},
+        "model3": {"1": "NK cell"},
+    }
+
+    consensus, scores, entropy = find_agreement(annotations, ontology=ontology)
+    assert scores["1"] == 1.0
+    assert entropy["1"] == 0.0
+
+    controversial = identify_controversial_clusters(annotations, ontology=ontology)
+    assert controversial == []
+
+
+def test_check_consensus_with_ontology():
+    """Test that the synonym tier uses the ontology and skips the LLM."""
+    ontology = load_ontology()
+    predictions = {
+        "model1": {"1": "Helper T cells"},
+        "model2": {"1": "CD4+ T cells"},
+        "model3": {"1": "CD4 T lymphocytes"},
+    }
+
+    with patch("mllmcelltype.consensus.check_consensus_with_llm") as mock_llm:
+        consensus, proportion, entropy, controversial = check_consensus(
+            predictions, ontology=ontology
+        )
+
+    mock_llm.assert_not_called()
+    assert controversial == []
+    assert proportion["1"] == 1.0
+    assert entropy["1"] == 0.0
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the dry-run cost and latency planner in mLLMCelltype.
+"""
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from mllmcelltype.annotate import _batch_set_key, _render_annotation_prompt
+from mllmcelltype.planner import plan_batch_run, plan_consensus_run
+from mllmcelltype.utils import create_cache_key, save_to_cache
+
+
+def test_plan_consensus_run(tmp_path):
+    """Test that a consensus run is planned from rendered prompts and the cache."""
+    marker_genes = {
+        "1": ["CD3D", "CD3E"],
+        "2": ["MS4A1", "CD79A"],
+        "3": ["NKG7", "GNLY"],
+        "4": ["CD14", "LYZ"],
+    }
+    prompt, _ = _render_annotation_prompt(marker_genes, "human", "blood")
+    save_to_cache(
+        create_cache_key(prompt, "gpt-4o", "openai"), ["Cluster 1: T cells"], str(tmp_path)
+    )
+
+    provider = MagicMock()
+    with patch.dict("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {"openai": provider}):
+        plan = plan_consensus_run(
+            marker_genes,
+            "human",
+            ["gpt-4o", {"provider": "openai", "model": "unpriced-model"}],
+            tissue="blood",
+            cache_dir=str(tmp_path),
+        )
+    provider.assert_not_called()
+
+    annotation = plan["by_stage"]["annotation"]
+    assert annotation["requests"] == 2
+    assert annotation["cache_hits"] == 1
+    # One of four clusters is expected to be controversial, discussed for three rounds
+    assert plan["by_stage"]["discussion"]["requests"] == 3
+    assert plan["by_stage"]["consensus_check"]["requests"] == 3
+    assert plan["totals"]["requests"] == 8
+    assert plan["totals"]["input_tokens"] > 0
+    assert plan["totals"]["seconds"] > 0
+    assert plan["unpriced_models"] == ["unpriced-model"]
+    cached = next(request for request in plan["requests"] if request["cached"])
+    assert cached["model"] == "gpt-4o"
+    assert cached["cost"] == 0.0
+
+
+def test_plan_batch_run(tmp_path):
+    """Test that cached and duplicate sets are left out of the planned batch requests."""
+    sets = [
+        {"1": ["CD3D", "CD3E"], "2": ["MS4A1"]},
+        {"1": ["CD3D", "CD3E"], "2": ["MS4A1"]},
+        {"1": ["LYZ", "CD14"]},
+    ]
+    save_to_cache(
+        _batch_set_key(sets[2], "human", None, None, None, "openai", "gpt-4o"),
+        {"1": "Monocytes"},
+        str(tmp_path),
+    )
+
+    plan = plan_batch_run(sets, "human", provider="openai", model="gpt-4o", cache_dir=str(tmp_path))
+
+    assert plan["totals"]["requests"] == 2
+    assert plan["totals"]["cache_hits"] == 1
+    batch = next(request for request in plan["requests"] if not request["cached"])
+    assert batch["clusters"] == 2
+    assert batch["cost"] > 0
+
+    deduplicated = plan_batch_run(
+        sets, "human", provider="openai", model="gpt-4o", use_cache=False, deduplicate_clusters=True
+    )
+    assert deduplicated["by_stage"]["annotation"]["requests"] == 1
+
+    with pytest.raises(ValueError, match="tissues"):
+        plan_batch_run(sets, "human", tissue=["blood"])
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
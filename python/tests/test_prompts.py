@@ -8,11 +8,14 @@ Tests for prompt generation functionality in mLLMCelltype.
 import pytest
 
 from mllmcelltype.prompts import (
+    create_batch_consensus_check_prompt,
+    create_batch_discussion_prompt,
     create_batch_prompt,
     create_consensus_check_prompt,
     create_discussion_prompt,
     create_json_prompt,
     create_prompt,
+    split_cacheable_prefix,
 )
 
 
@@ -131,6 +134,79 @@ Marker genes: {markers}"""
         assert "NK cells" in prompt
         assert "consensus" in prompt.lower()
 
+    def test_create_batch_consensus_check_prompt(self):
+        """Test batched consensus check prompt creation."""
+        prompt = create_batch_consensus_check_prompt(
+            {"1": ["T cells", "T lymphocytes"], "2": ["B cells", "Plasma cells"]}
+        )
+
+        # Check that every cluster and its annotations are included
+        assert isinstance(prompt, str)
+        assert "Cluster 1:\n- T cells\n- T lymphocytes" in prompt
+        assert "Cluster 2:\n- B cells\n- Plasma cells" in prompt
+        assert '"clusters"' in prompt
+        assert "consensus_proportion" in prompt
+
+    def test_create_batch_discussion_prompt(self):
+        """Test batched discussion prompt creation."""
+        prompt = create_batch_discussion_prompt(
+            marker_genes={"1": ["CD3D", "CD3E"], "2": ["MZB1", "JCHAIN"]},
+            model_votes={
+                "1": {"model1": "T cells", "model2": "NK cells"},
+                "2": {"model1": "B cells", "model2": "Plasma cells"},
+            },
+            species="human",
+            tissue="blood",
+            previous_discussion={"2": "proposed Plasma cells"},
+        )
+
+        # Shared framing appears once, per-cluster data once per cluster
+        assert prompt.count("Species: human") == 1
+        assert "Cluster 1:\nMarker genes: CD3D, CD3E" in prompt
+        assert "- model2: Plasma cells" in prompt
+        assert "Previous round: proposed Plasma cells" in prompt
+        assert '"reasoning"' in prompt
+
+    def test_split_cacheable_prefix(self):
+        """Test that prompts for different inputs share a static instruction prefix."""
+        blood = create_prompt(self.marker_genes, species="human", tissue="blood")
+        brain = create_prompt({"5": ["GFAP"]}, species="mouse", tissue="brain")
+
+        # Too short for providers to cache
+        assert split_cacheable_prefix(blood) == ("", blood)
+
+        blood_prefix, blood_suffix = split_cacheable_prefix(blood, min_tokens=0)
+        brain_prefix, brain_suffix = split_cacheable_prefix(brain, min_tokens=0)
+        assert blood_prefix
+        assert blood_prefix == brain_prefix
+        assert blood_prefix + blood_suffix == blood
+        assert "human" not in blood_prefix
+        assert "CD3D" in blood_suffix
+
+        json_prefix, _ = split_cacheable_prefix(
+            create_json_prompt(self.marker_genes, "human"), min_tokens=0
+        )
+        assert '"annotations"' in json_prefix
+
+        assert split_cacheable_prefix("A custom prompt", min_tokens=0) == ("", "A custom prompt")
+
+    def test_split_cacheable_prefix_discussion_rounds(self):
+        """Test that every round of a discussion reuses the prefix with the cluster's data."""
+        markers = [f"GENE{i}" for i in range(600)]
+        votes = {"model1": "T cells", "model2": "NK cells"}
+        first = create_discussion_prompt("1", markers, votes, "human", "blood")
+        second = create_discussion_prompt(
+            "1", markers, votes, "human", "blood", previous_discussion="Round 1: T cells"
+        )
+
+        first_prefix, first_suffix = split_cacheable_prefix(first)
+        second_prefix, second_suffix = split_cacheable_prefix(second)
+        assert first_prefix == second_prefix
+        assert "GENE599" in first_prefix
+        assert "- model2: NK cells" in first_prefix
+        assert not first_suffix.strip()
+        assert second_suffix.startswith("\n\nPrevious discussion round:\nRound 1: T cells")
+
 
 if __name__ == "__main__":
     pytest.main(["-xvs", __file__])
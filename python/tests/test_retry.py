@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the unified retry policy in mLLMCelltype.
+"""
+
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from mllmcelltype.annotate import _call_provider
+from mllmcelltype.providers.openai import process_openai
+from mllmcelltype.retry import (
+    CancellationToken,
+    DeadlineExceeded,
+    RetryPolicy,
+    call_with_retry,
+    configure_retry,
+    get_retry_budget,
+    parse_retry_after,
+)
+
+
+def _response(status_code, headers=None, body=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content = (body or '{"error": {"message": "failed"}}').encode()
+    return response
+
+
+def test_parse_retry_after():
+    """Test reading wait times from Retry-After and rate-limit reset headers."""
+    assert parse_retry_after({"Retry-After": "2"}) == 2.0
+    assert parse_retry_after({"retry-after-ms": "250"}) == 0.25
+    assert parse_retry_after({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}) == 0.0
+    assert parse_retry_after({"x-ratelimit-reset-tokens": "1m30s"}, 429) == 90.0
+    assert parse_retry_after({"x-ratelimit-reset-requests": "20ms"}, 429) == 0.02
+    # Reset headers are sent with every response and only matter when rate limited
+    assert parse_retry_after({"x-ratelimit-reset-tokens": "1m30s"}, 500) is None
+    assert parse_retry_after({}) is None
+
+
+@patch("mllmcelltype.retry.time.sleep")
+def test_call_with_retry(mock_sleep):
+    """Test retrying transient errors only, honoring the server's wait time."""
+    rate_limited = requests.HTTPError(response=_response(429, {"Retry-After": "3"}))
+    func = MagicMock(side_effect=[rate_limited, requests.ConnectionError(), "ok"])
+
+    assert call_with_retry(func, "test") == "ok"
+    assert func.call_count == 3
+    assert mock_sleep.call_args_list[0].args[0] == 3.0
+    # Full-jitter backoff stays below the exponential cap
+    assert 0 <= mock_sleep.call_args_list[1].args[0] <= 2.0
+
+    bad_request = requests.HTTPError(response=_response(400))
+    func = MagicMock(side_effect=bad_request)
+    with pytest.raises(requests.HTTPError):
+        call_with_retry(func, "test")
+    assert func.call_count == 1
+
+
+@patch("mllmcelltype.retry.time.sleep")
+def test_retry_budget_and_deadline(mock_sleep):
+    """Test that the run-level budget and the per-call deadline stop retries."""
+    configure_retry(RetryPolicy(max_attempts=5, retry_budget=2))
+    func = MagicMock(side_effect=requests.Timeout())
+    with pytest.raises(requests.Timeout):
+        call_with_retry(func, "test")
+    assert func.call_count == 3
+    assert get_retry_budget().used == 2
+
+    mock_sleep.reset_mock()
+    configure_retry(RetryPolicy(max_attempts=5, deadline=10.0))
+    rate_limited = requests.HTTPError(response=_response(429, {"Retry-After": "30"}))
+    func = MagicMock(side_effect=rate_limited)
+    with pytest.raises(requests.HTTPError):
+        call_with_retry(func, "test")
+    assert func.call_count == 1
+    mock_sleep.assert_not_called()
+
+
+@patch("mllmcelltype.retry.time.sleep")
+@patch("mllmcelltype.providers.openai.requests.post")
+def test_provider_retried_once_by_provider_layer(mock_post, mock_sleep):
+    """Test that providers make one attempt and the provider layer retries them."""
+    success = _response(200, body='{"choices": [{"message": {"content": "T cells\\nB cells"}}]}')
+    mock_post.side_effect = [_response(503, {"Retry-After": "1"}), success]
+
+    result = _call_provider(process_openai, "prompt", "openai", "gpt-4o", "key")
+
+    assert result == ["T cells", "B cells"]
+    assert mock_post.call_count == 2
+    mock_sleep.assert_called_once_with(1.0)
+
+
+def test_cancellation_token_abandons_call():
+    """Test that a pending call is abandoned at the deadline and later calls fail fast."""
+    token = CancellationToken(timeout=0.1)
+
+    def slow_provider(prompt, model, api_key):
+        time.sleep(1)
+        return ["too late"]
+
+    start_time = time.time()
+    with pytest.raises(DeadlineExceeded):
+        _call_provider(slow_provider, "prompt", "openai", "gpt-4o", "key", cancel_token=token)
+    assert time.time() - start_time < 0.5
+
+    token = CancellationToken()
+    token.cancel()
+    with pytest.raises(DeadlineExceeded):
+        _call_provider(slow_provider, "prompt", "openai", "gpt-4o", "key", cancel_token=token)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for latency- and health-aware model routing in mLLMCelltype.
+"""
+
+import time
+from unittest.mock import patch
+
+import pytest
+
+from mllmcelltype.annotate import _call_provider, annotate_clusters, get_model_response
+from mllmcelltype.consensus import _request_consensus_check
+from mllmcelltype.retry import CancellationToken, DeadlineExceeded
+from mllmcelltype.router import (
+    CircuitBreaker,
+    CircuitOpenError,
+    HedgingPolicy,
+    ProviderStats,
+    RoutingConstraints,
+    configure_router,
+    get_circuit_breaker,
+    rank_models,
+    record_prompt_usage,
+    summarize_prompt_cache,
+)
+
+
+def test_provider_stats_summary_and_persistence(tmp_path):
+    """Test latency percentiles, error rate and saving to disk."""
+    path = str(tmp_path / "stats.json")
+    stats = ProviderStats(path, save_every=1)
+    for latency in [1.0, 2.0, 3.0, 4.0]:
+        stats.record("openai", "gpt-4o", latency, True, output_tokens=100)
+    stats.record("openai", "gpt-4o", 30.0, False)
+
+    summary = stats.summary("openai", "gpt-4o")
+    assert summary["calls"] == 5
+    assert summary["error_rate"] == 0.2
+    assert summary["p50"] == 2.0
+    assert summary["p95"] == 4.0
+    assert summary["tokens_per_second"] == 40.0
+
+    reloaded = ProviderStats(path)
+    assert reloaded.summary("openai", "gpt-4o") == summary
+
+
+def test_provider_stats_decode_rate():
+    """Test that the decode rate leaves out the fixed overhead of each request."""
+    stats = ProviderStats()
+    for output_tokens in [10, 20, 400, 800, 1200]:
+        stats.record("openai", "gpt-4o", 2.0 + output_tokens / 100, True, output_tokens)
+
+    summary = stats.summary("openai", "gpt-4o")
+    assert summary["decode_tokens_per_second"] == pytest.approx(100.0)
+    assert summary["request_overhead"] == pytest.approx(2.0)
+    assert summary["tokens_per_second"] < summary["decode_tokens_per_second"]
+
+    # Short answers alone say nothing about the decode rate
+    short = ProviderStats()
+    for _ in range(5):
+        short.record("openai", "gpt-4o", 2.0, True, 10)
+    assert short.summary("openai", "gpt-4o")["decode_tokens_per_second"] is None
+
+
+def test_record_prompt_usage(isolated_provider_stats):
+    """Test that cached token counts are read from the usage fields of each provider."""
+    record_prompt_usage(
+        "openai",
+        "gpt-4o",
+        {"prompt_tokens": 1200, "prompt_tokens_details": {"cached_tokens": 1024}},
+    )
+    before = isolated_provider_stats.prompt_usage()
+    record_prompt_usage(
+        "deepseek", "deepseek-chat", {"prompt_tokens": 900, "prompt_cache_hit_tokens": 640}
+    )
+    record_prompt_usage(
+        "anthropic",
+        "claude-3-5-sonnet",
+        {"input_tokens": 50, "cache_read_input_tokens": 1500, "cache_creation_input_tokens": 0},
+    )
+    record_prompt_usage("gemini", "gemini-2.0-flash", None)
+
+    assert isolated_provider_stats.summary("openai", "gpt-4o")["cached_tokens"] == 1024
+    assert (
+        isolated_provider_stats.summary("anthropic", "claude-3-5-sonnet")["prompt_tokens"] == 1550
+    )
+
+    report = summarize_prompt_cache(since=before)
+    assert report["prompt_tokens"] == 2450
+    assert report["cached_tokens"] == 2140
+    assert set(report["models"]) == {"deepseek/deepseek-chat", "anthropic/claude-3-5-sonnet"}
+
+
+def test_rank_models():
+    """Test that healthy measured models are ranked by latency and others skipped."""
+    stats = ProviderStats()
+    candidates = [
+        ("qwen", "qwen-max"),
+        ("anthropic", "claude"),
+        ("openai", "gpt-4o"),
+        ("gemini", "gemini-pro"),
+    ]
+    for _ in range(3):
+        stats.record("qwen", "qwen-max", 9.0, True)
+        stats.record("anthropic", "claude", 2.0, True)
+        stats.record("openai", "gpt-4o", 1.0, False)
+
+    # gpt-4o is failing, gemini-pro has no statistics yet
+    ranked = rank_models(candidates, stats=stats)
+    assert ranked == [("anthropic", "claude"), ("qwen", "qwen-max"), ("gemini", "gemini-pro")]
+
+    constrained = rank_models(
+        candidates,
+        RoutingConstraints(max_latency=5.0, excluded_models=["gemini-pro"]),
+        stats=stats,
+    )
+    assert constrained == [("anthropic", "claude")]
+
+
+def test_rank_models_retries_excluded_model_after_max_age():
+    """Test that a failing model is ranked again once its outcomes expire."""
+    stats = ProviderStats(max_age=60.0)
+    with patch("mllmcelltype.router.time.time", return_value=1000.0):
+        for _ in range(3):
+            stats.record("openai", "gpt-4o", 1.0, False)
+        assert rank_models([("openai", "gpt-4o")], stats=stats) == []
+
+    with patch("mllmcelltype.router.time.time", return_value=1061.0):
+        assert stats.summary("openai", "gpt-4o")["calls"] == 0
+        assert rank_models([("openai", "gpt-4o")], stats=stats) == [("openai", "gpt-4o")]
+
+
+@patch("mllmcelltype.annotate.get_model_response")
+def test_consensus_check_uses_router(mock_get_model_response, isolated_provider_stats):
+    """Test that the consensus check avoids a slow model once it has been measured."""
+    for _ in range(3):
+        isolated_provider_stats.record("qwen", "qwen-max-2025-01-25", 40.0, True)
+        isolated_provider_stats.record("anthropic", "claude-3-5-sonnet-latest", 3.0, True)
+    mock_get_model_response.return_value = "1\n1.0\n0.0\nT cells"
+
+    response = _request_consensus_check("prompt", {"qwen": "key1", "anthropic": "key2"})
+
+    assert response == "1\n1.0\n0.0\nT cells"
+    assert mock_get_model_response.call_args.kwargs["provider"] == "anthropic"
+
+
+def test_hedged_request(isolated_provider_stats):
+    """Test that a slow request is hedged to the backup model and the hedge wins."""
+    for _ in range(3):
+        isolated_provider_stats.record("openai", "gpt-4o", 0.05, True)
+
+    def slow_provider(prompt, model, api_key):
+        time.sleep(0.5)
+        return ["slow"]
+
+    def fast_provider(prompt, model, api_key):
+        return ["fast"]
+
+    policy = HedgingPolicy(min_delay=0.0, backups={"openai/gpt-4o": ("anthropic", "claude")})
+    with patch.dict("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {"anthropic": fast_provider}):
+        with patch("mllmcelltype.annotate.load_api_key", return_value="key2"):
+            result = _call_provider(slow_provider, "prompt", "openai", "gpt-4o", "key1", policy)
+
+    assert result == ["fast"]
+    summary = isolated_provider_stats.summary("openai", "gpt-4o")
+    assert summary["hedges"] == 1
+    assert summary["hedge_wins"] == 1
+
+    # A request that finishes before the hedge delay is not hedged
+    result = _call_provider(fast_provider, "prompt", "openai", "gpt-4o", "key1", policy)
+    assert result == ["fast"]
+    assert isolated_provider_stats.summary("openai", "gpt-4o")["hedges"] == 1
+
+
+def test_configured_hedging_sends_one_hedge(isolated_provider_stats):
+    """Test that a policy set with configure_router hedges once instead of recursing."""
+    calls = []
+
+    def slow_provider(prompt, model, api_key):
+        calls.append(model)
+        time.sleep(0.2)
+        return ["slow"]
+
+    configure_router(hedging=HedgingPolicy(min_delay=0.05))
+    with patch.dict("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {"openai": slow_provider}):
+        response = get_model_response("prompt", "openai", "gpt-4o", "key1", use_cache=False)
+
+    assert response == "slow"
+    assert calls == ["gpt-4o", "gpt-4o"]
+    assert isolated_provider_stats.summary("openai", "gpt-4o")["hedges"] == 1
+
+
+def test_circuit_breaker_states():
+    """Test that the breaker opens, refuses calls, and closes after a good probe."""
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # Only one probe is let through while half-open
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_deadline_releases_half_open_probe():
+    """Test that a probe cut short by the deadline lets the next call probe again."""
+
+    def failing_provider(prompt, model, api_key):
+        raise ValueError("service unavailable")
+
+    def slow_provider(prompt, model, api_key):
+        time.sleep(0.2)
+        return ["slow"]
+
+    configure_router(reset_timeout=0.05)
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            _call_provider(failing_provider, "prompt", "openai", "gpt-4o", "key1")
+    breaker = get_circuit_breaker("openai", "gpt-4o")
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    with pytest.raises(DeadlineExceeded):
+        _call_provider(
+            slow_provider,
+            "prompt",
+            "openai",
+            "gpt-4o",
+            "key1",
+            cancel_token=CancellationToken(timeout=0.05),
+        )
+    assert breaker.state == "open"
+    assert breaker.allow()
+
+
+def test_annotate_clusters_fails_over_when_circuit_open(sample_marker_genes_dict):
+    """Test that an open circuit fails fast and annotate_clusters uses the fallback."""
+    calls = []
+
+    def failing_provider(prompt, model, api_key):
+        calls.append(model)
+        raise ValueError("service unavailable")
+
+    def fallback_provider(prompt, model, api_key):
+        return ["Cluster 1: T cells", "Cluster 2: B cells"]
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            _call_provider(failing_provider, "prompt", "openai", "gpt-4o", "key1")
+    assert get_circuit_breaker("openai", "gpt-4o").state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        _call_provider(failing_provider, "prompt", "openai", "gpt-4o", "key1")
+    assert len(calls) == 3
+
+    with patch.dict(
+        "mllmcelltype.annotate.PROVIDER_FUNCTIONS",
+        {"openai": failing_provider, "anthropic": fallback_provider},
+    ):
+        annotations = annotate_clusters(
+            sample_marker_genes_dict,
+            species="human",
+            provider="openai",
+            model="gpt-4o",
+            api_key="key1",
+            use_cache=False,
+            fallback_model="claude-3-5-sonnet-latest",
+            fallback_api_key="key2",
+        )
+
+    assert len(calls) == 3
+    assert annotations == {"1": "T cells", "2": "B cells"}
+    assert ("openai", "gpt-4o") not in rank_models([("openai", "gpt-4o")])
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the tracing spans in mLLMCelltype.
+"""
+
+import json
+from unittest.mock import patch
+
+import pytest
+
+from mllmcelltype.consensus import interactive_consensus_annotation
+from mllmcelltype.tracing import NOOP_SPAN, Tracer, get_tracer, start_span, tracing
+
+MARKER_GENES = {"1": ["CD3D", "CD3E"], "2": ["MS4A1", "CD79A"]}
+
+
+def mock_provider(prompt, model, api_key):
+    """Answer annotation, discussion and consensus check prompts; the models disagree on 2."""
+    if "resolving disagreements" in prompt:
+        return ["After reviewing the markers.", "Final cell type determination: B cells"]
+    if prompt.startswith("You are an expert in single-cell RNA-seq analysis, evaluating"):
+        return ["1", "1.0", "0.0", "B cells"]
+    answers = {"1": "T cells", "2": "B cells" if model == "model_a" else "Macrophages"}
+    return [
+        f"Cluster {cluster_id}: {answers[cluster_id]}"
+        for cluster_id, genes in MARKER_GENES.items()
+        if genes[0] in prompt
+    ]
+
+
+def test_start_span_without_tracer():
+    """Test that spans are no-ops while tracing is off."""
+    assert get_tracer() is None
+    span = start_span("annotation", model="gpt-4o")
+    assert span is NOOP_SPAN
+    with span:
+        span.set_attribute("clusters", 3)
+    span.end()
+
+
+@pytest.mark.parametrize("max_in_flight", [None, 2])
+def test_interactive_consensus_annotation_traces_stages(tmp_path, max_in_flight):
+    """Test that a consensus run is traced from stages down to HTTP requests."""
+    path = tmp_path / "trace.json"
+
+    with patch.dict("mllmcelltype.annotate.PROVIDER_FUNCTIONS", {"openai": mock_provider}):
+        with patch("mllmcelltype.utils.load_api_key", return_value=None):
+            with tracing(str(path)) as tracer:
+                result = interactive_consensus_annotation(
+                    marker_genes=MARKER_GENES,
+                    species="human",
+                    models=[
+                        {"provider": "openai", "model": "model_a"},
+                        {"provider": "openai", "model": "model_b"},
+                    ],
+                    api_keys={"openai": "test-key"},
+                    max_discussion_rounds=2,
+                    use_cache=False,
+                    max_in_flight=max_in_flight,
+                )
+    assert get_tracer() is None
+
+    assert result["controversial_clusters"] == ["2"]
+    timings = result["metadata"]["timings"]
+    assert set(timings) == {"annotation", "consensus_check", "discussion"}
+    assert all(seconds >= 0 for seconds in timings.values())
+
+    spans = json.loads(path.read_text())["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert len(spans) == len(tracer.spans())
+    assert len({span["traceId"] for span in spans}) == 1
+    by_id = {span["spanId"]: span for span in spans}
+
+    def ancestors(span):
+        names = []
+        while span["parentSpanId"]:
+            span = by_id[span["parentSpanId"]]
+            names.append(span["name"])
+        return names
+
+    annotation_requests = [
+        span
+        for span in spans
+        if span["name"] == "http.request" and "annotation.model" in ancestors(span)
+    ]
+    assert len(annotation_requests) == 2
+    assert ancestors(annotation_requests[0]) == [
+        "annotation.model",
+        "annotation",
+        "interactive_consensus_annotation",
+    ]
+
+    discussion_requests = [
+        span for span in spans if span["name"] == "http.request" and "discussion" in ancestors(span)
+    ]
+    assert discussion_requests
+    assert all(
+        ancestors(span)[:3] == ["discussion.round", "discussion.cluster", "discussion"]
+        for span in discussion_requests
+    )
+
+    breakdown = tracer.breakdown()
+    assert breakdown["discussion.cluster"]["count"] == 1
+    assert breakdown["annotation.model"]["count"] == 2
+    assert (
+        "interactive_consensus_annotation;discussion;discussion.cluster;discussion.round;"
+        "http.request" in tracer.folded_stacks()
+    )
+
+
+def test_tracer_export_marks_errors(tmp_path):
+    """Test that failed spans carry an error status in the OTLP export."""
+    tracer = Tracer()
+    with tracing(tracer=tracer):
+        with pytest.raises(ValueError):
+            with start_span("stage", clusters=2):
+                raise ValueError("bad response")
+
+    path = tmp_path / "trace.json"
+    assert tracer.export(str(path)) == 1
+    span = json.loads(path.read_text())["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert span["status"] == {"code": 2, "message": "ValueError: bad response"}
+    assert span["attributes"] == [{"key": "clusters", "value": {"intValue": "2"}}]
+    assert int(span["endTimeUnixNano"]) >= int(span["startTimeUnixNano"])
+
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])